@@ -0,0 +1,172 @@
+#!/usr/bin/python3
+"""PYroMat Gateway Interface - admission control
+
+The cost of every request is estimated in approximate seconds of CPU 
+time before it is processed (see pmgi.PMGIRequest.estimate() and 
+state_cost()).  Requests that cost too much are rejected, expensive 
+requests wait for a slot in the cost_queue, and each client may only 
+spend so much per second (see rate_limiter).  The limits are set in 
+config.
+"""
+
+import contextlib
+import threading
+import time
+
+from settings import config
+
+
+# The approximate cost of every request in seconds
+request_cost = 0.001
+# The approximate cost of evaluating a single state in seconds for each
+# kind of state() arguments (see state_kind()).  Multi-phase substances
+# must iterate to find the density at a given pressure, and all
+# substances must iterate to invert h, e, or s.
+state_costs = {
+    'ig': {
+        'direct': 1e-6,
+        'pressure': 1e-6,
+        'quality': 1e-6,
+        'inverse': 5e-6,
+    },
+    'mp': {
+        'direct': 3e-6,
+        'pressure': 30e-6,
+        'quality': 5e-6,
+        'inverse': 400e-6,
+    },
+}
+# The cost of evaluating a single saturation state
+saturation_cost = 30e-6
+
+
+def state_kind(names):
+    """Classify a set of state() arguments by their difficulty
+    kind = state_kind(names)
+
+NAMES is an iterable of the names of the state() arguments.  Returns
+'inverse' if h, e, or s must be inverted, 'quality' if x is specified,
+'pressure' if the density must be found from the pressure, and 'direct'
+otherwise (e.g. T and d).  Missing T and p arguments default as they do
+in state().
+"""
+    names = set(names)
+    if names & {'h', 'e', 's'}:
+        return 'inverse'
+    elif 'x' in names:
+        return 'quality'
+    elif names & {'d', 'v'} and 'p' not in names:
+        return 'direct'
+    return 'pressure'
+
+
+def state_cost(subst, names, size):
+    """Estimate the cost of a state() evaluation in seconds
+    cost = state_cost(subst, names, size)
+
+SUBST is the PYroMat substance instance, NAMES are the names of the
+state() arguments, and SIZE is the number of states.
+"""
+    costs = state_costs['ig' if subst.pmclass().startswith('ig') else 'mp']
+    return size * costs[state_kind(names)]
+
+
+class RateLimiter:
+    """Token buckets that limit the cost spent by each client
+    wait = rate_limiter.take(client, cost)
+
+Each client's bucket holds up to config['rate_burst'] seconds of
+estimated cost, and it is refilled at config['rate_limit'] seconds per
+second.  take() removes COST from the CLIENT's bucket and returns 0.  If
+the bucket does not hold enough, nothing is removed, and the number of
+seconds until it will is returned instead.  A request that costs more
+than the burst is admitted from a full bucket, which leaves the bucket
+in debt.
+
+Buckets that have refilled are forgotten, so the number of clients that
+are tracked is limited to those that were recently active.
+"""
+    # The number of buckets that triggers a search for full buckets
+    max_buckets = 4096
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # {client: (tokens, time)}
+        self._buckets = {}
+        self.limited = 0
+
+    def take(self, client, cost):
+        rate = config['rate_limit']
+        if rate is None:
+            return 0.
+        burst = config['rate_burst']
+        now = time.monotonic()
+        need = min(cost, burst)
+        with self._lock:
+            tokens, stamp = self._buckets.get(client, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens < need:
+                self.limited += 1
+                return (need - tokens) / rate
+            self._buckets[client] = (tokens - cost, now)
+            if len(self._buckets) > self.max_buckets:
+                for client, (tokens, stamp) in list(self._buckets.items()):
+                    if tokens + (now - stamp) * rate >= burst:
+                        del self._buckets[client]
+        return 0.
+
+    def stats(self):
+        """Return a dict of rate limiter statistics
+    stats = rate_limiter.stats()
+"""
+        with self._lock:
+            return {'clients': len(self._buckets), 'limited': self.limited}
+
+
+class CostQueue:
+    """Limit the number of expensive requests processed at once
+    with cost_queue.slot(cost) as admitted:
+        ...
+
+Requests that cost more than config['cost_queue'] seconds must hold one
+of config['cost_slots'] slots while they are processed.  ADMITTED is
+True once a slot is held (or if none is needed), and False if no slot
+became available within config['cost_timeout'] seconds.
+"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._slots = None
+        self.waiting = 0
+        self.timeouts = 0
+
+    @contextlib.contextmanager
+    def slot(self, cost):
+        threshold = config['cost_queue']
+        if threshold is None or cost <= threshold:
+            yield True
+            return
+        with self._lock:
+            if self._slots is None:
+                self._slots = threading.BoundedSemaphore(config['cost_slots'])
+            self.waiting += 1
+        acquired = self._slots.acquire(timeout=config['cost_timeout'])
+        with self._lock:
+            self.waiting -= 1
+            if not acquired:
+                self.timeouts += 1
+        try:
+            yield acquired
+        finally:
+            if acquired:
+                self._slots.release()
+
+    def stats(self):
+        """Return a dict of queue statistics
+    stats = cost_queue.stats()
+"""
+        with self._lock:
+            return {'waiting': self.waiting, 'timeouts': self.timeouts}
+
+
+rate_limiter = RateLimiter()
+cost_queue = CostQueue()
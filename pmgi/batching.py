@@ -0,0 +1,163 @@
+#!/usr/bin/python3
+"""PYroMat Gateway Interface - micro-batching
+
+Concurrent state requests for the same substance, input properties, and
+output properties may be combined into a single vectorized evaluation 
+(see StateBatcher).  The arguments of the requests are concatenated by
+concatenate_args(), and the combined result is split again by 
+split_result().
+"""
+
+import collections
+import threading
+
+import numpy as np
+
+from settings import config
+
+
+def concatenate_args(items):
+    """Concatenate several sets of state() arguments into one
+    args, shapes = concatenate_args(items)
+
+ITEMS is a list of argument dicts that all have the same keys.  The
+values in each dict are broadcast against each other and flattened, then
+the values for each key are concatenated.  SHAPES is a list of the 
+broadcast shape of each item, which is needed by split_result() to
+recover the individual results.
+"""
+    names = list(items[0].keys())
+    shapes = []
+    columns = {name:[] for name in names}
+    for item in items:
+        values = np.broadcast_arrays(*[
+                np.asarray(item[name], dtype=float) for name in names])
+        shapes.append(values[0].shape)
+        for name, value in zip(names, values):
+            columns[name].append(value.ravel())
+    args = {name:np.concatenate(columns[name]) for name in names}
+    return args, shapes
+
+
+def split_result(result, shapes):
+    """Split a result computed from concatenate_args() arguments
+    results = split_result(result, shapes)
+
+RESULT is a dict of arrays returned by state().  SHAPES is the list
+returned by concatenate_args().  Returns a list of result dicts, one for 
+each shape.  The arrays are views into the original result.
+"""
+    sizes = [int(np.prod(shape)) for shape in shapes]
+    offsets = np.cumsum(sizes)[:-1]
+    results = [{} for shape in shapes]
+    for name, value in result.items():
+        for index, part in enumerate(np.split(value, offsets)):
+            shape = shapes[index]
+            # PYroMat always returns at least one dimension
+            results[index][name] = part.reshape(shape if shape else (1,))
+    return results
+
+
+class StateBatcher:
+    """Combine concurrent state() evaluations into one vectorized call
+    sb = StateBatcher(evaluate_states)
+    result = sb.evaluate(subst, args, props=None)
+
+EVALUATE_STATES(subst, items, props) evaluates a list of state() 
+argument dicts that all have the same keys, and returns a list with the
+result dict of each, or the exception it raised (see 
+pmgi.evaluate_states()).  The evaluate() method is equivalent to 
+evaluating [args] alone, but when several threads call evaluate() at 
+the same time for the same substance with the same argument names (e.g.
+T and p) and the same PROPS, their arguments are evaluated together in
+a single call.  The results are returned to each of the waiting 
+threads.
+
+The first thread to arrive opens a batch and waits up to 
+config['batch_window'] seconds for other threads to join it.  The batch
+is closed early if it reaches config['batch_max'] requests.  The first
+thread then evaluates the batch on behalf of all of them.  If the 
+evaluation raises an exception, it is raised in every thread.
+
+Out-of-bounds elements in a batch produce NaN values like they would in
+any array passed to state().  Since EVALUATE_STATES returns the error of
+each request separately, a bad request cannot cause the others to fail.
+
+Statistics on the batches are reported by the stats() method.
+"""
+    class _Batch:
+        def __init__(self):
+            self.items = []
+            self.full = threading.Event()
+            self.done = threading.Event()
+            self.results = None
+
+    def __init__(self, evaluate_states):
+        self.evaluate_states = evaluate_states
+        self._lock = threading.Lock()
+        self._open = {}
+        self.batches = 0
+        self.requests = 0
+        self.largest = 0
+        # Number of batches by size: 1, 2-3, 4-7, 8-15, ...
+        self.histogram = collections.Counter()
+
+    def evaluate(self, subst, args, props=None):
+        """Evaluate a state, possibly combined with other requests
+    result = sb.evaluate(subst, args, props=None)
+"""
+        key = (subst.data['id'], tuple(sorted(args.keys())), 
+                None if props is None else tuple(props))
+        with self._lock:
+            batch = self._open.get(key)
+            leader = batch is None
+            if leader:
+                batch = self._open[key] = StateBatcher._Batch()
+            index = len(batch.items)
+            batch.items.append(args)
+            if len(batch.items) >= config['batch_max']:
+                del self._open[key]
+                batch.full.set()
+
+        if leader:
+            batch.full.wait(config['batch_window'])
+            with self._lock:
+                if self._open.get(key) is batch:
+                    del self._open[key]
+                size = len(batch.items)
+                self.batches += 1
+                self.requests += size
+                self.largest = max(self.largest, size)
+                self.histogram[1 << (size.bit_length() - 1)] += 1
+            try:
+                batch.results = self.evaluate_states(subst, batch.items, props)
+            except BaseException as e:
+                # The followers see the leader's exception
+                batch.results = [e] * len(batch.items)
+                raise
+            finally:
+                batch.done.set()
+        else:
+            batch.done.wait()
+
+        result = batch.results[index]
+        if isinstance(result, BaseException):
+            raise result
+        return result
+
+    def stats(self):
+        """Return a dict of batching statistics
+    stats = sb.stats()
+
+The dict contains 'batches' (the number of evaluations), 'requests' (the
+number of requests served), 'mean' (the mean batch size), 'largest', and
+'histogram', a dict of the number of batches keyed by the smallest 
+power of two in each size range (1, 2-3, 4-7, ...).
+"""
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'mean': self.requests / self.batches if self.batches else 0.,
+                'largest': self.largest,
+                'histogram': {str(k):v for k,v in sorted(self.histogram.items())}}
@@ -0,0 +1,602 @@
+#!/usr/bin/python3
+"""PYroMat Gateway Interface - result cache
+
+Property evaluations are deterministic for a given substance and set of
+canonical arguments, so their results can be re-used.  The arrays in a
+cached result are marked read-only, and the cache hands out copies of 
+the dicts and lists that contain them, so callers may modify the 
+structure of a result but never its arrays.
+
+Results are stored by their cache key (see cache_key()) in a 
+ResultCache, or in a SharedResultCache to share them between the 
+processes on a host.  get_result_cache() returns the cache used by all
+requests in this process.  Identical computations that are requested 
+at the same time are only performed once (see SingleFlight).
+"""
+
+import collections
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sqlite3
+import threading
+import time
+try:
+    import fcntl
+except ImportError:
+    # File locking is not available on all platforms (e.g. Windows).
+    # Computations are then only coalesced within a process.
+    fcntl = None
+
+import numpy as np
+import pyromat as pm
+
+from settings import config, __version__
+
+
+def result_size(result):
+    """Estimate the memory occupied by a result in bytes
+    size = result_size(result)
+
+Numpy arrays are counted by their nbytes attribute.  Dicts and lists are
+searched recursively.  All other values are counted with a nominal 64
+bytes.
+"""
+    if isinstance(result, np.ndarray):
+        return result.nbytes + 64
+    elif isinstance(result, dict):
+        return 64 + sum(result_size(value) for value in result.values())
+    elif isinstance(result, (list, tuple)):
+        return 64 + sum(result_size(value) for value in result)
+    return 64
+
+
+def freeze_result(result):
+    """Mark all numpy arrays in a result read-only in place
+    freeze_result(result)
+"""
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, dict):
+        for value in result.values():
+            freeze_result(value)
+    elif isinstance(result, (list, tuple)):
+        for value in result:
+            freeze_result(value)
+
+
+def copy_result(result):
+    """Copy the dicts and lists of a result without copying its arrays
+    new = copy_result(result)
+"""
+    if isinstance(result, dict):
+        return {name:copy_result(value) for name,value in result.items()}
+    elif isinstance(result, list):
+        return [copy_result(value) for value in result]
+    return result
+
+
+# The version of the form of the cached results, which is part of the 
+# cache key.  It changes when the results change (e.g. when the status
+# arrays were added), so that old results in a shared cache are not used.
+result_format = 2
+
+def cache_key(route, idstr, args):
+    """Construct a cache key for a computation
+    key = cache_key(route, idstr, args)
+
+ROUTE is the name of the request route (e.g. 'state'), IDSTR is the
+substance id string, and ARGS is a dict of arguments in canonical units.
+Numpy arrays are hashed by their dtype, shape, and raw bytes, so the key
+is short regardless of the size of the arguments.  Returns a hex digest
+string.
+"""
+    h = hashlib.sha1()
+    # Results may outlive the process (see SharedResultCache), so the
+    # versions are part of the key.
+    h.update(repr((pm.config['version'], __version__, result_format)).encode())
+    h.update(repr((route, idstr)).encode())
+    for name in sorted(args):
+        value = args[name]
+        h.update(repr(name).encode())
+        if isinstance(value, np.ndarray):
+            h.update(repr((value.dtype.str, value.shape)).encode())
+            h.update(np.ascontiguousarray(value))
+        else:
+            h.update(repr(value).encode())
+    return h.hexdigest()
+
+
+class ResultCache:
+    """An in-process least-recently-used cache for computed results
+    rc = ResultCache(maxbytes=None)
+
+Results are stored by their cache key (see cache_key()) with an optional
+expiration time.  When the estimated memory used by the cached results 
+exceeds MAXBYTES, the least recently used results are discarded.  If
+MAXBYTES is None, config['cache_bytes'] is used.
+
+    rc.put(key, result, ttl=None)
+    result = rc.get(key)
+
+get() returns None if the key is not found or the result has expired.
+All methods are thread-safe.
+
+The cache keeps hit, miss, and eviction counters, which are reported by
+the stats() method.  Expired results are counted as misses, and the 
+results discarded to meet the memory budget are counted as evictions.
+"""
+    def __init__(self, maxbytes=None):
+        self.maxbytes = maxbytes
+        self._entries = collections.OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """Retrieve a result from the cache
+    result = rc.get(key)
+
+Returns None if the result is not found or has expired.
+"""
+        found = self._fetch(key)
+        with self._lock:
+            if found is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return copy_result(found[0])
+
+    def _fetch(self, key):
+        """Look up a result without updating the hit and miss counters
+    result, expires = rc._fetch(key)
+
+Returns None if the result is not found or has expired.
+"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            result, size, expires = entry
+            if expires is not None and expires < time.time():
+                self._discard(key)
+                return None
+            self._entries.move_to_end(key)
+        return result, expires
+
+    def put(self, key, result, ttl=None):
+        """Store a result in the cache
+    rc.put(key, result, ttl=None)
+
+TTL is the number of seconds the result remains valid.  If TTL is None,
+the result never expires.  The arrays in the result are marked read-
+only.  Results larger than the whole memory budget are not stored.
+"""
+        freeze_result(result)
+        expires = None if ttl is None else time.time() + ttl
+        self._store(key, result, expires)
+
+    def _store(self, key, result, expires):
+        """Store a frozen result with an absolute expiration time
+    rc._store(key, result, expires)
+"""
+        size = result_size(result)
+        maxbytes = self.maxbytes
+        if maxbytes is None:
+            maxbytes = config['cache_bytes']
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            if size > maxbytes:
+                return
+            self._entries[key] = (copy_result(result), size, expires)
+            self._bytes += size
+            while self._bytes > maxbytes:
+                self._discard(next(iter(self._entries)))
+                self.evictions += 1
+
+    def lock(self, key):
+        """Serialize the computation of a result between processes
+    with rc.lock(key) as waited:
+        ...
+
+Returns a context manager that holds a lock on KEY that is visible to 
+other processes that use the same cache.  The value is True if the lock
+was held by another process when it was requested, which means the 
+result was probably just added to the cache.  The in-process ResultCache
+is not visible to other processes, so the lock does nothing, and the 
+value is always False.
+"""
+        return contextlib.nullcontext(False)
+
+    def _discard(self, key):
+        # Remove an entry; the lock must already be held.
+        result, size, expires = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        """Discard all cached results
+    rc.clear()
+"""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        """Return a dict of cache statistics
+    stats = rc.stats()
+
+The dict contains 'hits', 'misses', 'evictions', 'entries', 'bytes', and
+'maxbytes'.
+"""
+        maxbytes = self.maxbytes
+        if maxbytes is None:
+            maxbytes = config['cache_bytes']
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'maxbytes': maxbytes}
+
+
+def pack_result(result):
+    """Serialize a result to bytes
+    data = pack_result(result)
+
+The result may be any combination of dicts, lists, numpy arrays, strings,
+numbers, booleans, and None.  The arrays are stored in the numpy .npz 
+format, and the structure that contains them is stored as JSON.  Unlike
+pickle, unpacking the data cannot execute code.
+"""
+    arrays = {}
+    def encode(value):
+        if isinstance(value, np.ndarray):
+            name = 'a%d'%len(arrays)
+            arrays[name] = value
+            return {'__array__':name}
+        elif isinstance(value, dict):
+            return {'__dict__':[[k, encode(v)] for k,v in value.items()]}
+        elif isinstance(value, (list, tuple)):
+            return [encode(v) for v in value]
+        elif isinstance(value, np.generic):
+            return value.item()
+        return value
+    structure = json.dumps(encode(result))
+    buf = io.BytesIO()
+    np.savez(buf, __structure__=np.array(structure), **arrays)
+    return buf.getvalue()
+
+
+def unpack_result(data):
+    """Reconstruct a result serialized by pack_result()
+    result = unpack_result(data)
+"""
+    with np.load(io.BytesIO(data), allow_pickle=False) as npz:
+        structure = json.loads(str(npz['__structure__']))
+        def decode(value):
+            if isinstance(value, dict):
+                if '__array__' in value:
+                    return npz[value['__array__']]
+                return {k:decode(v) for k,v in value['__dict__']}
+            elif isinstance(value, list):
+                return [decode(v) for v in value]
+            return value
+        return decode(structure)
+
+
+class SharedResultCache(ResultCache):
+    """A result cache shared by all processes on a host
+    src = SharedResultCache(filename, maxbytes=None, filebytes=None)
+
+The SharedResultCache stores results in an SQLite database file, so that
+every worker process that opens the same FILENAME reads and writes the
+same results.  Because the results are stored on disk, they also survive
+restarts.  Results are serialized with pack_result(), so the file never
+contains executable data.
+
+Each process also keeps its own in-memory ResultCache of the most
+recently used results (MAXBYTES, see ResultCache).  Lookups check memory
+first, then the file.  New results are written to both.
+
+The file is limited to FILEBYTES bytes of results.  If FILEBYTES is None,
+config['cache_file_bytes'] is used.  When the limit is exceeded, the 
+least recently used results are deleted.  To avoid writing to the file on 
+every read, the access time of a result is only updated when it is more 
+than a minute old, so the eviction order is approximate.
+
+Errors accessing the file (e.g. a busy or full disk) never cause a 
+request to fail.  The lookup is treated as a miss, the store is skipped, 
+and the error is counted in the stats.
+"""
+    # The number of the oldest results examined by each eviction step
+    evict_batch = 64
+
+    def __init__(self, filename, maxbytes=None, filebytes=None):
+        ResultCache.__init__(self, maxbytes)
+        self.filename = filename
+        self.filebytes = filebytes
+        self.file_hits = 0
+        self.errors = 0
+        # SQLite connections may not be shared between threads
+        self._local = threading.local()
+        try:
+            self._connect()
+        except sqlite3.Error:
+            self.errors += 1
+        # The lock files used by lock()
+        self.lockdir = filename + '.locks'
+        try:
+            os.makedirs(self.lockdir, exist_ok=True)
+        except OSError:
+            self.errors += 1
+
+    @contextlib.contextmanager
+    def lock(self, key):
+        """Serialize the computation of a result between processes
+    with src.lock(key) as waited:
+        ...
+
+The lock is an exclusive flock() on one of 4096 files in the directory
+FILENAME.locks, selected by the key.  Unrelated keys occasionally share a
+lock file, which only means that their computations are not done at 
+the same time.  The value is True if another process held the lock.
+
+If the lock cannot be obtained within config['flight_timeout'] seconds
+or file locking is not available, the body is executed without the lock.
+"""
+        if fcntl is None:
+            yield False
+            return
+        try:
+            fd = os.open(os.path.join(self.lockdir, key[:3]),
+                    os.O_RDWR | os.O_CREAT, 0o666)
+        except OSError:
+            with self._lock:
+                self.errors += 1
+            yield False
+            return
+        try:
+            waited = False
+            deadline = time.time() + config['flight_timeout']
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    waited = True
+                    if time.time() > deadline:
+                        break
+                    time.sleep(0.005)
+            yield waited
+        finally:
+            # Closing the file releases the lock
+            os.close(fd)
+
+    def _connect(self):
+        """Return this thread's connection to the database
+    conn = src._connect()
+"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.filename, timeout=10.)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS results ('
+                    'key TEXT PRIMARY KEY, value BLOB, size INTEGER, '
+                    'expires REAL, atime REAL)')
+            # The sizes are in the index, so that the total and the 
+            # eviction never read the results themselves
+            conn.execute('DROP INDEX IF EXISTS results_atime')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_atime_size '
+                    'ON results (atime, size)')
+            conn.commit()
+            self._local.conn = conn
+        return conn
+
+    def _fetch(self, key):
+        found = ResultCache._fetch(self, key)
+        if found is not None:
+            return found
+        now = time.time()
+        try:
+            conn = self._connect()
+            row = conn.execute('SELECT value, expires, atime FROM results '
+                    'WHERE key=?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, expires, atime = row
+            if expires is not None and expires < now:
+                with conn:
+                    conn.execute('DELETE FROM results WHERE key=?', (key,))
+                return None
+            if atime < now - 60.:
+                with conn:
+                    conn.execute('UPDATE results SET atime=? WHERE key=?',
+                            (now, key))
+            result = unpack_result(value)
+        except (sqlite3.Error, ValueError, OSError):
+            with self._lock:
+                self.errors += 1
+            return None
+        freeze_result(result)
+        ResultCache._store(self, key, result, expires)
+        with self._lock:
+            self.file_hits += 1
+        return result, expires
+
+    def _store(self, key, result, expires):
+        ResultCache._store(self, key, result, expires)
+        filebytes = self.filebytes
+        if filebytes is None:
+            filebytes = config['cache_file_bytes']
+        try:
+            value = pack_result(result)
+            if len(value) > filebytes:
+                return
+            conn = self._connect()
+            with conn:
+                conn.execute('INSERT OR REPLACE INTO results '
+                        '(key, value, size, expires, atime) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        (key, value, len(value), expires, time.time()))
+                total, = conn.execute(
+                        'SELECT COALESCE(SUM(size),0) FROM results').fetchone()
+                # Delete the least recently used results until the file
+                # is within its budget, looking at no more than 
+                # evict_batch of them at a time
+                while total > filebytes:
+                    count = 0
+                    for size, in conn.execute('SELECT size FROM results '
+                            'ORDER BY atime, size, rowid LIMIT ?', 
+                            (self.evict_batch,)):
+                        if total <= filebytes:
+                            break
+                        total -= size
+                        count += 1
+                    if not count:
+                        break
+                    conn.execute('DELETE FROM results WHERE rowid IN '
+                            '(SELECT rowid FROM results '
+                            'ORDER BY atime, size, rowid LIMIT ?)', (count,))
+                    with self._lock:
+                        self.evictions += count
+        except (sqlite3.Error, OSError):
+            with self._lock:
+                self.errors += 1
+
+    def clear(self):
+        ResultCache.clear(self)
+        try:
+            conn = self._connect()
+            with conn:
+                conn.execute('DELETE FROM results')
+        except sqlite3.Error:
+            with self._lock:
+                self.errors += 1
+
+    def stats(self):
+        """Return a dict of cache statistics
+    stats = src.stats()
+
+In addition to the ResultCache statistics, the dict contains 
+'file_hits' (the number of hits found in the file rather than memory), 
+'file_entries', 'file_bytes', 'file_maxbytes', and 'errors'.  The hits
+count includes the file hits, and the evictions count includes results
+deleted from the file.
+"""
+        out = ResultCache.stats(self)
+        filebytes = self.filebytes
+        if filebytes is None:
+            filebytes = config['cache_file_bytes']
+        try:
+            entries, size = self._connect().execute(
+                    'SELECT COUNT(*), COALESCE(SUM(size),0) FROM results'
+                    ).fetchone()
+        except sqlite3.Error:
+            entries, size = None, None
+        with self._lock:
+            out.update({
+                'file_hits': self.file_hits,
+                'file_entries': entries,
+                'file_bytes': size,
+                'file_maxbytes': filebytes,
+                'errors': self.errors})
+        return out
+
+
+class SingleFlight:
+    """Coalesce concurrent computations of the same result
+    sf = SingleFlight()
+    result = sf.do(key, compute)
+
+When do() is called with a KEY that is not already being computed, the
+calling thread becomes the leader; it calls COMPUTE (a function with no
+arguments) and returns its result.  Threads that call do() with the same
+key while the leader is working wait for the leader's result instead of
+calling COMPUTE themselves.  If the leader raises an exception, the
+waiting threads raise it too.
+
+Every caller receives its own copy of the result's dicts and lists (see
+copy_result()), but the arrays are shared, so the result should already
+be frozen (see freeze_result()).
+
+If the leader takes longer than config['flight_timeout'] seconds, the
+waiting threads give up and call COMPUTE themselves.  The number of calls
+that were answered by another thread's computation is kept in the 
+coalesced attribute.
+"""
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0
+
+    def do(self, key, compute):
+        """Compute a result or wait for the thread already computing it
+    result = sf.do(key, compute)
+"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = SingleFlight._Call()
+
+        if not leader:
+            if call.event.wait(config['flight_timeout']):
+                if call.error is not None:
+                    raise call.error
+                with self._lock:
+                    self.coalesced += 1
+                return copy_result(call.result)
+            # The leader is taking too long; do it ourselves.
+            return compute()
+
+        try:
+            call.result = compute()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+        return copy_result(call.result)
+
+# All cached computations in this process are coalesced by the same 
+# SingleFlight instance
+single_flight = SingleFlight()
+
+
+# The result cache is created on the first request, so that the WSGI 
+# script has a chance to change the configuration first.
+_result_cache = None
+_result_cache_lock = threading.Lock()
+
+def get_result_cache():
+    """Return the result cache used by all requests in this process
+    rc = get_result_cache()
+
+If config['cache_file'] is None, the result cache is an in-process 
+ResultCache.  Otherwise, it is a SharedResultCache that uses the file.
+"""
+    global _result_cache
+    if _result_cache is None:
+        with _result_cache_lock:
+            if _result_cache is None:
+                if config['cache_file'] is None:
+                    _result_cache = ResultCache()
+                else:
+                    _result_cache = SharedResultCache(config['cache_file'])
+    return _result_cache
@@ -20,9 +20,11 @@ of 'uT').  The remaining values in args will be used by process().
     rh.mh       # An initialized PMGIMessageHandler instance.
 
 (2) Process units
-Any units specified in the units dict are applied to the live PYroMat
-installation.  Any not specified are reset to their default values and
-recorded in the units dict, so all units will be reported every time.
+Any units not specified in the units dict are set to their default values
+and recorded in the units dict, so all units will be reported every time.
+PYroMat itself is always evaluated in canonical units, which are set 
+once when the module is imported (see use_canonical_units()), so 
+concurrent requests in separate threads do not interfere with each other.
 This is a separate step because it is not always necessary.  For example,
 informational calls have no need for units.
     
@@ -41,12 +43,14 @@ stored in the data member so they will be found by the output step.
 
 (4) Output
 The output() method assembles the contents of the data, units, args, and
-mh members into a JSON-friendly dict.  Output does NOT do additional 
-post-processing like eliminating NaN values.  If necessary, that must be
-handled in process().
+mh members into a dict.  Output does NOT do additional post-processing
+like eliminating NaN values.  If necessary, that must be handled in 
+process().  The response() method encodes the output as JSON, where 
+numpy arrays are written directly (see encode_json()).
 
     out = rh.output()
     # out now contains 'data', 'args', 'units', and 'message' entries
+    body, status, headers = rh.response()
 
 ** UNITS **
 In the initialization step, before the individual classes enforce their
@@ -80,6 +84,32 @@ Any units specifiers that are omitted will be loaded with their default
 values when process_units() is executed.  If process_units() is not 
 called, the unit arguments are still separated out of the args dict, but
 they are ignored.
+
+PYroMat is always evaluated in the canonical units (PYroMat's defaults,
+see canonical_units).  Once the substance is known, process() calls 
+compile_units() to obtain a set of per-property scale factors and offsets.
+They are used to convert the arguments into canonical units before they
+are evaluated, and output() uses them to convert the data into the 
+requested units in a single vectorized pass.  As a result, every unit 
+system shares the same evaluation, and the requested units never have 
+to be written to pm.config.
+
+** MODULES **
+The subsystems that are shared by every request live in modules of 
+their own, and their public names are imported into this one:
+
+    settings    The version and the gateway configuration (config)
+    cache       The result caches (ResultCache, SharedResultCache, 
+                get_result_cache(), cache_key()), and the coalescing of
+                identical computations (SingleFlight)
+    workspace   The arrays that are referenced by handle (store_array(),
+                fetch_array())
+    batching    The combination of concurrent state evaluations 
+                (StateBatcher, concatenate_args())
+    pool        The evaluation of large states on a process pool 
+                (evaluate_pooled(), iter_state_chunks())
+    admission   The cost estimates and the admission of expensive 
+                requests (state_cost(), RateLimiter, CostQueue)
 """
 
 import flask
@@ -87,8 +117,42 @@ import pyromat as pm
 import numpy as np
 from flask import Flask, request
 import sys
-
-__version__ = '0.1'
+import functools
+import hashlib
+import time
+import json
+import io
+import os
+import zipfile
+import zlib
+import gzip
+import re
+import mimetypes
+import email.utils
+import struct
+try:
+    import brotli
+except ImportError:
+    # Responses are only compressed with gzip.
+    brotli = None
+try:
+    import orjson
+except ImportError:
+    # Responses are encoded by the standard json module instead, which is
+    # much slower for large arrays (see encode_json()).
+    orjson = None
+
+from settings import config, __version__
+from cache import result_size, freeze_result, copy_result, cache_key, \
+        ResultCache, SharedResultCache, get_result_cache, SingleFlight, \
+        single_flight
+from workspace import get_workspace, ishandle, store_array, fetch_array, \
+        store_arrays
+from batching import concatenate_args, split_result, StateBatcher
+from pool import get_state_pool, state_size, iter_state_chunks, \
+        evaluate_pooled
+from admission import request_cost, saturation_cost, state_kind, \
+        state_cost, RateLimiter, CostQueue, rate_limiter, cost_queue
 
 
 
@@ -99,11 +163,97 @@ def toarray(a):
     except ValueError:
         return np.asarray(a.split(','), dtype=float)
         
+def tohandlelist(a):
+    """Condition a list of workspace handles
+    handles = tohandlelist(a)
+
+A may be a list of handles or a comma-separated string (see 
+toproplist()).  Raises ValueError if any of them is not a handle.
+"""
+    handles = toproplist(a)
+    if not all(ishandle(handle) for handle in handles):
+        raise ValueError('Workspace handles must begin with @')
+    return handles
+
 def tobool(a):
+    if isinstance(a, (bool, int, float)):
+        return bool(a)
     if a.lower() in ['0', 'f', 'false']:
         return False
     return True
 
+def toproplist(a):
+    """Condition a list of property names
+    props = toproplist(a)
+
+A may be a list of names or a comma-separated string.  Returns a tuple 
+of the unique names in their original order.
+"""
+    if isinstance(a, str):
+        a = a.split(',')
+    props = tuple(dict.fromkeys(str(name).strip() for name in a))
+    if not props or '' in props:
+        raise ValueError('Empty property name')
+    return props
+
+# Range expressions, like linspace(300,900,5000)
+_range_pattern = re.compile(r'\s*(linspace|logspace|arange)\s*\((.*)\)\s*$')
+
+def isrange(value):
+    """Test whether an argument is a range expression
+    test = isrange(value)
+"""
+    return isinstance(value, str) and _range_pattern.match(value) is not None
+
+def expand_range(text):
+    """Expand a range expression into an array
+    a = expand_range(text)
+
+The expressions mimic the numpy functions with the same names:
+    linspace(start, stop, num)  NUM evenly spaced values from START to 
+                                STOP inclusive
+    logspace(start, stop, num)  NUM values from 10**START to 10**STOP 
+                                inclusive, evenly spaced on a log scale
+    arange(start, stop, step)   Values from START by STEP up to, but not
+                                including, STOP.  STEP defaults to 1, and
+                                arange(stop) starts at 0.
+The number of values may not exceed config['range_max'].  Raises 
+ValueError if TEXT is not a valid expression.
+"""
+    match = _range_pattern.match(text)
+    if match is None:
+        raise ValueError(f'Not a range expression: {text}')
+    name, params = match.groups()
+    try:
+        params = [float(param) for param in params.split(',')]
+    except ValueError:
+        raise ValueError(f'The parameters of {name}() must be numbers') from None
+    limit = config['range_max']
+    if name in ('linspace', 'logspace'):
+        if len(params) != 3:
+            raise ValueError(f'{name}() requires start, stop, and num')
+        start, stop, num = params
+        if num != int(num) or num < 1:
+            raise ValueError(f'The num of {name}() must be a positive integer')
+        num = int(num)
+        if num > limit:
+            raise ValueError(f'{name}() may not generate more than {limit} values')
+        if name == 'linspace':
+            return np.linspace(start, stop, num)
+        return np.logspace(start, stop, num)
+    # arange
+    if not 1 <= len(params) <= 3:
+        raise ValueError('arange() requires stop, or start, stop, and an optional step')
+    if len(params) == 1:
+        params = [0.] + params
+    start, stop, step = (params + [1.])[:3]
+    if step == 0 or not np.isfinite(step):
+        raise ValueError('The step of arange() must be finite and nonzero')
+    num = np.ceil((stop - start) / step)
+    if num > limit:
+        raise ValueError(f'arange() may not generate more than {limit} values')
+    return np.arange(start, stop, step)
+
 def ismultiphase(subst):
     """Test whether the PYroMat substance instance is a multi-phase model
     :param subst: A PYroMat substance instance
@@ -133,94 +283,692 @@ def ismultiphase(subst):
 
 
 
+# ### Unit conversion
+# All property evaluations are done in a single canonical unit system -
+# PYroMat's default units.  Request arguments are converted into the
+# canonical units before evaluation, and the results are converted into
+# the requested units when the output is assembled.  This way, the same
+# evaluation serves every unit system.
+canonical_units = {}
+for _param in pm.config:
+    if _param.startswith('unit_'):
+        canonical_units[_param[5:]] = pm.config.entries[_param].default
+del _param
 
-def json_friendly(unfriendly):
-    """Clean up an output dictionary or list for output as JSON.
-    friendly = json_friendly(unfriendly)
-    
-This function recursively checks each value of the list or dict (and all
-child lists or dictionaries) for numpy data classes.  They are converted
-to lists in place or (if possible) they are converted to scalars.
-
-If the argument (unfriendly) is a list or dict, the same structure will
-be returned, but with the appropriate modifications made internally.
-If the argument is a numpy array, a list or scalar version will be 
-returned.  As a result, it is not necessary to catch the return value 
-unless a numpy array is passed explicitly.
-"""
-
-    # Handle numpy datatypes
-    if isinstance(unfriendly, np.ndarray):
-        if unfriendly.size == 1:
-            return np.asscalar(unfriendly)
-        return unfriendly.tolist()
-    # If this is a dict, recurse inside
-    elif isinstance(unfriendly, dict):
-        for name,value in unfriendly.items():
-            unfriendly[name] = json_friendly(value)
-    # If this is a list, recurse inside
-    elif isinstance(unfriendly, list):
-        for index,value in enumerate(unfriendly):
-            unfriendly[index] = json_friendly(value)
-    # Datatypes that aren't explicitly handled above are simply passed
-    # through with no modification
-    return unfriendly
-            
-
-def clean_nan(dirty):
-    """Clean out nan values from a computed dict in place. 
-    result = clean_nan( dirty )
-    
-The PMGI has a number of use cases where arrays of equal length are
-returned inside of a dictionary or list with the intention that they be 
-interpreted as varying together.  The PM property interface adds NaN 
-values at points that are out-of-bounds or otherwise illegal.  If any
-arrays are found to have NaN values, those and the corresponding values
-of all other arrays are removed.
 
-On success, returns the number of NaN values found. 
+def use_canonical_units():
+    """Set the PYroMat unit configuration to the canonical units
+    use_canonical_units()
 
-If the arrays are found to have incompatible shapes, -1 is returned.
+This is called once when the module is imported, so that every 
+evaluation in the process is done in canonical units.  The requests 
+never change pm.config, so it is not needed again.
 """
+    for unit, value in canonical_units.items():
+        pm.config['unit_' + unit] = value
+
+use_canonical_units()
+
+# The units of each property are a product of the unit dimensions raised
+# to an exponent.  Properties that do not appear here are dimensionless
+# or are not numerical; they are never converted.  Temperature is handled
+# separately, because the temperature scales have offsets.
+property_dimensions = {
+    'p': {'pressure':1},
+    'd': {'matter':1, 'volume':-1},
+    'v': {'volume':1, 'matter':-1},
+    'e': {'energy':1, 'matter':-1},
+    'h': {'energy':1, 'matter':-1},
+    'f': {'energy':1, 'matter':-1},
+    'g': {'energy':1, 'matter':-1},
+    's': {'energy':1, 'matter':-1, 'temperature':-1},
+    'cp': {'energy':1, 'matter':-1, 'temperature':-1},
+    'cv': {'energy':1, 'matter':-1, 'temperature':-1},
+    'mw': {'mass':1, 'molar':-1},
+}
+# Properties that share the units of another property
+property_aliases = {
+    'Tc':'T', 'Tt':'T', 'pc':'p', 'pt':'p', 'dc':'d'
+}
+
+@functools.lru_cache(maxsize=256)
+def _compile_conversion(mw, units):
+    """Compile a unit conversion table (cached)
+    conversion = _compile_conversion(mw, units)
+
+MW is the molecular weight in canonical units and UNITS is a tuple of
+(unit, value) pairs.  See get_conversion().
+"""
+    units = dict(units)
+    factors = {}
+    for unit, value in units.items():
+        if unit == 'matter':
+            factors[unit] = pm.units.matter(1., mw,
+                    from_units=canonical_units[unit], to_units=value)
+        elif unit == 'temperature':
+            factors[unit] = pm.units.temperature(1.,
+                    from_units=canonical_units[unit], to_units=value)
+        else:
+            factors[unit] = getattr(pm.units, unit)(1.,
+                    from_units=canonical_units[unit], to_units=value)
+
+    conversion = {}
+    # Temperature scales are affine: T = scale*T0 + offset
+    offset = float(pm.units.temperature_scale(0.,
+            from_units=canonical_units['temperature'],
+            to_units=units['temperature']))
+    scale = float(pm.units.temperature_scale(1.,
+            from_units=canonical_units['temperature'],
+            to_units=units['temperature'])) - offset
+    conversion['T'] = (scale, offset)
+    for prop, dims in property_dimensions.items():
+        scale = 1.
+        for unit, exponent in dims.items():
+            scale *= factors[unit] ** exponent
+        conversion[prop] = (float(scale), 0.)
+    for alias, prop in property_aliases.items():
+        conversion[alias] = conversion[prop]
+    # Discard the conversions that do nothing
+    for prop in list(conversion.keys()):
+        if conversion[prop] == (1., 0.):
+            del conversion[prop]
+    return conversion
+
+
+def get_conversion(subst, units):
+    """Return the conversion from canonical units to the requested units
+    conversion = get_conversion(subst, units)
+
+SUBST is the PYroMat substance instance (needed because conversion
+between mass and molar units depends on molecular weight) and UNITS is
+a units dict like the one found in the PMGIRequest units attribute.  Any
+units that are not specified are assumed to be canonical.
+
+The conversion is a dict keyed by property name.  Each value is a
+(scale, offset) tuple so that
+
+    value = scale * canonical_value + offset
+
+Properties that need no conversion are omitted.  Conversions are cached,
+so repeated calls with the same substance and units are inexpensive.
+"""
+    full = canonical_units.copy()
+    full.update(units)
+    return _compile_conversion(
+            float(subst.mw()), tuple(sorted(full.items())))
 
-    # Prepare an iterator for the dirty dataset
-    if isinstance(dirty, list):
-        iterator = enumerate(dirty)
-    elif isinstance(dirty, dict):
-        iterator = dirty.items()
-        
-    # We'll keep track of the keys that need to be changed using
-    # a "change_keys" list.
-    change_keys = []
-
-    # indices will eventually become a boolean array indicating which
-    # of the values should be eliminated.
-    indices = None
-    for key, value in iterator:
-        # If this is a numpy array, we need to check it
-        if isinstance(value, np.ndarray):
-            change_keys.append(key)
-            # If this is the first numpy array found, init indices
-            if indices is None:
-                indices = np.isnan(value)
-            # If there are already indices, verify the shape
-            elif indices.shape == value.shape:
-                indices = np.logical_or(indices, np.isnan(value))
+
+def convert_units(data, conversion, inverse=False):
+    """Apply a unit conversion to a dict or list of property values
+    converted = convert_units(data, conversion, inverse=False)
+
+DATA may be a dict of property values keyed by property name, or a list
+or dict containing such dicts (e.g. the liquid and vapor dicts of a
+saturation request or the list of lines in an isoline request).  The
+CONVERSION is a dict returned by get_conversion().  Each value whose key
+appears in the conversion is scaled in a single vectorized operation.
+
+When INVERSE is True, values are converted from the requested units to
+canonical units instead.
+
+A new structure is returned.  The original data are not modified, and
+values that need no conversion are not copied.
+"""
+    if not conversion:
+        return data
+    if isinstance(data, list):
+        return [convert_units(value, conversion, inverse) for value in data]
+    elif isinstance(data, dict):
+        out = {}
+        for name, value in data.items():
+            if isinstance(value, (dict, list)):
+                out[name] = convert_units(value, conversion, inverse)
+            elif name in conversion and \
+                    isinstance(value, (np.ndarray, float, int)) and \
+                    not isinstance(value, bool):
+                scale, offset = conversion[name]
+                if inverse:
+                    out[name] = (value - offset) / scale
+                else:
+                    out[name] = value * scale + offset
             else:
-                return -1
+                out[name] = value
+        return out
+    return data
 
-    # There were no numpy arrays!
-    if indices is None:
-        return 0
-    
-    count = indices.sum()
-    # If necessary, go back and remove NaN entries
-    if count:
-        indices = np.logical_not(indices)
-        for key in change_keys:
-            dirty[key] = dirty[key][indices]
-    return count
-        
+
+
+def round_significant(value, digits):
+    """Round values to a number of significant digits
+    rounded = round_significant(value, digits)
+
+VALUE is an array or a scalar, and the rounding is vectorized over the 
+whole array.  Zero and non-finite values are unchanged.  The result is
+the float closest to the rounded decimal value, so it is written with no
+more than DIGITS digits by encode_json().
+"""
+    value = np.asarray(value, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        magnitude = np.floor(np.log10(np.abs(value)))
+        shift = digits - 1 - np.where(np.isfinite(magnitude), magnitude, 0)
+        # Dividing by a power of ten is exact when the power is, so 
+        # negative shifts are applied by multiplying instead.
+        scale = 10.**np.abs(shift)
+        rounded = np.where(shift >= 0, 
+                np.round(value * scale) / scale, 
+                np.round(value / scale) * scale)
+    return np.where(np.isfinite(rounded), rounded, value)
+
+
+def reduce_precision(data, precision=None, dtype=None):
+    """Reduce the precision of the floating point values in a structure
+    reduced = reduce_precision(data, precision=None, dtype=None)
+
+DATA may be a dict or list of values, possibly nested, like the data of
+a request.  Floating point arrays and scalars are rounded to PRECISION 
+significant digits (see round_significant()), and/or converted to DTYPE
+(e.g. 'float32').  When both are None, DATA is returned unchanged.
+
+A new structure is returned.  The original data are not modified.
+"""
+    if precision is None and dtype is None:
+        return data
+    if isinstance(data, list):
+        return [reduce_precision(value, precision, dtype) for value in data]
+    elif isinstance(data, dict):
+        return {name: reduce_precision(value, precision, dtype) 
+                for name, value in data.items()}
+    elif isinstance(data, np.ndarray) and data.dtype.kind == 'f' or \
+            isinstance(data, (float, np.floating)):
+        shape = np.shape(data)
+        if precision is not None:
+            data = round_significant(data, precision)
+        if dtype is not None:
+            data = np.asarray(data, dtype=dtype)
+        return np.reshape(data, shape) if shape else data[()]
+    return data
+
+
+
+# ### Micro-batching
+def evaluate_states(subst, items, props=None):
+    """Evaluate a list of state() argument dicts with a single call
+    results = evaluate_states(subst, items, props=None)
+
+ITEMS is a list of argument dicts that all have the same keys.  They are
+combined with concatenate_args() and evaluated by a single call to 
+evaluate_status(), which isolates the invalid states.  Returns a list 
+with a result dict, including its status codes, for each item.
+
+If the combined evaluation raises an exception, each item is evaluated
+separately, so that a bad item cannot cause the others to fail.  In that
+case, the entry in the returned list for an item that failed is the
+exception it raised.
+"""
+    if len(items) > 1:
+        try:
+            args, shapes = concatenate_args(items)
+            return split_result(evaluate_status(subst, args, props), shapes)
+        except Exception:
+            pass
+    results = []
+    for item in items:
+        try:
+            results.append(evaluate_status(subst, item, props))
+        except Exception as e:
+            results.append(e)
+    return results
+
+
+# All state requests in this process share the same batcher
+state_batcher = StateBatcher(evaluate_states)
+
+
+
+# ### JSON encoding
+def _orjson_default(value):
+    """Convert the values that orjson cannot serialize on its own"""
+    if isinstance(value, np.ndarray):
+        # orjson only serializes contiguous arrays of common types
+        if not value.flags.c_contiguous:
+            return np.ascontiguousarray(value)
+        return value.tolist()
+    raise TypeError(f'Object of type {type(value).__name__} is not JSON serializable')
+
+
+def _scalarize(value):
+    """Replace single-element arrays with scalars in an output structure
+    value = _scalarize(value)
+
+Dicts, lists, and tuples are copied, and their contents are not modified.
+"""
+    if isinstance(value, np.ndarray):
+        if value.size == 1:
+            return value.item()
+        return value
+    elif isinstance(value, dict):
+        return {name: _scalarize(item) for name, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [_scalarize(item) for item in value]
+    return value
+
+
+def _join_tokens(tokens):
+    """Join an array of JSON tokens into nested JSON arrays"""
+    if tokens.ndim == 1:
+        return '[' + ','.join(tokens.tolist()) + ']'
+    return '[' + ','.join(_join_tokens(row) for row in tokens) + ']'
+
+
+def _encode_parts(value, parts, literal, scalars=True):
+    """Append the JSON text of a value to a list of strings
+    _encode_parts(value, parts, literal, scalars=True)
+
+This is the encoder used when orjson is not available.  Numeric arrays
+are encoded by a single call to the standard json encoder.
+"""
+    if isinstance(value, dict):
+        parts.append('{')
+        sep = ''
+        for name, item in value.items():
+            parts.append(sep + json.dumps(str(name)) + ':')
+            _encode_parts(item, parts, literal, scalars)
+            sep = ','
+        parts.append('}')
+    elif isinstance(value, (list, tuple)):
+        parts.append('[')
+        sep = ''
+        for item in value:
+            parts.append(sep)
+            _encode_parts(item, parts, literal, scalars)
+            sep = ','
+        parts.append(']')
+    elif isinstance(value, np.ndarray):
+        if value.size == 1 and scalars:
+            _encode_parts(value.reshape(-1)[0], parts, literal)
+        elif value.dtype.kind == 'f' and value.dtype.itemsize < 8:
+            # Converting single precision values to Python floats would 
+            # write them with double precision digits, so numpy writes 
+            # the shortest representation instead.
+            tokens = value.astype(str)
+            nonfinite = ~np.isfinite(value)
+            if nonfinite.any():
+                if literal:
+                    tokens[np.isnan(value)] = 'NaN'
+                    tokens[value == np.inf] = 'Infinity'
+                    tokens[value == -np.inf] = '-Infinity'
+                else:
+                    tokens[nonfinite] = 'null'
+            parts.append(_join_tokens(tokens))
+        elif value.dtype.kind in 'biuf':
+            text = json.dumps(value.tolist(), separators=(',', ':'))
+            # The array holds only numbers, so the non-finite values are
+            # the only possible matches.
+            if not literal and value.dtype.kind == 'f' and \
+                    not np.isfinite(value).all():
+                text = text.replace('-Infinity', 'null').replace(
+                        'Infinity', 'null').replace('NaN', 'null')
+            parts.append(text)
+        else:
+            _encode_parts(value.tolist(), parts, literal, scalars)
+    elif isinstance(value, np.floating) and value.dtype.itemsize < 8 \
+            and np.isfinite(value):
+        parts.append(str(value))
+    elif isinstance(value, np.generic):
+        _encode_parts(value.item(), parts, literal)
+    elif isinstance(value, float) and not literal and not np.isfinite(value):
+        parts.append('null')
+    else:
+        parts.append(json.dumps(value))
+
+
+def encode_json(value, nan=None, scalars=True):
+    """Encode an output structure as JSON
+    body = encode_json(value, nan=None, scalars=True)
+
+VALUE is a structure of dicts, lists, and tuples that may contain numpy 
+arrays and scalars anywhere.  Arrays are written directly, without first
+being converted to lists.  If SCALARS is True, arrays with a single 
+element are written as scalars.  The structure is not modified.
+
+NAN is the policy for non-finite values, 'null' or 'literal' (see 
+config['json_nan'], which is the default).
+
+When the orjson package is installed, it encodes the arrays in a single
+pass in native code.  Otherwise, each array is encoded by a single call 
+to the standard json encoder.
+
+Returns bytes.
+"""
+    if nan is None:
+        nan = config['json_nan']
+    if nan not in ('null', 'literal'):
+        raise ValueError(f'Unrecognized JSON NaN policy: {nan}')
+    # orjson always writes non-finite values as null
+    if orjson is not None and nan == 'null':
+        if scalars:
+            value = _scalarize(value)
+        return orjson.dumps(value, default=_orjson_default,
+                option=orjson.OPT_SERIALIZE_NUMPY)
+    parts = []
+    _encode_parts(value, parts, nan == 'literal', scalars)
+    return ''.join(parts).encode()
+
+
+# The mimetypes of the response formats, in order of preference.  The 
+# first is the default.
+json_type = 'application/json'
+npz_type = 'application/x-npz'
+ndjson_type = 'application/x-ndjson'
+response_types = [json_type, npz_type, ndjson_type]
+
+
+def negotiate(accept, offers):
+    """Choose the mimetype preferred by an HTTP Accept header
+    mimetype = negotiate(accept, offers)
+
+ACCEPT is the value of the Accept header (or None), and OFFERS is a list
+of the mimetypes that can be produced, in order of preference.  Each 
+offer is given the quality of the most specific media range that matches
+it (e.g. 'application/x-npz', then 'application/*', then '*/*'), and the
+offer with the highest quality wins.  Ties go to the earlier offer.  If
+no offer is acceptable, the first offer is returned.
+"""
+    if not accept:
+        return offers[0]
+    ranges = {}
+    for item in accept.split(','):
+        params = item.split(';')
+        mediarange = params[0].strip().lower()
+        quality = 1.
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.
+        ranges[mediarange] = quality
+    best, best_quality = offers[0], 0.
+    for offer in offers:
+        for mediarange in (offer, offer.split('/')[0] + '/*', '*/*'):
+            if mediarange in ranges:
+                if ranges[mediarange] > best_quality:
+                    best, best_quality = offer, ranges[mediarange]
+                break
+    return best
+
+
+def negotiate_encoding(accept, offers):
+    """Choose the content coding preferred by an HTTP Accept-Encoding header
+    encoding = negotiate_encoding(accept, offers)
+
+ACCEPT is the value of the Accept-Encoding header (or None), and OFFERS 
+is a list of the available codings (e.g. 'br' and 'gzip'), in order of
+preference.  Each offer is given the quality of its own entry or of the 
+'*' entry, and the offer with the highest quality wins.  Ties go to the
+earlier offer.  Returns None if no offer is acceptable, in which case 
+the response should not be encoded.
+"""
+    if not accept:
+        return None
+    qualities = {}
+    for item in accept.split(','):
+        params = item.split(';')
+        coding = params[0].strip().lower()
+        quality = 1.
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.
+        qualities[coding] = quality
+    best, best_quality = None, 0.
+    for offer in offers:
+        quality = qualities.get(offer, qualities.get('*', 0.))
+        if quality > best_quality:
+            best, best_quality = offer, quality
+    return best
+
+
+def etag_match(tag, header):
+    """Test an entity tag against an If-None-Match header
+    match = etag_match(tag, header)
+
+TAG is a quoted entity tag (e.g. '"0123abcd"'), and HEADER is the value
+of an If-None-Match request header, which is a comma-separated list of 
+tags or '*'.  Weak tags (W/"...") match their strong equivalents.  
+Returns True if TAG is matched.
+"""
+    if header is None:
+        return False
+    tags = [item.strip() for item in header.split(',')]
+    return '*' in tags or tag in [item.removeprefix('W/') for item in tags]
+
+
+# The responses depend only on the software and the data loaded when the
+# server starts, so none of them has been modified since.
+started = time.time()
+last_modified = email.utils.formatdate(started, usegmt=True)
+
+
+def modified_since(header):
+    """Test an If-Modified-Since header against the server start time
+    modified = modified_since(header)
+
+Returns True if the responses may have changed since the date in HEADER,
+or if HEADER is None or is not a valid HTTP date.
+"""
+    if header is None:
+        return True
+    try:
+        since = email.utils.parsedate_to_datetime(header).timestamp()
+    except (TypeError, ValueError):
+        return True
+    # HTTP dates have a resolution of one second
+    return since < int(started)
+
+
+def content_encodings():
+    """Return the content codings that are available, in order of preference
+    encodings = content_encodings()
+"""
+    if brotli is not None:
+        return ['br', 'gzip']
+    return ['gzip']
+
+
+def compress(data, encoding, level=None):
+    """Compress a response body
+    data = compress(data, encoding, level=None)
+
+ENCODING is 'br' or 'gzip' (see content_encodings()).  When LEVEL is 
+None, config['brotli_level'] or config['gzip_level'] is used.
+"""
+    if encoding == 'br':
+        if level is None:
+            level = config['brotli_level']
+        return brotli.compress(data, quality=level)
+    if level is None:
+        level = config['gzip_level']
+    return gzip.compress(data, compresslevel=level, mtime=0)
+
+
+def compress_stream(parts, encoding, level=None):
+    """Compress a streamed response body
+    for data in compress_stream(parts, encoding, level=None):
+        ...
+
+PARTS is an iterator over the parts of the body.  Each compressed part
+is flushed, so the client can decompress it as soon as it is received.
+See compress() for ENCODING and LEVEL.
+"""
+    if encoding == 'br':
+        if level is None:
+            level = config['brotli_level']
+        compressor = brotli.Compressor(quality=level)
+        for part in parts:
+            yield compressor.process(part) + compressor.flush()
+        yield compressor.finish()
+    else:
+        if level is None:
+            level = config['gzip_level']
+        # wbits=31 writes a gzip header and trailer
+        compressor = zlib.compressobj(level, zlib.DEFLATED, 31)
+        for part in parts:
+            yield compressor.compress(part) + compressor.flush(zlib.Z_SYNC_FLUSH)
+        yield compressor.flush()
+
+
+def decode_npz(data):
+    """Decode the arguments of a request from an npz archive
+    args = decode_npz(data)
+
+DATA is the body of the request (bytes), an archive like those written by
+numpy.savez().  Each .npy member becomes an argument named after it, and
+zero-dimensional string arrays become strings.  Arguments that are not 
+arrays (e.g. a units dict) may be given as a JSON object in an optional
+args.json member.
+
+Uncompressed members (those written by savez()) are not copied.  The 
+arrays are read-only views into DATA (see _stored_array()), and they 
+must be copied before they are modified (see writable()).  Compressed 
+members (savez_compressed()), and any member that cannot be viewed, are
+read by zipfile.  Object arrays are not allowed.
+
+Raises ValueError if DATA is not a valid archive.
+"""
+    args = {}
+    try:
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            for info in zf.infolist():
+                if info.filename == 'args.json':
+                    args.update(json.loads(zf.read(info)))
+                    continue
+                elif not info.filename.endswith('.npy'):
+                    raise ValueError(f'Unexpected member: {info.filename}')
+                name = info.filename[:-4]
+                value = None
+                if info.compress_type == zipfile.ZIP_STORED:
+                    value = _stored_array(data, info)
+                if value is None:
+                    with zf.open(info) as fd:
+                        value = np.lib.format.read_array(fd, allow_pickle=False)
+                if value.ndim == 0 and value.dtype.kind in 'US':
+                    value = str(value.item())
+                args[name] = value
+    except (zipfile.BadZipFile, struct.error, IndexError) as e:
+        raise ValueError('The request body is not a valid npz archive.') from e
+    return args
+
+
+def _stored_array(data, info):
+    """Return a view of an uncompressed .npy member of an archive
+    value = _stored_array(data, info)
+
+DATA is the archive and INFO is the ZipInfo of a stored member, whose 
+offset and size come from the central directory.  VALUE is a read-only
+array that shares DATA's memory, or None if the member is not laid out 
+as expected (e.g. it is encrypted), so that it has to be read by 
+zipfile instead.  Raises ValueError for object arrays.
+"""
+    offset = info.header_offset
+    if info.flag_bits & 0x1 or data[offset:offset+4] != b'PK\x03\x04':
+        return None
+    # The local header's name and extra fields may differ from those in 
+    # the central directory (e.g. zip64 sizes).
+    namelen, extralen = struct.unpack('<HH', data[offset+26:offset+30])
+    start = offset + 30 + namelen + extralen
+    stop = start + info.file_size
+    if stop > len(data) or info.file_size < 12:
+        return None
+    # The .npy header length follows the magic string and the format 
+    # version.
+    major = data[start+6]
+    if major == 1:
+        headerlen = 10 + struct.unpack('<H', data[start+8:start+10])[0]
+    else:
+        headerlen = 12 + struct.unpack('<I', data[start+8:start+12])[0]
+    fd = io.BytesIO(data[start:start+headerlen])
+    version = np.lib.format.read_magic(fd)
+    if version == (1, 0):
+        shape, fortran, dtype = np.lib.format.read_array_header_1_0(fd)
+    else:
+        shape, fortran, dtype = np.lib.format.read_array_header_2_0(fd)
+    if dtype.hasobject:
+        raise ValueError(f'Object arrays are not allowed: {info.filename}')
+    count = int(np.prod(shape))
+    if start + headerlen + count * dtype.itemsize != stop:
+        return None
+    value = np.frombuffer(data, dtype=dtype, count=count, 
+            offset=start+headerlen)
+    return value.reshape(shape, order='F' if fortran else 'C')
+
+
+def writable(args):
+    """Return arguments whose arrays may be modified in place
+    args = writable(args)
+
+PYroMat writes to the arrays that are passed to it (e.g. to mark states
+that are out of bounds), so read-only arrays (like those returned by 
+decode_npz()) are copied.  A new dict is returned.
+"""
+    return {name: value.copy() 
+            if isinstance(value, np.ndarray) and not value.flags.writeable
+            else value for name, value in args.items()}
+
+
+def _split_arrays(value, path, arrays):
+    """Move the arrays out of an output structure
+    skeleton = _split_arrays(value, path, arrays)
+
+Each array in VALUE is added to the ARRAYS dict with its PATH, the keys
+and indices that lead to it joined by '/'.  The rest of the structure is
+returned.  Arrays are omitted from dicts and replaced by None in lists.
+"""
+    if isinstance(value, dict):
+        skeleton = {}
+        for name, item in value.items():
+            if isinstance(item, np.ndarray):
+                arrays[path + str(name)] = item
+            else:
+                skeleton[name] = _split_arrays(item, path + str(name) + '/', arrays)
+        return skeleton
+    elif isinstance(value, (list, tuple)):
+        skeleton = []
+        for index, item in enumerate(value):
+            if isinstance(item, np.ndarray):
+                arrays[path + str(index)] = item
+                item = None
+            skeleton.append(_split_arrays(item, path + str(index) + '/', arrays))
+        return skeleton
+    return value
+
+
+def encode_npz(value):
+    """Encode an output structure as an npz archive
+    body = encode_npz(value)
+
+Every array in VALUE becomes an uncompressed .npy member named after its
+path in the structure, e.g. 'data/T' or 'data/liquid/p', and it is 
+written as a raw binary buffer.  Unlike JSON, arrays with a single 
+element are written as arrays.  Everything else (e.g. the message and
+units) is written as JSON in an output.json member.  The archive can be
+read with numpy.load().
+
+Returns bytes.
+"""
+    arrays = {}
+    skeleton = _split_arrays(value, '', arrays)
+    fd = io.BytesIO()
+    with zipfile.ZipFile(fd, 'w', zipfile.ZIP_STORED, allowZip64=True) as zf:
+        zf.writestr('output.json', encode_json(skeleton))
+        for name, array in arrays.items():
+            with zf.open(name + '.npy', 'w', force_zip64=True) as member:
+                np.lib.format.write_array(member, array, allow_pickle=False)
+    return fd.getvalue()
 
 
 def get_practical_limits(subst):
@@ -252,11 +1000,13 @@ d=1000.
 
 
 
-def get_default_lines(subst, prop):
+def get_default_lines(subst, prop, limits=None):
     """
     Get a default set of isolines for a given property.
     :param subst: A pyromat substance object
     :param prop: A string representing the requested property
+    :param limits: The practical limits of the substance, as returned by
+                    get_practical_limits().  They are computed if None.
     :return: vals - a np array of suitable default values.
     """
     if not hasattr(subst, prop):
@@ -265,7 +1015,9 @@ def get_default_lines(subst, prop):
     vals = None
 
     multiphase = hasattr(subst, 'ps')
-    Tmin, pmin, Tmax, pmax = get_practical_limits(subst)
+    if limits is None:
+        limits = get_practical_limits(subst)
+    Tmin, pmin, Tmax, pmax = limits
     if multiphase:
         Tt, pt = subst.triple()
 
@@ -298,56 +1050,459 @@ def get_default_lines(subst, prop):
     return vals
 
 
-def compute_iso_line(subst, n=25, scaling='linear', **kwargs):
-    """
-    Compute a constant line for a given property at a given value
-    :param subst: a pyromat substance object
-    :param n: The number of points to compute to define the line
-    :param scaling: Should point spacing be 'linear' or 'log'
-    :param kwargs: A property specified by name. If 'default' is specified in
-                    kwargs, the value of the prop will be ignored and a set
-                    of default lines for that prop will be computed (see
-                    get_default_lines()).
-    :return: A dict containing arrays of properties. If 'default' flag is set
-                the response will be an array of dicts representing all the
-                individual lines.
-    """
+@functools.lru_cache(maxsize=None)
+def _density_limits(idstr):
+    subst = pm.get(idstr)
+    Tmin, pmin, Tmax, pmax = get_practical_limits(subst)
+    try:  # Finding the high value can be flaky for some substances
+        dmax = subst.d(T=Tmin, p=pmax)
+    except pm.utility.PMParamError:
+        if ismultiphase(subst):
+            Tt, pt = subst.triple()
+            dmax = subst.ds(T=Tt)[0]
+        else:
+            dmax = subst.d(T=Tmin, p=pmin)
+    dmin = subst.d(T=Tmax, p=pmin)
+    return float(np.ravel(dmin)[0]), float(np.ravel(dmax)[0])
+
+def get_density_limits(subst):
+    """Return the practical density boundaries for a substance
+    dmin, dmax = get_density_limits(subst)
+
+The densities are those at the corners of the practical limits (see 
+get_practical_limits()): the lowest is at the highest temperature and 
+the lowest pressure, and the highest is at the lowest temperature and 
+the highest pressure.  They are iterative, so they are only computed 
+once for each substance.
+"""
+    return _density_limits(subst.data['id'])
 
-    # Perform a default computation
-    if len(kwargs) != 1:
-        if 'default' not in kwargs or len(kwargs) != 2:
-            raise pm.utility.PMParamError("Specify exactly one property "
-                                          "for an isoline")
 
-    # Get an array of lines, ignore the value of prop.
-    if 'default' in kwargs:
-        kwargs.pop('default')
-        prop = list(kwargs.keys())[0]  # only value left is prop
-        lines = []
-        # Recursively compute the single line
-        for val in get_default_lines(subst, prop):
-            arg = {prop: val}  # Build an argument
-            try:
-                lines.append(compute_iso_line(subst, n, scaling, **arg))
-            except pm.utility.PMParamError:
-                pass
-        return lines
+@functools.lru_cache(maxsize=None)
+def _state_properties(idstr):
+    return tuple(pm.get(idstr).state().keys())
+
+def state_properties(subst):
+    """Return the names of the properties returned by a substance's state()
+    names = state_properties(subst)
+"""
+    return _state_properties(subst.data['id'])
+
+
+def evaluate_props(subst, args, props=None):
+    """Evaluate a subset of the properties returned by state()
+    result = evaluate_props(subst, args, props=None)
+
+ARGS are the state() arguments, and PROPS is a sequence of the names of
+the properties to return (see state_properties()).  If PROPS is None, 
+all of them are returned, exactly as by subst.state(**args).
+
+Each of the property methods (e.g. subst.h()) must solve for the state
+from the arguments on its own, which is as expensive as state() when it
+requires an iteration (e.g. for pressure or enthalpy arguments).  So, a
+single property is evaluated by its own method, while several properties
+are evaluated by a single call to state() that shares the solution, and
+the others are discarded.
+"""
+    if props is None:
+        return subst.state(**args)
+    if len(props) == 1:
+        return {props[0]: getattr(subst, props[0])(**args)}
+    result = subst.state(**args)
+    return {name: result[name] for name in props}
+
+
+# ### Per-element status
+# Every evaluated state is given one of these status codes, which are 
+# returned in the 'status' array of the data.
+status_ok = 0           # The state was evaluated
+status_oob = 1          # The arguments were out of bounds or invalid
+status_noconv = 2       # The iteration for the state did not converge
+status_ambiguous = 3    # T and p lie on the saturation line, so the phase
+                        # (and the quality) is ambiguous
+status_names = {status_ok: 'ok', status_oob: 'oob', 
+        status_noconv: 'noconv', status_ambiguous: 'ambiguous'}
+# States that fail together are split in halves to isolate the ones that
+# fail on their own, but no more than isolate_max evaluations are made.
+isolate_max = 256
+# The relative distance from the saturation pressure that is ambiguous
+ambiguous_rtol = 1e-6
+# Only the T,p states whose pressure is within saturation_screen_rtol of 
+# an interpolated saturation curve are checked against subst.ps(); the 
+# interpolation error of the curve is below 1e-4.
+saturation_screen_points = 129
+saturation_screen_rtol = 1e-3
+
+
+# A state failed if any of these properties is NaN.  The specific heats
+# and their ratio are not defined for saturated mixtures, so they are NaN
+# (or infinite) there, even though the state is valid.
+state_variables = ('T', 'p', 'd', 'v', 'e', 'h', 's', 'f', 'g')
+
+
+def failed_states(result):
+    """Identify the states that failed in a result
+    failed = failed_states(result)
+
+RESULT is a dict of property arrays with the same size.  Returns a flat
+boolean array that is True where any of the state_variables is NaN.  If
+RESULT contains none of them (see evaluate_props()), all of its floating
+point arrays are tested instead.
+"""
+    values = [np.asarray(value) for name, value in result.items()
+            if name in state_variables]
+    if not values:
+        values = [np.asarray(value) for value in result.values()
+                if np.asarray(value).dtype.kind == 'f']
+    failed = None
+    for value in values:
+        bad = np.isnan(value.ravel())
+        failed = bad if failed is None else failed | bad
+    return failed
+
+
+def evaluate_isolated(subst, args, props=None):
+    """Evaluate states so that the ones that fail cannot fail the others
+    result, failed = evaluate_isolated(subst, args, props=None)
+
+state() raises an exception for the whole array if any element is 
+invalid (e.g. a quality greater than one).  Here, the ARGS are 
+broadcast and flattened, and if their evaluation by evaluate_props() 
+raises a PMParamError or a PMAnalysisError, they are split in halves, 
+which are evaluated in the same way.  The values of the elements that 
+fail on their own are NaN.  
+
+FAILED is an array of the status code of each element: status_oob for a
+PMParamError, status_noconv for a PMAnalysisError, and status_ok for the
+elements that were evaluated.  The arrays in RESULT and FAILED are flat.
+To limit the cost, no more than isolate_max evaluations are made, after
+which every element of a failing half is marked as failed.  If every
+element fails with a PMParamError, the first exception is raised, since
+the arguments are probably invalid as a whole.  If any of them failed to
+converge, the states are valid arguments, so the result is all NaN and
+FAILED holds their status codes instead.
+"""
+    flat, shapes = concatenate_args([args])
+    n = int(np.prod(shapes[0]))
+    failed = np.zeros(n, dtype=np.uint8)
+    parts = []
+    errors = []
+    pending = [(0, n)]
+    evaluations = 0
+    while pending:
+        start, stop = pending.pop()
+        evaluations += 1
+        try:
+            parts.append((start, stop, evaluate_props(subst, 
+                    {name:value[start:stop] for name,value in flat.items()},
+                    props)))
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
+            errors.append(e)
+            if stop - start > 1 and evaluations + len(pending) < isolate_max:
+                middle = (start + stop) // 2
+                pending.extend([(middle, stop), (start, middle)])
+            elif isinstance(e, pm.utility.PMAnalysisError):
+                failed[start:stop] = status_noconv
+            else:
+                failed[start:stop] = status_oob
+    if not parts:
+        if not any(isinstance(e, pm.utility.PMAnalysisError) for e in errors):
+            raise errors[0]
+        names = props if props is not None else state_properties(subst)
+        return {name:np.full(n, np.nan) for name in names}, failed
+    result = {name:np.full(n, np.nan) for name in parts[0][2]}
+    for start, stop, part in parts:
+        for name, value in part.items():
+            result[name][start:stop] = np.ravel(value)
+    return result, failed
+
+
+@functools.lru_cache(maxsize=None)
+def _saturation_curve(idstr):
+    subst = pm.get(idstr)
+    Tt, pt = subst.triple()
+    Tc, pc = subst.critical()
+    T = np.linspace(float(Tt), float(Tc), saturation_screen_points)
+    lnps = np.log(np.asarray(subst.ps(T=T), dtype=float))
+    # np.interp() needs increasing abscissae, and ln(ps) is nearly 
+    # linear in 1/T
+    return 1. / T[::-1], lnps[::-1]
+
+def state_status(subst, args, result, failed=None):
+    """Determine the status code of each evaluated state
+    status = state_status(subst, args, result, failed=None)
+
+ARGS are the state() arguments, RESULT is the evaluated result, and 
+FAILED is an optional array of the codes of the elements that could not
+be evaluated (see evaluate_isolated()).  Elements that failed (see 
+failed_states()) are status_oob if their temperature or pressure arguments are outside of the
+substance's limits (or are not finite), status_noconv if their state 
+had to be found by an iteration (see state_kind()), and status_oob 
+otherwise.  For multi-phase substances, states given by T and p on the 
+saturation line are status_ambiguous.  Returns an unsigned 8-bit array
+with the shape of the RESULT arrays.
+
+Only the T,p states near an interpolated saturation curve, which is 
+computed once for each substance, are checked against subst.ps().
+"""
+    shape = np.shape(next(iter(result.values())))
+    flat = {name:np.broadcast_to(value, shape).ravel() 
+            for name, value in args.items()}
+    n = int(np.prod(shape))
+    status = np.zeros(n, dtype=np.uint8) if failed is None \
+            else np.array(failed, dtype=np.uint8).reshape(n)
+    bad = failed_states(result)
+    if bad is None:
+        bad = np.zeros(n, dtype=bool)
+    bad &= status == status_ok
+    if bad.any():
+        outside = np.zeros(n, dtype=bool)
+        for name in flat:
+            outside |= ~np.isfinite(flat[name])
+        Tmin, Tmax = subst.Tlim()
+        if 'T' in flat:
+            outside |= (flat['T'] < Tmin) | (flat['T'] > Tmax)
+        if 'p' in flat and ismultiphase(subst):
+            pmin, pmax = subst.plim()
+            outside |= (flat['p'] < pmin) | (flat['p'] > pmax)
+        # Ideal gases only iterate to invert h, e, or s
+        kind = state_kind(flat.keys())
+        iterative = kind == 'inverse' or \
+                (kind == 'pressure' and ismultiphase(subst))
+        status[bad & outside] = status_oob
+        status[bad & ~outside] = status_noconv if iterative else status_oob
+    if ismultiphase(subst) and 'T' in flat and 'p' in flat:
+        Tt, pt = subst.triple()
+        Tc, pc = subst.critical()
+        T, p = flat['T'], flat['p']
+        saturated = (status == status_ok) & (T >= Tt) & (T <= Tc)
+        # A quality selects the phase
+        if 'x' in flat:
+            saturated &= flat['x'] < 0
+        if saturated.any():
+            invT, lnps = _saturation_curve(subst.data['id'])
+            with np.errstate(divide='ignore', invalid='ignore'):
+                screen = np.abs(np.log(p[saturated]) - 
+                        np.interp(1. / T[saturated], invT, lnps))
+            saturated[np.flatnonzero(saturated)[
+                    ~(screen <= saturation_screen_rtol)]] = False
+        if saturated.any():
+            ps = np.asarray(subst.ps(T=np.array(T[saturated])), dtype=float)
+            near = np.abs(p[saturated] - ps) <= ambiguous_rtol * ps
+            index = np.flatnonzero(saturated)[near]
+            status[index] = status_ambiguous
+    return status.reshape(shape)
+
+
+def evaluate_status(subst, args, props=None, evaluate=None):
+    """Evaluate states with a status code for each element
+    result = evaluate_status(subst, args, props=None, evaluate=None)
+
+The result of evaluate_props(subst, args, props) is returned with a
+'status' array of the status code of each state (see state_status()).
+EVALUATE is an alternative function with the same signature as 
+evaluate_props() (e.g. evaluate_pooled()).  If it raises a PMParamError
+or a PMAnalysisError, the states are evaluated again by 
+evaluate_isolated(), so that only the elements that fail are lost.
+"""
+    if evaluate is None:
+        evaluate = evaluate_props
+    failed = None
+    try:
+        result = evaluate(subst, args, props)
+    except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+        result, failed = evaluate_isolated(subst, args, props)
+        shape = np.broadcast(*[np.asarray(value) for value in args.values()]).shape
+        shape = shape if shape else (1,)
+        result = {name:value.reshape(shape) for name, value in result.items()}
+    result = dict(result)
+    result['status'] = state_status(subst, args, result, failed)
+    return result
+
+
+def drop_nan(data, offset=0):
+    """Remove the states with NaN values from a result
+    data = drop_nan(data, offset=0)
+
+DATA is a dict of arrays, possibly nested (e.g. the liquid and vapor 
+dicts of a saturation result), that vary together.  If it is a list, 
+each item is treated separately.  The arrays are flattened, and the 
+elements that failed are removed.  If DATA has a 'status' array, the 
+elements that failed are those that are not status_ok or 
+status_ambiguous.  Otherwise, they are found by failed_states() in each 
+of the nested dicts.  An 'index' array of the flat indices of the 
+remaining elements (plus OFFSET) is added, and the 'status' array is 
+left intact, so that it still describes every element.  A new 
+structure is returned; DATA is not modified.
+"""
+    if isinstance(data, list):
+        return [drop_nan(item, offset) for item in data]
+    elif not isinstance(data, dict):
+        return data
+    if isinstance(data.get('status'), np.ndarray):
+        status = data['status'].ravel()
+        keep = (status == status_ok) | (status == status_ambiguous)
+    else:
+        keep = None
+        def find(value):
+            nonlocal keep
+            if not isinstance(value, dict):
+                return
+            value = {name: item for name, item in value.items() 
+                    if name not in ('status', 'index')}
+            arrays = {name: item for name, item in value.items()
+                    if isinstance(item, np.ndarray)}
+            failed = failed_states(arrays) if arrays else None
+            if failed is not None:
+                keep = ~failed if keep is None else keep & ~failed
+            for item in value.values():
+                find(item)
+        find(data)
+        if keep is None:
+            return data
+    def select(value):
+        if isinstance(value, dict):
+            return {name: item if name in ('status', 'index') else select(item)
+                    for name, item in value.items()}
+        elif isinstance(value, np.ndarray) and value.size == keep.size:
+            return value.ravel()[keep]
+        return value
+    out = select(data)
+    out['index'] = np.flatnonzero(keep) + offset
+    return out
+
+
+# ### Saturation states
+# The default steam dome is evaluated at this many temperatures
+dome_points = 31
+
+
+def dome_temperatures(subst, n=None):
+    """Return the temperatures of the default steam dome
+    T = dome_temperatures(subst, n=None)
+
+The N temperatures (dome_points if N is None) are evenly spaced between 
+the triple and the critical points of the multi-phase SUBST, which are 
+themselves excluded.
+"""
+    Tt,pt = subst.triple()
+    Tc,pc = subst.critical()
+    ep = (Tc-Tt) * .001
+    return np.linspace(Tt+ep, Tc-ep, dome_points if n is None else n)
+
+
+def saturation_states(subst, T, props=None, valid=None):
+    """Evaluate the saturated liquid and vapor states at temperatures
+    data = saturation_states(subst, T, props=None, valid=None)
+
+T is an array of temperatures in canonical units, and PROPS are the 
+names of the properties to return (see evaluate_props()), or None for 
+all of them.  DATA is a dict with 'liquid' and 'vapor' dicts of property
+arrays, and a 'status' array (see state_status()).  
+
+Saturation properties are only defined between the triple and the 
+critical points, so the temperatures outside of them (and NaN) are not
+evaluated.  They are given status_oob, and their properties are NaN.  
+VALID is a boolean array that marks the temperatures to evaluate.  If it
+is None, it is determined from T.  Raises PMParamError or 
+PMAnalysisError if the evaluation fails.
+
+The critical point is singular, and it disturbs the iteration for the 
+other states evaluated with it, so it is evaluated separately.
+"""
+    T = np.asarray(T, dtype=float)
+    shape = T.shape if T.shape else (1,)
+    T = T.reshape(shape)
+    Tt,pt = subst.triple()
+    Tc,pc = subst.critical()
+    if valid is None:
+        valid = (T >= Tt) & (T <= Tc)
+    mask = np.asarray(valid, dtype=bool).reshape(shape)
+    names = props if props is not None else state_properties(subst)
+    data = {phase: {name: np.full(shape, np.nan) for name in names}
+            for phase in ('liquid', 'vapor')}
+    for group in (mask & (T != Tc), mask & (T == Tc)):
+        if not group.any():
+            continue
+        Tv = np.array(T[group])
+        dsL,dsV = subst.ds(T=Tv)
+        phases = {
+            'liquid': evaluate_props(subst, {'T': np.array(Tv), 'd': dsL}, props),
+            'vapor': evaluate_props(subst, {'T': np.array(Tv), 'd': dsV}, props)}
+        for phase, result in phases.items():
+            for name in names:
+                if name in result:
+                    data[phase][name][group] = result[name]
+    # Throw away the liquid pressure - it is not numerically correct.
+    if 'p' in data['vapor']:
+        data['liquid']['p'] = data['vapor']['p']
+    status = np.where(mask, status_ok, status_oob).astype(np.uint8)
+    failed = failed_states(data['liquid']) | failed_states(data['vapor'])
+    status[failed.reshape(shape) & mask] = status_noconv
+    data['status'] = status
+    return data
+
+
+def mix_states(data, x):
+    """Compute saturated mixture states from saturation states
+    result = mix_states(data, x)
+
+DATA is a result of saturation_states(), and X is the quality of the 
+mixture.  RESULT is a dict of the same properties (and 'status') at each
+of the saturation temperatures, as state() would return them for T and
+x, but no further evaluation is needed.  As in state(), the specific 
+volume and the specific energies and entropy are weighted by the 
+quality, and the specific heats are not defined.
+"""
+    liquid, vapor = data['liquid'], data['vapor']
+    result = {}
+    for name, value in vapor.items():
+        if name in ('T', 'p'):
+            result[name] = value.copy()
+        elif name == 'x':
+            result[name] = np.full(value.shape, float(x))
+        elif name == 'd':
+            result[name] = 1. / ((1.-x)/liquid['d'] + x/value)
+        elif name in ('cp', 'gam'):
+            result[name] = np.full(value.shape, np.inf)
+        elif name == 'cv':
+            result[name] = np.full(value.shape, np.nan)
+        else:
+            result[name] = (1.-x)*liquid[name] + x*value
+    result['status'] = data['status'].copy()
+    return result
 
-    # We have a single property, so compute the line
 
+def iso_line_args(subst, prop, value, n=25, limits=None, insert=True):
+    """
+    Construct the state() arguments for a constant line of a property
+    :param subst: a pyromat substance object
+    :param prop: The name of the property held constant
+    :param value: The value of the property
+    :param n: The number of points to compute to define the line
+    :param limits: The practical limits of the substance, as returned by
+                    get_practical_limits().  They are computed if None.
+    :param insert: If False, the saturation points are not inserted.
+    :return: A dict of state() arguments.  For multi-phase substances, 
+                the saturated liquid and vapor points are inserted where
+                the line crosses the saturation line, and an 'x' array 
+                gives their quality (-1 elsewhere).
+    """
     # Compute the limit pressures and temperatures
     multiphase = hasattr(subst, 'Ts')
-    Tmin, pmin, Tmax, pmax = get_practical_limits(subst)
+    if limits is None:
+        limits = get_practical_limits(subst)
+    Tmin, pmin, Tmax, pmax = limits
     if multiphase:
         Tc, pc = subst.critical()
         Tt, pt = subst.triple()
-
+    args = {prop: value}
 
     # The props for which we will plot against a T list
-    if any(prop in kwargs for prop in ['p', 'd', 'v', 's', 'x']):
+    if prop in ['p', 'd', 'v', 's', 'x']:
 
         # If quality, we stop at the crit pt
-        if 'x' in kwargs:
+        if prop == 'x':
             if multiphase:
                 Tmax = Tc
             else:
@@ -357,55 +1512,1014 @@ def compute_iso_line(subst, n=25, scaling='linear', **kwargs):
         line_T = np.linspace(Tmin, Tmax, n).flatten()
 
         # We can insert the phase change points
-        if multiphase and 'p' in kwargs and pc > kwargs['p'] > pt:
-            Tsat = subst.Ts(p=kwargs['p'])
-            i_insert = np.argmax(line_T > Tsat)
+        if insert and multiphase and prop == 'p' and pc > value > pt:
+            Tsat = subst.Ts(p=value)
+            i_insert = np.searchsorted(line_T, Tsat, side='right')
 
             line_T = np.insert(line_T, i_insert, np.array([Tsat, Tsat]).flatten())
             x = -np.ones_like(line_T)
             x[line_T == Tsat] = np.array([0, 1])
-            kwargs['x'] = x
+            args['x'] = x
 
-        kwargs['T'] = line_T
+        args['T'] = line_T
 
-    elif any(prop in kwargs for prop in ['h', 'e']):
-        try:  # Finding the low value can be flaky for some substances
-            dmax = subst.d(T=Tmin, p=pmax)
-        except pm.utility.PMParamError:
-            if multiphase:
-                dmax = subst.ds(T=Tt)[0]
-            else:
-                dmax = subst.d(T=Tmin, p=pmin)
-        dmin = subst.d(T=Tmax, p=pmin)
+    elif prop in ['h', 'e']:
+        dmin, dmax = get_density_limits(subst)
         line_d = np.logspace(np.log10(dmin), np.log10(dmax), n).flatten()
-        # line_d = np.linspace(dmin, dmax, n)
-        kwargs['d'] = line_d
-
-    elif any(prop in kwargs for prop in ['T', 'h', 'e']):
-        # ph & pe are going to be really slow, but what's better?
+        args['d'] = line_d
 
+    elif prop == 'T':
         line_p = np.logspace(np.log10(pmin), np.log10(pmax), n).flatten()
 
         # We can insert the phase change points
-        if multiphase and 'T' in kwargs and Tc > kwargs['T'] > Tt:
-            psat = subst.ps(T=kwargs['T'])
-            i_insert = np.argmax(line_p > psat)
+        if insert and multiphase and Tc > value > Tt:
+            psat = subst.ps(T=value)
+            i_insert = np.searchsorted(line_p, psat, side='right')
 
             line_p = np.insert(line_p, i_insert, np.array([psat, psat]).flatten())
             x = -np.ones_like(line_p)
             x[line_p == psat] = np.array([1, 0])
-            kwargs['x'] = x
-
-        kwargs['p'] = line_p
-
+            args['x'] = x
 
+        args['p'] = line_p
 
     else:  # Should never arrive here without error
         raise pm.utility.PMParamError('property invalid')
 
-    states = subst.state(**kwargs)
+    return args
+
+
+# ### Isoline solving
+# Lines of constant h, e, or s are found by inverting the property along 
+# a grid of densities (h and e) or temperatures (s).  Instead of state(),
+# which solves every point from scratch, they may be solved by 
+# solve_monotonic() (see evaluate_iso_family()).
+iso_methods = ('direct', 'independent')
+# A point is converged when the change in its unknown (the temperature,
+# or the logarithm of the density) is below this, relative to its value
+iso_tol = 1e-9
+# The largest number of property evaluations for each point
+iso_max_iter = 50
+
+
+def solve_monotonic(F, lower, upper):
+    """Solve F(x) = 0 for a monotonic function, element by element
+    x, iterations, failed = solve_monotonic(F, lower, upper)
+
+F(x, index) returns the residuals of the elements in the INDEX array at 
+the unknowns X (arrays of the same size).  All of the elements that are 
+still being solved are evaluated by a single call.  LOWER and UPPER 
+bound the search.
+
+The residuals at the bounds are evaluated, and the root is bracketed by 
+them.  In the bracket, secant steps are taken, and the bracket is 
+bisected when one would leave it.  Since F only needs to be monotonic, 
+a kink at a phase boundary cannot make the solution diverge.
+
+ITERATIONS is the number of evaluations of each element.  FAILED is the
+status code of each element: status_oob if there is no root between the
+bounds, status_noconv if F could not be evaluated or the root was not 
+found in iso_max_iter evaluations, and status_ok otherwise.  The X of 
+the elements that failed is NaN.
+"""
+    lower = np.array(lower, dtype=float).ravel()
+    upper = np.array(upper, dtype=float).ravel()
+    n = max(lower.size, upper.size)
+    lower = np.array(np.broadcast_to(lower, n))
+    upper = np.array(np.broadcast_to(upper, n))
+    iterations = np.zeros(n, dtype=int)
+    failed = np.zeros(n, dtype=np.uint8)
+    active = np.ones(n, dtype=bool)
+
+    def evaluate(xv, index):
+        iterations[index] += 1
+        return np.asarray(F(xv, index), dtype=float).ravel()
+
+    every = np.arange(n)
+    fl = evaluate(lower, every)
+    fu = evaluate(upper, every)
+    # The root is between lo and hi.  x is the latest estimate, and xp is
+    # the one before it, so the first secant step is a false position step.
+    lo, flo, hi, fhi = lower.copy(), fl.copy(), upper.copy(), fu.copy()
+    xp, fxp, x, fx = lower.copy(), fl, upper.copy(), fu
+    for bound, value in ((lower, fl), (upper, fu)):
+        root = value == 0
+        x[root] = bound[root]
+        active[root] = False
+    missing = active & ~(np.isfinite(fl) & np.isfinite(fu))
+    failed[missing] = status_noconv
+    outside = active & ~missing & (np.sign(fl) == np.sign(fu))
+    failed[outside] = status_oob
+    active &= ~(missing | outside)
+
+    while active.any():
+        index = np.flatnonzero(active)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            secant = x[index] - fx[index] * (x[index] - xp[index]) / \
+                    (fx[index] - fxp[index])
+        inside = (secant - lo[index]) * (secant - hi[index]) < 0
+        xn = np.where(inside, secant, 0.5 * (lo[index] + hi[index]))
+        fn = evaluate(xn, index)
+        scale = iso_tol * np.maximum(np.abs(xn), 1.)
+        bad = ~np.isfinite(fn)
+        # Narrow the brackets
+        low = np.sign(fn) == np.sign(flo[index])
+        lo[index] = np.where(low, xn, lo[index])
+        flo[index] = np.where(low, fn, flo[index])
+        hi[index] = np.where(low, hi[index], xn)
+        fhi[index] = np.where(low, fhi[index], fn)
+        done = (np.abs(xn - x[index]) <= scale) | (fn == 0) | \
+                (np.abs(hi[index] - lo[index]) <= scale)
+        # Stop when the next secant step would be negligible
+        with np.errstate(divide='ignore', invalid='ignore'):
+            chord = (fn - fx[index]) / (xn - x[index])
+        done |= np.abs(fn) <= scale * np.abs(chord)
+        xp[index], fxp[index] = x[index], fx[index]
+        x[index], fx[index] = xn, fn
+
+        failed[index[bad]] = status_noconv
+        active[index[done | bad]] = False
+        over = active & (iterations >= iso_max_iter)
+        failed[over] = status_noconv
+        active &= ~over
+
+    x[failed != status_ok] = np.nan
+    return x, iterations, failed
+
+
+def evaluate_iso_family(subst, prop, items, props=None, method='direct'):
+    """Evaluate the lines of an isoline family
+    lines = evaluate_iso_family(subst, prop, items, props=None, method='direct')
+
+ITEMS are the state() arguments of each line (see iso_line_args()), and
+PROP is the property that is held constant.  Returns a list with the 
+result dict of each line, including the status of each point (see 
+evaluate_status()).
+
+With the 'direct' METHOD, the lines are concatenated and evaluated by a 
+single call to state(), which solves every point of an h, e, or s line 
+from scratch.  The 'independent' method solves those lines with 
+solve_monotonic() instead, between the limits of the substance, and 
+the results include an 'iterations' array with the number of property 
+evaluations spent on each point.  All of the points of all of the lines
+are solved together, so each step is a single vectorized evaluation.  
+Other lines are always evaluated directly.
+"""
+    if method not in iso_methods:
+        raise pm.utility.PMParamError(f'Unrecognized isoline method: {method}')
+    if method == 'direct' or prop not in ('h', 'e', 's'):
+        args, shapes = concatenate_args(items)
+        return split_result(evaluate_status(subst, args, props), shapes)
+
+    # Lines of s are solved for log(d) along T, and lines of h or e are 
+    # solved for T along log(d).
+    grid_name = 'T' if prop == 's' else 'd'
+    grid = np.array([np.asarray(item[grid_name], dtype=float).ravel() 
+            for item in items])
+    target = np.broadcast_to(np.array([float(np.ravel(item[prop])[0]) 
+            for item in items])[:, None], grid.shape).ravel()
+    lines = grid.shape[0]
+    flat = grid.ravel()
+    if prop == 's':
+        dmin, dmax = get_density_limits(subst)
+        lower, upper = np.log(0.001 * dmin), np.log(dmax)
+        def F(x, index):
+            try:
+                return subst.s(T=np.array(flat[index]), d=np.exp(x)) - \
+                        target[index]
+            except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+                return np.full(index.size, np.nan)
+    else:
+        lower, upper = subst.Tlim()
+        function = getattr(subst, prop)
+        def F(x, index):
+            try:
+                return function(T=np.array(x), d=np.array(flat[index])) - \
+                        target[index]
+            except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+                return np.full(index.size, np.nan)
+
+    x, iterations, failed = solve_monotonic(F, 
+            np.full(flat.size, lower), np.full(flat.size, upper))
+    x = x.reshape(grid.shape)
+    iterations = iterations.reshape(grid.shape)
+    failed = failed.reshape(grid.shape)
+
+    # Evaluate the properties at the solutions
+    if prop == 's':
+        T, d = grid, np.exp(x)
+    else:
+        T, d = x, grid
+    ok = failed == status_ok
+    names = props if props is not None else state_properties(subst)
+    result = {name: np.full(grid.shape, np.nan) for name in names}
+    status = failed.copy()
+    if ok.any():
+        found = evaluate_status(subst, {'T': np.array(T[ok]), 
+                'd': np.array(d[ok])}, props)
+        for name in names:
+            result[name][ok] = found[name]
+        status[ok] = np.where(found['status'] == status_ok, status_ok, 
+                status_noconv)
+    return [dict({name: value[line] for name, value in result.items()},
+                status=status[line], iterations=iterations[line])
+            for line in range(lines)]
+
+
+# ### Adaptive sampling
+# Instead of a fixed number of points, lines may be sampled until they 
+# look smooth on a diagram (see refine_adaptive()).  They start with 
+# adaptive_points evenly spaced points, and a segment is bisected no 
+# more than adaptive_depth times, or adaptive_edge_depth times to find 
+# the edge of the valid states.  Unless a request allows more, no line
+# has more than adaptive_max_points points.
+adaptive_points = 9
+adaptive_depth = 12
+adaptive_edge_depth = 9
+adaptive_max_points = 200
+# Lines in a plot window start with the points of a fixed line, along 
+# grids that are clipped to the window, and they are refined no more 
+# than adaptive_window_passes times.  Each pass costs another call to 
+# state() for every family, so a windowed request costs no more than one
+# on the fixed grid.
+adaptive_window_passes = 0
+# The default axes of a diagram (see static_joe/script.js), and the 
+# properties that are plotted on a logarithmic scale
+adaptive_axes = ('s', 'T')
+log_axes = ('p', 'd', 'v')
+
+
+def _concat_tree(parts):
+    """Concatenate the arrays of a list of dicts
+    tree = _concat_tree(parts)
+
+The PARTS have the same (possibly nested) dicts of arrays, and TREE has
+their arrays concatenated in order.
+"""
+    if isinstance(parts[0], dict):
+        return {name: _concat_tree([part[name] for part in parts]) 
+                for name in parts[0]}
+    return np.concatenate([np.ravel(part) for part in parts])
+
+
+def _take_tree(tree, index):
+    """Select the same elements from every array of a dict
+    tree = _take_tree(tree, index)
+"""
+    if isinstance(tree, dict):
+        return {name: _take_tree(value, index) for name, value in tree.items()}
+    return np.ravel(tree)[index]
+
+
+def plot_coordinates(result, axes=adaptive_axes):
+    """Return the diagram coordinates of evaluated states
+    xy = plot_coordinates(result, axes=adaptive_axes)
+
+RESULT is a dict of property arrays, and AXES are the names of the 
+properties on the x- and y-axes.  XY is an (m, 2) array of their values,
+or of their base-10 logarithms for the properties in log_axes.  The 
+coordinates of the states that failed (see drop_nan()) are NaN.
+"""
+    xy = np.stack([np.asarray(result[name], dtype=float).ravel() 
+            for name in axes], axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for column, name in enumerate(axes):
+            if name in log_axes:
+                value = xy[:, column]
+                xy[:, column] = np.log10(np.where(value > 0, value, np.nan))
+    status = result.get('status')
+    if status is not None:
+        status = np.ravel(status)
+        xy[(status != status_ok) & (status != status_ambiguous)] = np.nan
+    return xy
+
+
+@functools.lru_cache(maxsize=None)
+def _axis_span(idstr, axes):
+    subst = pm.get(idstr)
+    Tmin, pmin, Tmax, pmax = get_practical_limits(subst)
+    corners = {'T': np.array([Tmin, Tmin, Tmax, Tmax]),
+            'p': np.array([pmin, pmax, pmin, pmax])}
+    xy = plot_coordinates(evaluate_status(subst, corners, list(axes)), axes)
+    span = []
+    for column in xy.T:
+        column = column[np.isfinite(column)]
+        value = column.max() - column.min() if column.size else 0.
+        span.append(float(value) if value > 0 else 1.)
+    return tuple(span)
+
+def get_axis_span(subst, axes=adaptive_axes):
+    """Return the extent of a diagram of a substance
+    span = get_axis_span(subst, axes=adaptive_axes)
+
+SPAN is a tuple with the range of each of the AXES (see 
+plot_coordinates()) over the corners of the practical limits (see 
+get_practical_limits()), which is roughly the extent of a diagram of the
+whole substance.  It is only computed once for each substance and pair 
+of axes.
+"""
+    return _axis_span(subst.data['id'], tuple(axes))
+
+
+def _chord_deviation(a, m, b):
+    """Return the distance of midpoints from the chords between their ends
+    deviation = _chord_deviation(a, m, b)
+
+A, M, and B are (s, k, 2) arrays of the coordinates of the ends and the
+midpoints of s segments of k curves.  DEVIATION is the largest distance
+of each midpoint from the chord of its curve, ignoring the curves with 
+a point that failed.
+"""
+    chord = b - a
+    offset = m - a
+    length = np.sum(chord**2, axis=-1)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        u = np.clip(np.sum(offset*chord, axis=-1) / length, 0., 1.)
+    u = np.where(length > 0, u, 0.)
+    distance = np.sqrt(np.sum((offset - u[..., None]*chord)**2, axis=-1))
+    return np.where(np.isfinite(distance), distance, 0.).max(axis=-1)
+
+
+def _in_window(a, b, window, margin=False):
+    """Test which segments cross a window
+    inside = _in_window(a, b, window, margin=False)
+
+A and B are (s, k, 2) arrays of the coordinates of the ends of s 
+segments of k curves, and WINDOW is (xmin, xmax, ymin, ymax).  A segment
+of any curve crosses it if their bounding boxes overlap, ignoring an 
+end that failed.  If MARGIN is True, the box of each segment is grown by
+its own size, since the curve between the ends may bulge into the 
+window.
+"""
+    lower, upper = np.fmin(a, b), np.fmax(a, b)
+    if margin:
+        size = np.max(upper - lower, axis=-1, keepdims=True)
+        size = np.where(np.isfinite(size), size, 0.)
+        lower, upper = lower - size, upper + size
+    inside = (upper[..., 0] >= window[0]) & (lower[..., 0] <= window[1]) & \
+            (upper[..., 1] >= window[2]) & (lower[..., 1] <= window[3])
+    return inside.any(axis=-1)
+
+
+def refine_adaptive(t, payloads, evaluate, coordinates, span, tol, 
+        max_points=None, window=None, depth=None, passes=None):
+    """Refine sampled lines until they are smooth on a diagram
+    t, payloads, count = refine_adaptive(t, payloads, evaluate, 
+            coordinates, span, tol, max_points=None, window=None, 
+            depth=None, passes=None)
+
+T is a list of the parameter arrays of the lines (e.g. the temperatures
+along isobars), and PAYLOADS is a list of the dicts of property arrays 
+(possibly nested) that were evaluated at them.  EVALUATE(LINES, T) 
+evaluates new points, where LINES is a nondecreasing array of the 
+indices of their lines and T are their parameters, and it returns a 
+single payload with an element for each point.  COORDINATES(PAYLOAD) 
+returns an (m, k, 2) array of the diagram coordinates (see 
+plot_coordinates()) of the k curves that a payload of m points 
+describes (e.g. the liquid and vapor sides of the steam dome).
+
+Every segment between neighbouring parameters is bisected, and so are 
+its halves, for as long as the midpoint lies farther than TOL from the 
+chord between the ends.  Distances are measured in fractions of SPAN, 
+the extent of the diagram along each axis (see get_axis_span()).  A 
+segment with a point that failed and one that did not is also bisected,
+to find the edge of the valid states, until it is narrower than 
+2**-adaptive_edge_depth of its line.  Segments of zero width (e.g. 
+between the liquid and the vapor where a line crosses the saturation 
+line) are never bisected, nor are those narrower than 2**-DEPTH 
+(adaptive_depth if None) of their line.  No line grows beyond MAX_POINTS 
+(adaptive_max_points if None) points; when a line runs out of room, the
+segments with the largest deviations are bisected first.  All the 
+midpoints of a pass are evaluated by a single call to EVALUATE, and no 
+more than PASSES passes are made (as many as needed if None).
+
+WINDOW is None, or the (xmin, xmax, ymin, ymax) bounds of the visible 
+part of the diagram in the same coordinates.  Then, only the segments 
+near it are bisected (see _in_window()), and the points that are not on
+a segment that crosses it are removed from the results, so the lines 
+just reach its edges.
+
+Returns the sorted parameters and payloads of the lines, with every 
+point that was evaluated (or only the visible ones), and COUNT, the 
+number of points that were added.
+"""
+    if max_points is None:
+        max_points = adaptive_max_points
+    if depth is None:
+        depth = adaptive_depth
+    span = np.asarray(span, dtype=float)
+    if window is not None:
+        window = np.asarray(window, dtype=float) / np.repeat(span, 2)
+    params = [[np.asarray(value, dtype=float).ravel()] for value in t]
+    parts = [[payload] for payload in payloads]
+    sizes = [value[0].size for value in params]
+    if not params:
+        return [], [], 0
+
+    # The open segments of all the lines: their line, the parameters and
+    # coordinates of their ends, and the deviation of their parents
+    line, ta, tb, xya, xyb = [], [], [], [], []
+    width = np.zeros(len(params))
+    edge_width = np.zeros(len(params))
+    for index, (value, payload) in enumerate(zip(params, payloads)):
+        order = np.argsort(value[0], kind='stable')
+        tt = value[0][order]
+        xy = coordinates(payload)[order] / span
+        if tt.size:
+            width[index] = (tt[-1] - tt[0]) * 2.**-depth
+            edge_width[index] = (tt[-1] - tt[0]) * 2.**-adaptive_edge_depth
+        segment = np.flatnonzero(tt[1:] > tt[:-1])
+        line.append(np.full(segment.size, index))
+        ta.append(tt[segment])
+        tb.append(tt[segment+1])
+        xya.append(xy[segment])
+        xyb.append(xy[segment+1])
+    line, ta, tb = np.concatenate(line), np.concatenate(ta), np.concatenate(tb)
+    xya, xyb = np.concatenate(xya), np.concatenate(xyb)
+    priority = np.full(line.size, np.inf)
+
+    count = 0
+    while line.size and (passes is None or passes > 0):
+        if passes is not None:
+            passes -= 1
+        # Only bisect the segments that are wide enough, and no more of a
+        # line's segments than it has room for.
+        wide = (tb - ta) > width[line]
+        if window is not None:
+            wide &= _in_window(xya, xyb, window, margin=True)
+        keep = np.zeros(line.size, dtype=bool)
+        for index in np.unique(line[wide]):
+            candidates = np.flatnonzero(wide & (line == index))
+            room = max_points - sizes[index]
+            if room <= 0:
+                continue
+            if candidates.size > room:
+                candidates = candidates[np.argsort(-priority[candidates], 
+                        kind='stable')[:room]]
+            keep[candidates] = True
+            sizes[index] += candidates.size
+        if not keep.any():
+            break
+        order = np.flatnonzero(keep)
+        order = order[np.argsort(line[order], kind='stable')]
+        line, ta, tb = line[order], ta[order], tb[order]
+        xya, xyb = xya[order], xyb[order]
+
+        tm = 0.5 * (ta + tb)
+        payload = evaluate(line, tm)
+        xym = coordinates(payload) / span
+        count += tm.size
+        for index in np.unique(line):
+            points = np.flatnonzero(line == index)
+            params[index].append(tm[points])
+            parts[index].append(_take_tree(payload, points))
+
+        deviation = _chord_deviation(xya, xym, xyb)
+        valid = [np.isfinite(xy).all(axis=-1) for xy in (xya, xym, xyb)]
+        edge = np.any((valid[0] != valid[1]) | (valid[1] != valid[2]), axis=-1)
+        split = (deviation > tol) | \
+                (edge & (tm - ta > edge_width[line]))
+        priority = np.where(edge, np.inf, deviation)[split]
+        priority = np.concatenate([priority, priority])
+        line = np.concatenate([line[split], line[split]])
+        ta, tb = np.concatenate([ta[split], tm[split]]), \
+                np.concatenate([tm[split], tb[split]])
+        xya, xyb = np.concatenate([xya[split], xym[split]]), \
+                np.concatenate([xym[split], xyb[split]])
+
+    t, payloads = [], []
+    for value, part in zip(params, parts):
+        value = np.concatenate(value)
+        order = np.argsort(value, kind='stable')
+        if window is not None:
+            payload = _take_tree(_concat_tree(part), order)
+            xy = coordinates(payload) / span
+            visible = _in_window(xy[:-1], xy[1:], window)
+            keep = np.zeros(order.size, dtype=bool)
+            keep[:-1] |= visible
+            keep[1:] |= visible
+            order = order[keep]
+        t.append(value[order])
+        payloads.append(_take_tree(_concat_tree(part), order))
+    return t, payloads, count
+
+
+def window_sampling(subst, axes, window):
+    """Return the adaptive sampling settings of a plot window
+    span, bounds, depth = window_sampling(subst, axes, window)
+
+WINDOW is None, or the (xmin, xmax, ymin, ymax) bounds in canonical 
+units of the visible part of a diagram with AXES.  SPAN and BOUNDS are
+the extent and the bounds of the window in diagram coordinates (see 
+plot_coordinates()), and DEPTH is the number of times a segment may be 
+bisected (see refine_adaptive()).  It grows with the zoom, so a small 
+window is resolved as finely as the whole diagram, when the number of 
+passes (adaptive_window_passes) allows it.  Without a WINDOW, 
+the diagram is the whole substance (see get_axis_span()).  Raises 
+PMParamError if a bound of a logarithmic axis is not positive.
+"""
+    full = np.asarray(get_axis_span(subst, axes))
+    if window is None:
+        return tuple(full), None, adaptive_depth
+    bounds = np.array(window, dtype=float).reshape(2, 2)
+    for row, name in enumerate(axes):
+        if name in log_axes:
+            if np.any(bounds[row] <= 0):
+                raise pm.utility.PMParamError(
+                        f'The window bounds of {name} must be positive.')
+            bounds[row] = np.log10(bounds[row])
+    span = bounds[:, 1] - bounds[:, 0]
+    zoom = np.max(full / span)
+    depth = adaptive_depth + max(0, int(np.ceil(np.log2(zoom))))
+    # Stay well clear of the resolution of the parameters
+    depth = min(depth, 40)
+    return tuple(span), tuple(bounds.ravel()), depth
+
+
+def _window_limits(limits, axes, window):
+    """Limit the practical limits of a substance to a plot window
+    limits = _window_limits(limits, axes, window)
+
+LIMITS are (Tmin, pmin, Tmax, pmax) (see get_practical_limits()).  The
+temperature and pressure ranges are limited by _window_range(), so that
+the grids of isolines (see iso_line_args()) only span the window.
+"""
+    Tmin, pmin, Tmax, pmax = limits
+    Tmin, Tmax = _window_range(axes, window, 'T', Tmin, Tmax)
+    pmin, pmax = _window_range(axes, window, 'p', pmin, pmax)
+    return Tmin, pmin, Tmax, pmax
+
+
+def _window_range(axes, window, name, lower, upper):
+    """Limit the range of a property to a plot window
+    lower, upper = _window_range(axes, window, name, lower, upper)
+
+If NAME is on one of the AXES of WINDOW (see window_sampling()), and the
+window overlaps the range from LOWER to UPPER, the overlap is returned.
+Otherwise, the range is unchanged.
+"""
+    if window is None or name not in axes:
+        return lower, upper
+    row = list(axes).index(name)
+    low = max(lower, window[2*row])
+    high = min(upper, window[2*row + 1])
+    if low < high:
+        return low, high
+    return lower, upper
+
+
+def _window_values(axes, window, name, values):
+    """Select the values of a property that are inside a plot window
+    visible = _window_values(axes, window, name, values)
+
+VISIBLE is a boolean array that marks the VALUES of NAME that are inside
+the WINDOW (see window_sampling()), so a line on which NAME is constant
+can be seen.  If NAME is not on one of the AXES, all of them are marked.
+"""
+    values = np.asarray(values, dtype=float)
+    if window is None or name not in axes:
+        return np.ones(values.shape, dtype=bool)
+    row = list(axes).index(name)
+    return (values >= window[2*row]) & (values <= window[2*row + 1])
+
+
+def iso_line_grid(prop):
+    """Return the property that varies along an isoline
+    name = iso_line_grid(prop)
+
+Lines of T are evaluated along pressures, lines of h and e along 
+densities, and the others along temperatures (see iso_line_args()).
+"""
+    return {'T': 'p', 'h': 'd', 'e': 'd'}.get(prop, 'T')
+
+
+def iso_line_parameter(prop, value):
+    """Return the adaptive sampling parameter of an isoline's grid
+    t = iso_line_parameter(prop, value)
+
+VALUE is an array of the grid (see iso_line_grid()) of a line of PROP.
+Pressures and densities are spaced logarithmically, so T is their 
+natural logarithm.  Temperatures are used as they are.
+"""
+    value = np.asarray(value, dtype=float)
+    return np.log(value) if iso_line_grid(prop) in ('p', 'd') else value
+
+
+def refine_iso_family(subst, prop, items, lines, tol, max_points=None, 
+        axes=adaptive_axes, props=None, method='direct', t=None, 
+        window=None):
+    """Adaptively refine the lines of an isoline family
+    lines = refine_iso_family(subst, prop, items, lines, tol, 
+            max_points=None, axes=adaptive_axes, props=None, 
+            method='direct', t=None, window=None)
+
+ITEMS are the state() arguments of each line (see iso_line_args()), and
+LINES are their results (see evaluate_iso_family()).  Points are added 
+between them until they are within TOL of a smooth line on a diagram 
+with AXES, with no more than MAX_POINTS points per line (see 
+refine_adaptive()).  The new points are evaluated with the same PROPS 
+and METHOD, which must include the AXES.  T is a list of the parameters
+of the points of each line (see iso_line_parameter()).  If it is None, 
+they are those of ITEMS.  If WINDOW is not None, the lines are only 
+refined and returned where they are visible in it (see 
+window_sampling()), in no more than adaptive_window_passes passes.
+"""
+    grid = iso_line_grid(prop)
+    if t is None:
+        t = [iso_line_parameter(prop, item[grid]) for item in items]
+    scale = np.exp if grid in ('p', 'd') else (lambda value: value)
+
+    def evaluate(index, value):
+        midpoints = []
+        for line, point in zip(index, scale(value)):
+            item = dict(items[line])
+            item[grid] = point
+            if 'x' in item and prop != 'x':
+                item['x'] = -1.
+            midpoints.append(item)
+        try:
+            return _concat_tree(evaluate_iso_family(subst, prop, midpoints, 
+                    props, method))
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
+            # Every point was out of bounds
+            failed = {name: np.full(index.size, np.nan) for name in lines[0]}
+            failed['status'] = np.full(index.size, status_oob, dtype=np.uint8)
+            if 'iterations' in failed:
+                failed['iterations'] = np.zeros(index.size, dtype=int)
+            return failed
+
+    def coordinates(payload):
+        return plot_coordinates(payload, axes)[:, None, :]
+
+    span, bounds, depth = window_sampling(subst, axes, window)
+    passes = None if window is None else adaptive_window_passes
+    t, lines, count = refine_adaptive(t, lines, evaluate, coordinates, 
+            span, tol, max_points, bounds, depth, passes)
+    return lines
+
+
+def refine_saturation(subst, tol, max_points=None, axes=adaptive_axes, 
+        props=None, dome=True, qualities=(), window=None):
+    """Adaptively sample the saturation states
+    data = refine_saturation(subst, tol, max_points=None, 
+            axes=adaptive_axes, props=None, dome=True, qualities=(), 
+            window=None)
+
+Saturation states (see saturation_states()) are evaluated at 
+temperatures between the triple and the critical points (see 
+dome_temperatures()) of the multi-phase SUBST, and more temperatures 
+are added until the curves drawn from them are within TOL of smooth 
+curves on a diagram with AXES, with no more than MAX_POINTS points (see
+refine_adaptive()).  If DOME is True, the curves are the liquid and 
+vapor sides of the steam dome, and there is a curve for the mixture at
+each of the QUALITIES (see mix_states()).  PROPS must include the AXES.
+If WINDOW is not None, the curves start with dome_points temperatures 
+in it, and they are only refined and returned where they are visible in
+it (see window_sampling()), in no more than adaptive_window_passes 
+passes.
+"""
+    curves = (['liquid', 'vapor'] if dome else []) + list(qualities)
+
+    def evaluate(index, T):
+        return saturation_states(subst, T, props)
+
+    def coordinates(payload):
+        xy = []
+        for curve in curves:
+            if isinstance(curve, str):
+                xy.append(plot_coordinates(dict(payload[curve], 
+                        status=payload['status']), axes))
+            else:
+                xy.append(plot_coordinates(mix_states(payload, curve), axes))
+        return np.stack(xy, axis=1)
+
+    points = adaptive_points if window is None else dome_points
+    T = dome_temperatures(subst, points)
+    T = np.linspace(*_window_range(axes, window, 'T', T[0], T[-1]), points)
+    span, bounds, depth = window_sampling(subst, axes, window)
+    passes = None if window is None else adaptive_window_passes
+    t, data, count = refine_adaptive([T], [evaluate(None, T)], evaluate, 
+            coordinates, span, tol, max_points, bounds, depth, passes)
+    return data[0]
+
+
+def _sampling_props(props, axes):
+    """Return the properties to evaluate for adaptive sampling
+    names = _sampling_props(props, axes)
+
+NAMES are the requested PROPS and the properties on the AXES, or None if
+PROPS is None (all of the properties).  The extra properties are removed
+again by _strip_props().
+"""
+    if props is None:
+        return None
+    return list(props) + [name for name in axes if name not in props]
+
 
-    return states
+def _strip_props(data, props):
+    """Remove the properties that were only evaluated for sampling
+    data = _strip_props(data, props)
+
+DATA is a result dict (possibly nested, or a list of them), and PROPS 
+are the names of the properties that were requested, or None for all of
+them.
+"""
+    if props is None:
+        return data
+    if isinstance(data, list):
+        return [_strip_props(item, props) for item in data]
+    return {name: _strip_props(value, props) if isinstance(value, dict) 
+            else value for name, value in data.items()
+            if isinstance(value, dict) or name in props or 
+                    name in ('status', 'iterations', 'index')}
+
+
+def compute_iso_line(subst, n=25, scaling='linear', props=None, 
+        method='direct', tol=None, max_points=None, axes=adaptive_axes,
+        window=None, **kwargs):
+    """
+    Compute a constant line for a given property at a given value
+    :param subst: a pyromat substance object
+    :param n: The number of points to compute to define the line
+    :param scaling: Should point spacing be 'linear' or 'log'
+    :param props: The names of the properties to return (see
+                    evaluate_props()), or None for all of them
+    :param method: How lines of h, e, and s are solved: 'direct' or
+                    'independent' (see evaluate_iso_family())
+    :param tol: If not None, the lines are sampled adaptively instead of
+                    at n points, until they are within tol (a fraction 
+                    of the extent of the diagram) of smooth lines (see 
+                    refine_iso_family())
+    :param max_points: The largest number of points on an adaptive line
+    :param axes: The properties on the axes of the diagram on which 
+                    adaptive lines are judged
+    :param window: The (xmin, xmax, ymin, ymax) bounds of the visible 
+                    part of that diagram, or None.  Adaptive lines are
+                    only computed where they are visible, starting from
+                    n points (see window_sampling()).
+    :param kwargs: A property specified by name. If 'default' is specified in
+                    kwargs, the value of the prop will be ignored and a set
+                    of default lines for that prop will be computed (see
+                    get_default_lines()).  If the value is an array with 
+                    more than one element, a line is computed for each.
+    :return: A dict containing arrays of properties, including the status
+                of each point (see evaluate_status()). If 'default' flag 
+                is set (or several values are given) the response will be
+                an array of dicts representing all the individual lines.
+
+    The arguments of all the lines (see iso_line_args()) are evaluated 
+    together (see evaluate_iso_family()), and the result is split into 
+    the lines.  Lines that cannot be constructed, and lines in which no point
+    could be evaluated, are omitted from a family.  Adaptive lines start
+    with adaptive_points points, and the new points of every line are 
+    evaluated together in each pass.  With a window, they start with n 
+    points along grids that are clipped to it instead, and they are 
+    refined no more than adaptive_window_passes times, so they cost no 
+    more than lines on the fixed grid.
+    """
+
+    # Perform a default computation
+    if len(kwargs) != 1:
+        if 'default' not in kwargs or len(kwargs) != 2:
+            raise pm.utility.PMParamError("Specify exactly one property "
+                                          "for an isoline")
+
+    default = kwargs.pop('default', False)
+    prop, value = list(kwargs.items())[0]  # only value left is prop
+    if not hasattr(subst, prop):
+        raise pm.utility.PMParamError(f"{subst} has no such property: {prop}")
+    limits = get_practical_limits(subst)
+    if default:
+        values = np.ravel(get_default_lines(subst, prop, limits))
+    else:
+        values = np.asarray(value, dtype=float).reshape(-1)
+    family = default or len(values) > 1
+    adaptive = tol is not None
+    if adaptive and family:
+        values = values[_window_values(axes, window, prop, values)]
+    line_limits = limits
+    if adaptive:
+        if window is None:
+            n = adaptive_points
+        eval_props = _sampling_props(props, axes)
+        line_limits = _window_limits(limits, axes, window)
+
+    # Build the arguments of every line
+    items = []
+    for val in values:
+        try:
+            items.append(iso_line_args(subst, prop, float(val), n, 
+                    line_limits))
+        except pm.utility.PMParamError:
+            if not family:
+                raise
+    if not items:
+        return []
+    # Lines that cross the saturation line have an x argument, so the 
+    # others are given one that is ignored.
+    if any('x' in item for item in items) and prop != 'x':
+        for item in items:
+            if 'x' not in item:
+                size = len(next(value for value in item.values() 
+                        if np.ndim(value)))
+                item['x'] = -np.ones(size)
+
+    if adaptive:
+        lines = evaluate_iso_family(subst, prop, items, eval_props, method)
+        lines = refine_iso_family(subst, prop, items, lines, tol, 
+                max_points, axes, eval_props, method, window=window)
+        lines = _strip_props(lines, props)
+    else:
+        lines = evaluate_iso_family(subst, prop, items, props, method)
+    if not family:
+        return lines[0]
+    return [line for line in lines 
+            if np.any((line['status'] == status_ok) | 
+                    (line['status'] == status_ambiguous))]
+
+
+def _insert_states(line, index, states):
+    """Insert states into a line
+    line = _insert_states(line, index, states)
+
+STATES is a list of dicts of the property values of single states, which
+are inserted in that order before the point at INDEX.
+"""
+    return {name: np.insert(value, index, [state[name] for state in states])
+            for name, value in line.items()}
+
+
+def compute_auxlines(subst, lines=None, dome=True, n=25, props=None,
+        method='direct', tol=None, max_points=None, axes=adaptive_axes,
+        window=None):
+    """Compute the steam dome and default isoline families of a substance
+    data = compute_auxlines(subst, lines=None, dome=True, n=25, props=None,
+            method='direct', tol=None, max_points=None, axes=adaptive_axes,
+            window=None)
+
+LINES is a list of the properties held constant by the default families
+to compute (see get_default_lines()).  If it is None, families of x (for
+multi-phase substances), p, T, d, h, and s are computed.  If DOME is 
+True and the substance is multi-phase, the steam dome is included, as 
+it is returned by the saturation route.  N is the number of points on 
+each line, and PROPS are the names of the properties to return (see 
+evaluate_props()), or None for all of them.  METHOD determines how the 
+families of h, e, and s are solved (see evaluate_iso_family()).  If TOL
+is not None, the lines are sampled adaptively on a diagram with AXES 
+instead of at N points, with no more than MAX_POINTS points each (see 
+refine_adaptive()).  If WINDOW is also given, they are only computed 
+where they are visible in it (see window_sampling()).
+
+Each pass of refine_adaptive() makes another call to state() for every
+family, and the cost of a call to the iterative solvers hardly depends 
+on its size.  So, with a WINDOW, the lines start with N points along 
+grids that are clipped to the window, and they are refined no more than
+adaptive_window_passes times.  The points are spent where they can be 
+seen, and a windowed call is no slower than one on the fixed grid.
+
+DATA is a dict with a 'dome' entry (see saturation_states()) and an 
+entry for each property in LINES, which is the list of lines returned by
+compute_iso_line() for the default family.  
+
+The work that the separate requests would repeat is only done once.  The
+limits, triple, and critical points are found once, and the saturation 
+states of the dome, the quality lines, and the points where isobars and
+isotherms cross the saturation line are evaluated together in a single 
+call.  The quality lines are mixtures of those states (see mix_states()),
+and the crossing points are inserted into the isobars and isotherms 
+instead of being evaluated with them.  The remaining points of each 
+family are evaluated together.  When the lines are sampled adaptively, 
+the dome and the quality lines are refined together (see 
+refine_saturation()), and the crossing points are inserted into the 
+isobars and isotherms before they are refined.
+"""
+    multiphase = ismultiphase(subst)
+    if lines is None:
+        lines = ['x', 'p', 'T', 'd', 'h', 's'] if multiphase else \
+                ['p', 'T', 'd', 'h', 's']
+    if 'x' in lines and not multiphase:
+        raise pm.utility.PMParamError('x cannot be computed for non-'
+                                      'multiphase substances.')
+    dome = dome and multiphase
+    limits = get_practical_limits(subst)
+    values = {prop: np.ravel(get_default_lines(subst, prop, limits)) 
+            for prop in lines}
+    adaptive = tol is not None
+    eval_props = props
+    line_limits = limits
+    if adaptive:
+        if window is None:
+            n = adaptive_points
+        eval_props = _sampling_props(props, axes)
+        line_limits = _window_limits(limits, axes, window)
+        values = {prop: value[_window_values(axes, window, prop, value)]
+                for prop, value in values.items()}
+
+    # Collect the saturation temperatures of every part in one array.
+    # Isobars cross the saturation line at Ts(p), and isotherms cross it
+    # at ps(T), along the grids of iso_line_args().
+    parts = {}
+    crossings = {}
+    sat_T = []
+    def collect(name, T):
+        start = sum(item.size for item in sat_T)
+        parts[name] = slice(start, start + np.size(T))
+        sat_T.append(np.ravel(T))
+    if multiphase:
+        Tt, pt = subst.triple()
+        Tc, pc = subst.critical()
+        if adaptive:
+            if dome or 'x' in lines:
+                refined = refine_saturation(subst, tol, max_points, axes, 
+                        eval_props, dome, values.get('x', ()), window)
+        elif dome:
+            collect('dome', dome_temperatures(subst))
+        if 'x' in lines and not adaptive:
+            collect('x', np.linspace(limits[0], Tc, n))
+        if 'p' in values:
+            p = values['p']
+            crossing = (p > pt) & (p < pc)
+            Ts = np.full(p.shape, np.nan)
+            if crossing.any():
+                Ts[crossing] = subst.Ts(p=np.array(p[crossing]))
+            crossings['p'] = Ts
+            collect('p', Ts)
+        if 'T' in values:
+            T = values['T']
+            crossing = (T > Tt) & (T < Tc)
+            ps = np.full(T.shape, np.nan)
+            if crossing.any():
+                ps[crossing] = subst.ps(T=np.array(T[crossing]))
+            crossings['T'] = ps
+            collect('T', np.where(crossing, T, np.nan))
+    if sat_T:
+        sat_T = np.concatenate(sat_T)
+        sat = saturation_states(subst, sat_T, eval_props, 
+                valid=np.isfinite(sat_T))
+    def saturated(name):
+        if adaptive and name in ('dome', 'x'):
+            return refined
+        index = parts[name]
+        return {'liquid': {key: value[index] 
+                        for key, value in sat['liquid'].items()},
+                'vapor': {key: value[index] 
+                        for key, value in sat['vapor'].items()},
+                'status': sat['status'][index]}
+
+    def usable(family):
+        return [line for line in family 
+                if np.any((line['status'] == status_ok) | 
+                        (line['status'] == status_ambiguous))]
+
+    data = {}
+    if dome:
+        data['dome'] = saturated('dome')
+    for prop in lines:
+        if prop == 'x':
+            states = saturated('x')
+            data[prop] = usable([mix_states(states, x) for x in values[prop]])
+            continue
+        items = []
+        family_values = []
+        for index, value in enumerate(values[prop]):
+            try:
+                items.append(iso_line_args(subst, prop, float(value), n, 
+                        line_limits, insert=False))
+                family_values.append(index)
+            except pm.utility.PMParamError:
+                pass
+        if not items:
+            data[prop] = []
+            continue
+        family = evaluate_iso_family(subst, prop, items, eval_props, method)
+        grid = iso_line_grid(prop)
+        t = [iso_line_parameter(prop, item[grid]) for item in items]
+        if prop in crossings:
+            # Insert the saturated liquid and vapor at the crossings.  The
+            # temperature increases along isobars, and the pressure 
+            # increases along isotherms.
+            states = saturated(prop)
+            liquid, vapor = mix_states(states, 0.), mix_states(states, 1.)
+            order = (liquid, vapor) if prop == 'p' else (vapor, liquid)
+            for item, index in enumerate(family_values):
+                point = crossings[prop][index]
+                if not np.isfinite(point):
+                    continue
+                at = int(np.searchsorted(items[item][grid], point, 
+                        side='right'))
+                family[item] = _insert_states(family[item], at, 
+                        [{name: value[index] for name, value in state.items()}
+                            for state in order])
+                t[item] = np.insert(t[item], at, 
+                        iso_line_parameter(prop, [point, point]))
+        if adaptive:
+            family = refine_iso_family(subst, prop, items, family, tol, 
+                    max_points, axes, eval_props, method, t, window)
+        data[prop] = usable(family)
+    if adaptive:
+        data = {name: _strip_props(value, props) 
+                for name, value in data.items()}
+    return data
 
 
 
@@ -531,6 +2645,23 @@ out = {'message':mh._messagestr, 'error':mh._errorflag, 'warn:mh._warnflag}
 ###
 
 
+class PMGISubRequest:
+    """A stand-in for a Flask request that carries an arguments dict
+    sub = PMGISubRequest(args)
+
+The request handler classes are initialized with a Flask request 
+object, but they only use its method and its arguments.  PMGISubRequest
+behaves like a POST request with the ARGS dict as its JSON body, so a 
+handler can be constructed without an HTTP request of its own (e.g. for 
+each of the requests in a BatchRequest).
+"""
+    method = 'POST'
+    
+    def __init__(self, args):
+        self.json = args
+        self.args = {}
+
+
 class PMGIRequest:
     """The PYroMat Gateway Interface Request class
 
@@ -582,12 +2713,20 @@ A request handling process should follow these steps:
     process_units() will assert any units settings found in the 
     arguments.  See above for how units are specified.
     
-    Specified units will be asserted in the PYroMat configuration 
-    system.  Unspecified units will be returned to their default and
-    written to the dictionary, so that they may be displayed by the live
-    page.
+    Specified units will be asserted in a request-local context that 
+    PYroMat consults through its configuration system.  Unspecified units
+    will be set to their default and written to the dictionary, so that 
+    they may be displayed by the live page.
+
+(3) Admit
+    The admit() method estimates the cost of the request with the 
+    estimate() method, which child classes that perform computations 
+    should define.  Requests that are too expensive, or that exceed 
+    their client's rate limit, are rejected with an appropriate status.
+    If the 'dryrun' argument is set, the estimate is written to the data
+    attribute instead of processing the request.
     
-(3) Process
+(4) Process
     There is a generic process() method defined by the parent 
     PMGIRequest prototype, but it does nothing.  Each child request 
     handler should define its own process method, which is responsible
@@ -601,13 +2740,14 @@ A request handling process should follow these steps:
     The get_substance() is a method provided by PMGIRequest that will
     probably be helpful in this step.
     
-(4) Output
+(5) Output
     The final output process should almost always be handled by the 
     PMGIRequest.output() prototype method.  It assembles the data, args,
-    units, and mh attributes into a standard JSON-compatible dictionary 
-    and returns it.  Using the same output method for all classes 
-    ensures that the PMGI output will always adopt a standard form, so
-    custom output() methods should be avoided.
+    units, and mh attributes into a standard dictionary and returns it.
+    The response() method encodes it as JSON (or in the binary format 
+    requested by the Accept header).  Using the same output method for
+    all classes ensures that the PMGI output will always adopt a 
+    standard form, so custom output() methods should be avoided.
     
 There are several methods that automate steps of this process.
 
@@ -618,26 +2758,142 @@ get_substance()
     on failure and False on success.
     
 output()
-    The output method automates step 4, and is described above and in 
+    The output method automates step 5, and is described above and in 
     its own in-line documentation.
     
 process_units()
     The process_units() method is designed to automate step 2, and is
     described above.  It handles error logging and returns True on 
     failure and False on success.
+
+The run_request() function automates all five steps, and it queues 
+expensive requests (see CostQueue).  Classes that do not need step 2 set 
+their uses_units attribute to False.  The status and headers attributes
+hold the HTTP status and any extra headers of the response.
+
+Before a request is admitted, run_request() also calls not_modified(),
+which answers a conditional GET request (see etag()) with 304 Not 
+Modified if the client already has the response.
 """
+    # Whether run_request() should call process_units()
+    uses_units = True
+    # Whether workspace handles in the arguments are replaced by arrays
+    uses_handles = True
+    # What is done with states that could not be evaluated: 'drop' them,
+    # write their values as 'null', or 'keep' them as NaN (see 
+    # format_data()).  Classes that evaluate states set a default, which
+    # may be changed by the nan_policy argument.  When it is None, the 
+    # argument is not recognized.
+    nan_policy = None
+    # The name of the handler's route (see routes), which selects its 
+    # settings in config['http_max_age']
+    route = None
+
     def __init__(self, request):
         # Initialize the four parts of the output
         self.mh = PMGIMessageHandler()
         self.units = {}
         self.data = {}
+        # The conversion from canonical units is set by compile_units()
+        self.conversion = None
+        # The HTTP status and any extra headers of the response
+        self.status = 200
+        self.headers = {}
+        # The client address is used for rate limiting
+        self.client = getattr(request, 'remote_addr', None)
+        # The estimated cost is set by admit()
+        self.cost = request_cost
+        # The Accept header selects the response format (see response())
+        headers = getattr(request, 'headers', None)
+        # The request headers are kept for not_modified()
+        self.method = request.method
+        self.request_headers = headers
+        self.accept = headers.get('Accept') if headers is not None else None
+        self.mimetype = negotiate(self.accept, response_types)
+        # The Accept-Encoding header selects the compression
+        self.encoding = None
+        if headers is not None:
+            self.encoding = negotiate_encoding(
+                    headers.get('Accept-Encoding'), content_encodings())
         # Read in the request data to an args dict
-        if request.method == 'POST':
+        if request.method == 'POST' and \
+                getattr(request, 'mimetype', None) == npz_type:
+            # Arrays are sent in the body, and the other arguments may
+            # be sent in the query string.
+            self.args=dict(request.args)
+            try:
+                self.args.update(decode_npz(request.get_data()))
+            except ValueError as e:
+                self.mh.error(str(e))
+                self.mh.message(repr(e.__cause__ or e))
+        elif request.method == 'POST':
             self.args=dict(request.json)
         elif request.method == 'GET':
             self.args=dict(request.args)
         else:
             self.args={}
+        # Arguments may be range expressions (see expand_range()) or 
+        # workspace handles (see store_array()), which are replaced by 
+        # their arrays here.  The expressions and the handles are echoed
+        # in place of the arrays (see echo_args()).
+        self.handles = {}
+        for name, value in self.args.items():
+            if isrange(value):
+                self.handles[name] = value
+                try:
+                    self.args[name] = expand_range(value)
+                except ValueError as e:
+                    self.mh.error(f'Invalid argument: {name}={value}  {e}.')
+        if self.uses_handles:
+            for name, value in self.args.items():
+                if ishandle(value):
+                    self.handles[name] = value
+                    found = fetch_array(value)
+                    if found is None:
+                        self.mh.error(f'Workspace handle not found: {name}={value}  It may have expired.')
+                    else:
+                        self.args[name] = found
+        # A dry run only reports the estimated cost of the request.  Like 
+        # the units, the flag is stripped from the arguments.
+        self.dryrun = False
+        if 'dryrun' in self.args:
+            try:
+                self.dryrun = tobool(self.args.pop('dryrun'))
+            except:
+                self.mh.error('Invalid argument: dryrun')
+        # When store is set, the arrays in the data are stored in the 
+        # workspace, and their handles are returned in their place.
+        self.store = False
+        if 'store' in self.args:
+            try:
+                self.store = tobool(self.args.pop('store'))
+            except:
+                self.mh.error('Invalid argument: store')
+        # The precision and dtype options reduce the size of the output
+        # (see reduce_precision()).  They are also stripped from the 
+        # arguments, and they are echoed with them by output().
+        self.precision = None
+        self.dtype = None
+        if 'precision' in self.args:
+            value = self.args.pop('precision')
+            try:
+                self.precision = int(value)
+                if not 1 <= self.precision <= 17:
+                    raise ValueError()
+            except:
+                self.mh.error(f'Invalid argument: precision={value}  The precision must be an integer from 1 to 17.')
+        if 'dtype' in self.args:
+            value = self.args.pop('dtype')
+            if value in ('float32', 'float64'):
+                self.dtype = value
+            else:
+                self.mh.error(f'Invalid argument: dtype={value}  The dtype must be float32 or float64.')
+        if self.nan_policy is not None and 'nan_policy' in self.args:
+            value = self.args.pop('nan_policy')
+            if value in ('drop', 'null', 'keep'):
+                self.nan_policy = value
+            else:
+                self.mh.error(f'Invalid argument: nan_policy={value}  The nan_policy must be drop, null, or keep.')
         
         # Build legal unit dict
         self.valid_units = {
@@ -759,48 +3015,311 @@ logged appropriately in the mh attribute.
         return False
 
     def process_units(self):
-        """Assign the units discovered in the arguments to PYroMat's settings
+        """Resolve the units discovered in the arguments
     process_units()
-    
+
 Uses the dict stored in the units attribute to determine which (if any)
-units need to be changed from the default.  If units is empty, no changes
-are made.
+units need to be changed from the default.  Unspecified units are set to
+their default values and recorded in the units dict to record the 
+system's units status.
 
-Units specified in the units dict are modified in the PYroMat system. 
-Other units found in the PMyroMat system are recorded in the units dict
-to record the system's units status.
+PYroMat is always evaluated in the canonical units (see canonical_units),
+so the units do not affect the evaluation, and the PYroMat configuration
+is not modified.  Instead, the compile_units() method prepares a conversion
+that is applied to the arguments before process() evaluates them and to
+the data by output().
 
-Returns True in the event of an error.  On success, returns False.  
+Returns True in the event of an error.  On success, returns False.
 """
         if self.mh:
             self.mh.message('Unit processing aborted due to an error.')
             return True
-        # Loop through all possible parameters, and only work on the 
-        # units.
-        for param in pm.config:
-            if param.startswith('unit_'):
-                unit = param[5:]
-                # If the unit was specified in the configuration
-                if unit in self.units:                    
-                    try:
-                        pm.config[param] = self.units[unit]
-                    except:
-                        self.mh.error('Failed to set the units as configured.')
-                        self.mh.message(repr(sys.exc_info()[1]))
-                        return True
-                # If it was not specified, return it to its default value
-                # and record it for the output record
-                else:
-                    pm.config.restore_default(param)
-                    self.units[unit] = pm.config[param]
+        # Loop through all possible units; record the defaults for the
+        # ones that were not specified.
+        for unit, value in canonical_units.items():
+            if unit not in self.units:
+                self.units[unit] = value
         return False
 
+    def compile_units(self, subst):
+        """Prepare the conversion between canonical and requested units
+    compile_units(subst)
 
-    def get_substance(self, idstr):
-        """Wrapper function for pm.get() that registers appropriate error messages
-    substance = get_substance(idstr)
+SUBST is the PYroMat substance instance being evaluated.  The resulting 
+conversion is stored in the conversion attribute.  It may be used with
+convert_units() to convert arguments to canonical units before they are 
+evaluated, and it is automatically applied to the data by output().
 
-The idstr is the ID string used by get().
+Returns True in the event of an error.  On success, returns False.
+"""
+        try:
+            self.conversion = get_conversion(subst, self.units)
+        except:
+            self.mh.error('Failed to set the units as configured.')
+            self.mh.message(repr(sys.exc_info()[1]))
+            return True
+        return False
+
+    def check_props(self, subst, props):
+        """Verify that the requested properties are available
+    check_props(subst, props)
+
+PROPS is a sequence of property names from the 'props' argument (see
+toproplist()), or None.  Returns True and logs an error if any of them 
+is not returned by SUBST's state() method.  Otherwise, returns False.
+"""
+        if props is None:
+            return False
+        valid = state_properties(subst)
+        unknown = [name for name in props if name not in valid]
+        if unknown:
+            self.mh.error('Unrecognized properties: ' + ', '.join(unknown))
+            self.mh.message('Valid properties are: ' + ', '.join(valid))
+            return True
+        return False
+
+    def check_method(self, method):
+        """Verify that an isoline method is recognized
+    check_method(method)
+
+Returns True and logs an error if METHOD is not one of iso_methods (see
+evaluate_iso_family()).  Otherwise, returns False.
+"""
+        if method not in iso_methods:
+            self.mh.error('Unrecognized isoline method: ' + repr(method))
+            self.mh.message('Valid methods are: ' + ', '.join(iso_methods))
+            return True
+        return False
+
+    def check_adaptive(self, subst, tol, max_points, axes, window=None,
+            pixels=None):
+        """Verify the adaptive sampling arguments
+    check_adaptive(subst, tol, max_points, axes, window=None, pixels=None)
+
+TOL, MAX_POINTS, AXES, WINDOW, and PIXELS are the 'tol', 'max_points', 
+'axes', 'window', and 'pixels' arguments, or None (see refine_adaptive()
+and window_sampling()).  Returns True and logs an error if any of them 
+is invalid.  Otherwise, returns False.
+"""
+        if (window is None) != (pixels is None):
+            self.mh.error('The window and pixels arguments must be given together.')
+            return True
+        if tol is None and window is None:
+            if max_points is not None or axes is not None:
+                self.mh.error('The max_points and axes arguments require tol or window.')
+                return True
+            return False
+        if tol is not None and not tol > 0:
+            self.mh.error('The tol argument must be positive.')
+            return True
+        if max_points is not None and max_points < adaptive_points:
+            self.mh.error(f'The max_points argument must be at least {adaptive_points}.')
+            return True
+        if window is not None:
+            if np.size(window) != 4 or not np.all(np.isfinite(window)) or \
+                    not (window[0] < window[1] and window[2] < window[3]):
+                self.mh.error('The window argument must be four increasing bounds: xmin, xmax, ymin, ymax.')
+                return True
+            if not pixels > 0:
+                self.mh.error('The pixels argument must be positive.')
+                return True
+        if axes is not None:
+            if len(axes) != 2:
+                self.mh.error('The axes argument must name two properties.')
+                return True
+            return self.check_props(subst, axes)
+        return False
+
+    def adaptive_sampling(self, tol, axes, window, pixels):
+        """Resolve the adaptive sampling arguments
+    tol, axes, window = adaptive_sampling(tol, axes, window, pixels)
+
+The arguments must have passed check_adaptive().  The AXES default to 
+adaptive_axes, and the WINDOW is converted from the units of the request
+to canonical units.  With a WINDOW, the TOL defaults to the width of one
+of its PIXELS, so the lines are as smooth as the display can show.
+"""
+        axes = axes or adaptive_axes
+        if window is None:
+            return tol, axes, None
+        window = np.asarray(window, dtype=float)
+        bounds = convert_units({axes[0]: window[:2], axes[1]: window[2:]}, 
+                self.conversion, inverse=True)
+        window = tuple(float(value) for name in axes for value in bounds[name])
+        if tol is None:
+            tol = 1. / pixels
+        return tol, axes, window
+
+    def adaptive_key(self, key_args, tol, max_points, axes, window=None):
+        """Add the adaptive sampling arguments to a cache key
+    adaptive_key(key_args, tol, max_points, axes, window=None)
+
+The arguments are only added to the KEY_ARGS dict if TOL is not None, so
+the keys of the fixed grids are unchanged.
+"""
+        if tol is not None:
+            key_args['tol'] = tol
+            key_args['max_points'] = max_points
+            key_args['axes'] = axes
+        if window is not None:
+            key_args['window'] = window
+
+    def cached(self, route, idstr, args, compute):
+        """Evaluate a computation through the result cache
+    result = cached(route, idstr, args, compute)
+
+ROUTE is the name of the route (e.g. 'state'), which determines the 
+expiration time of the result in config['cache_ttl'].  IDSTR and ARGS are
+the substance id string and the arguments in canonical units.  Together,
+they identify the result.  COMPUTE is a function with no arguments that
+performs the computation if the result is not already in the cache.
+
+On a cache miss, concurrent requests for the same result are coalesced
+(see SingleFlight), so COMPUTE is only called once.  When the cache is
+shared between processes (see SharedResultCache), the computation is
+also locked between processes, and a process that had to wait for the 
+lock finds the result in the cache.
+
+Exceptions raised by COMPUTE are not caught, and failed computations are
+not cached.  If caching is disabled for the route, COMPUTE is simply 
+called.
+"""
+        ttl_config = config['cache_ttl']
+        if route not in ttl_config or ttl_config[route] == 0:
+            return compute()
+        key = cache_key(route, idstr, args)
+        rc = get_result_cache()
+        result = rc.get(key)
+        if result is None:
+            def fill():
+                with rc.lock(key) as waited:
+                    # If another process held the lock, it was probably
+                    # computing this result.
+                    found = rc.get(key) if waited else None
+                    if found is None:
+                        found = compute()
+                        rc.put(key, found, ttl=ttl_config[route])
+                return found
+            result = single_flight.do(key, fill)
+        return result
+
+    def etag(self):
+        """Compute the entity tag of the response
+    tag = pr.etag()
+
+The responses of the routes listed in config['http_max_age'] depend only
+on the versions of the software, the arguments, the units, and the 
+output options (including the format and the content coding negotiated 
+from the request headers), so the tag is a hash of those (see 
+cache_key()).  Returns a quoted string, or None if the response should 
+not be cached by the client because the route is not listed, the 
+request is not a GET request, it is a dry run, its data are stored in 
+the workspace (which expires), or it has already failed.  It is called
+after process_units(), so the units are complete.
+"""
+        if self.route not in config['http_max_age'] or \
+                self.method != 'GET' or self.dryrun or self.store or self.mh:
+            return None
+        args = dict(self.echo_args())
+        # None of these are valid arguments, so they cannot collide
+        args['units'] = sorted(self.units.items())
+        args['format'] = (self.mimetype, self.encoding)
+        args['environment'] = (sys.version, np.version.full_version, 
+                flask.__version__)
+        return '"%s"' % cache_key(self.route, args.get('id'), args)[:24]
+
+    def not_modified(self):
+        """Answer a conditional request
+    stop = pr.not_modified()
+
+If the response can be cached (see etag()), the ETag, Last-Modified, 
+and Cache-Control headers are added to the response.  If the request's 
+If-None-Match header matches the tag (or, without one, if its 
+If-Modified-Since header is no older than the server), the status is 
+set to 304, and the response will have no body.
+
+Returns True if the request should not be processed.  Otherwise, returns
+False.
+"""
+        tag = self.etag()
+        if tag is None:
+            return False
+        self.headers['ETag'] = tag
+        self.headers['Last-Modified'] = last_modified
+        self.headers['Cache-Control'] = 'public, max-age=%d' % \
+                config['http_max_age'][self.route]
+        headers = self.request_headers
+        if headers is None:
+            return False
+        match = headers.get('If-None-Match')
+        if match is not None:
+            unchanged = etag_match(tag, match)
+        else:
+            unchanged = not modified_since(headers.get('If-Modified-Since'))
+        if unchanged:
+            self.status = 304
+        return unchanged
+
+    def estimate(self):
+        """Estimate the cost of processing the request
+    cost = pr.estimate()
+
+Returns the approximate CPU time needed by process() in seconds.  The 
+prototype returns request_cost, which is appropriate for requests that
+do not perform significant computations.  Child classes that do should
+define their own estimate() method.  It is called after require(), so
+the arguments have already been conditioned, but they have not yet been
+converted to canonical units.
+"""
+        return request_cost
+
+    def admit(self):
+        """Decide whether the request should be processed
+    stop = pr.admit()
+
+The cost of the request is estimated (see estimate()) and recorded in
+the cost attribute.  The request is rejected if the cost exceeds 
+config['cost_limit'] or if the client has exceeded its rate limit (see
+RateLimiter).  For a dry run, the estimate is written to the data 
+attribute.
+
+Returns True if the request should not be processed because it was 
+rejected or because it is a dry run.  Otherwise, returns False.  
+Requests that have already failed are left for process() to report.
+"""
+        if self.mh:
+            return False
+        try:
+            self.cost = self.estimate()
+        except Exception:
+            # Leave the error for process() to report
+            self.cost = request_cost
+        limit = config['cost_limit']
+        if self.dryrun:
+            queue = config['cost_queue']
+            self.data = {
+                'cost': self.cost,
+                'admitted': limit is None or self.cost <= limit,
+                'queued': queue is not None and self.cost > queue}
+            return True
+        if limit is not None and self.cost > limit:
+            self.status = 413
+            self.mh.error(f'The request was estimated to take {self.cost:.3g} seconds, which exceeds the limit of {limit:.3g} seconds.')
+            self.mh.message('Split the request into smaller requests.')
+            return True
+        wait = rate_limiter.take(self.client, self.cost)
+        if wait:
+            self.status = 429
+            self.headers['Retry-After'] = str(int(np.ceil(wait)))
+            self.mh.error(f'Too many requests.  Try again in {wait:.3g} seconds.')
+            return True
+        return False
+
+    def get_substance(self, idstr):
+        """Wrapper function for pm.get() that registers appropriate error messages
+    substance = get_substance(idstr)
+
+The idstr is the ID string used by get().
 """
         substance = None
         try:
@@ -829,18 +3348,152 @@ The process method is responsible for populating the data attribute.
         return False
 
     def output(self):
-        """Generate the serializable output of the process request.
+        """Generate the output of the process request.
+
+If compile_units() was called, the data are converted from canonical
+units into the requested units.  The output may contain numpy arrays, 
+so it must be encoded by encode_json() (see response()).  If the store 
+argument was set, the arrays are stored in the workspace, and the data
+contain their handles instead (see store_arrays()).
 """
+        data = self.format_data(self.data)
+        if self.store and not self.mh:
+            try:
+                data = store_arrays(data)
+            except ValueError as e:
+                self.mh.error(f'Failed to store the data: {e}')
+                data = {}
         return {
-            'data':json_friendly(self.data), 
+            'data':data, 
             'message':self.mh.tojson(), 
             'units':self.units,
-            'args':json_friendly(self.args)
+            'args':self.echo_args()
             }
 
+    def format_data(self, data, offset=0):
+        """Prepare data for the output
+    data = pr.format_data(data, offset=0)
+
+The data are converted from canonical units into the requested units 
+(if compile_units() was called), and their precision is reduced as 
+requested (see reduce_precision()).  If the nan_policy is 'drop', the 
+states with NaN values are removed, and the indices of the others (plus
+OFFSET) are added (see drop_nan()).  A new structure is returned.
+"""
+        if self.conversion:
+            data = convert_units(data, self.conversion)
+        data = reduce_precision(data, self.precision, self.dtype)
+        if self.nan_policy == 'drop':
+            data = drop_nan(data, offset)
+        return data
+
+    def json_nan(self):
+        """Return the encoding of NaN values in the JSON output
+    nan = pr.json_nan()
+
+Returns 'literal' if the nan_policy is 'keep', 'null' if it is 'null', 
+and None (for config['json_nan'], see encode_json()) otherwise.
+"""
+        return {'keep': 'literal', 'null': 'null'}.get(self.nan_policy)
+
+    def echo_args(self):
+        """Return the arguments to be echoed in the output
+    args = pr.echo_args()
+
+The output options, which were stripped from the arguments, are echoed
+with them.  Arguments that were given as range expressions or workspace
+handles are echoed as they were given, not as the arrays.
+"""
+        args = self.args
+        nan_policy = self.nan_policy != type(self).nan_policy
+        if self.precision is not None or self.dtype is not None or \
+                self.store or self.handles or nan_policy:
+            args = dict(args)
+            args.update(self.handles)
+            if self.precision is not None:
+                args['precision'] = self.precision
+            if self.dtype is not None:
+                args['dtype'] = self.dtype
+            if self.store:
+                args['store'] = True
+            if nan_policy:
+                args['nan_policy'] = self.nan_policy
+        return args
+
+    def response(self):
+        """Generate the HTTP response of the process request.
+    body, status, headers = pr.response()
+
+BODY is the output() encoded as JSON (see encode_json()), unless the 
+request's Accept header prefers an npz archive (see encode_npz()) or
+newline-delimited JSON.  In the latter case, BODY is an iterator over 
+the lines (see stream()).  If the request's Accept-Encoding header 
+allows it, BODY is compressed (see compress()).  STATUS and HEADERS are
+the HTTP status and a dict of the response headers.
+
+A 304 Not Modified response (see not_modified()) has an empty BODY.  
+Responses that report an error are not cached by the client.
+"""
+        headers = dict(self.headers)
+        headers['Vary'] = 'Accept, Accept-Encoding'
+        if self.status == 304:
+            return b'', self.status, headers
+        elif self.status != 200 or self.mh:
+            for name in ('ETag', 'Last-Modified', 'Cache-Control'):
+                headers.pop(name, None)
+        headers['Content-Type'] = self.mimetype
+        if self.mimetype == npz_type:
+            body = encode_npz(self.output())
+        elif self.mimetype == ndjson_type:
+            body = self.stream()
+            if self.encoding is not None:
+                headers['Content-Encoding'] = self.encoding
+                body = compress_stream(body, self.encoding)
+            return body, self.status, headers
+        else:
+            body = encode_json(self.output(), nan=self.json_nan())
+        if self.encoding is not None and len(body) >= config['compress_min']:
+            headers['Content-Encoding'] = self.encoding
+            body = compress(body, self.encoding)
+        return body, self.status, headers
+
+    def stream(self):
+        """Generate the response as newline-delimited JSON records
+    for line in pr.stream():
+        ...
+
+Each line is a JSON object (bytes, ending with a newline) with a 'record'
+entry that identifies its kind:
+    header  The 'args', 'units', and 'message' entries of output()
+    data    The 'data' entry of output()
+    item    One item of the 'data' entry of output() when it is a list
+            (e.g. a batch), with its 'index'
+    chunk   A block of the 'data' arrays, from index 'start' to 'stop',
+            in the flattened arrays (see PropertyRequest.stream())
+    end     The final 'message', which includes any errors that were
+            encountered while streaming
+
+The prototype streams the output of process().  Handlers that defer 
+their computations until the response is sent override it.
+"""
+        out = self.output()
+        nan = self.json_nan()
+        yield encode_json({'record': 'header', 'args': out['args'],
+                'units': out['units'], 'message': out['message']}) + b'\n'
+        if isinstance(out['data'], list):
+            for index, item in enumerate(out['data']):
+                yield encode_json({'record': 'item', 'index': index, 
+                        'data': item}, nan=nan) + b'\n'
+        else:
+            yield encode_json({'record': 'data', 'data': out['data']}, 
+                    nan=nan) + b'\n'
+        yield encode_json({'record': 'end', 'message': self.mh.tojson()}) + b'\n'
+
 class SubstanceRequest(PMGIRequest):
     """This class handles substance metadata requests
 """
+    route = 'subst'
+
     def __init__(self, args):
         PMGIRequest.__init__(self,args)
         self.require( types={
@@ -857,7 +3510,7 @@ class SubstanceRequest(PMGIRequest):
         # Everything that's left will be arguments to the state method
         args = self.args.copy()
         subst = self.get_substance(args.pop('id'))
-        if subst is None:
+        if subst is None or self.compile_units(subst):
             return True
         
         try:
@@ -884,7 +3537,15 @@ class SubstanceRequest(PMGIRequest):
 class PropertyRequest(PMGIRequest):
     """
     This class will handle requests for properties at a fixed state or states.
+
+    The data include a 'status' array of the status code of each state 
+    (see state_status()).  States that cannot be evaluated do not fail 
+    the request; their values are NaN, which are handled according to 
+    the nan_policy (null by default).
     """
+    route = 'state'
+    nan_policy = 'null'
+
     def __init__(self, args):
         # Clean initialization
         PMGIRequest.__init__(self, args)
@@ -898,31 +3559,84 @@ class PropertyRequest(PMGIRequest):
                 'd': toarray,
                 'v': toarray,
                 'x': toarray,
+                'props': toproplist,
                 'id': str }, 
                 mandatory=['id'])
+        # The properties to evaluate are set by prepare().  None means all.
+        self.props = None
+        # When the response is streamed, process() leaves the substance
+        # and the arguments here for stream() to evaluate.
+        self.deferred = None
             
         
 
-    def process(self):
-        """Process the request
-        This method is responsible for populating the "out" member dict with
-        correctly formatted data that can be returned as a JSON object.
-        """
+    def estimate(self):
+        """Estimate the cost of processing the request
+    cost = pr.estimate()
+"""
+        args = self.args.copy()
+        subst = pm.get(args.pop('id'))
+        args.pop('props', None)
+        size = state_size(args) if args else 1
+        return request_cost + state_cost(subst, args.keys(), size)
+
+    def prepare(self):
+        """Prepare the substance and the arguments for the state method
+    subst, args = pr.prepare()
+
+ARGS are the state() arguments in canonical units.  The conversion to the
+requested units is compiled (see compile_units()), and the requested 
+properties are recorded in the props attribute.  If there is an error, 
+it is logged, and (None, None) is returned.
+"""
         # If there was an error, abort the processing
         if self.mh:
             self.mh.message('Processing aborted due to error.')
-            return True
+            return None, None
 
         # Copy the args and pop out the id entry
         # Everything that's left will be arguments to the state method
         args = self.args.copy()
         subst = self.get_substance(args.pop('id'))
+        self.props = args.pop('props', None)
+        if subst is None or self.compile_units(subst) or \
+                self.check_props(subst, self.props):
+            return None, None
+        args = writable(convert_units(args, self.conversion, inverse=True))
+        return subst, args
+
+    def key_args(self, args):
+        """Return the arguments that identify the result in the cache
+    key_args = pr.key_args(args)
+"""
+        if self.props is None:
+            return args
+        return dict(args, props=self.props)
+
+    def process(self):
+        """Process the request
+        This method is responsible for populating the "out" member dict with
+        correctly formatted data that can be returned as a JSON object.
+        """
+        subst, args = self.prepare()
         if subst is None:
             return True
+        if self.mimetype == ndjson_type and not self.store:
+            self.deferred = (subst, args)
+            return False
         
+        props = self.props
         try:
-            self.data = subst.state(**args)
-        except pm.utility.PMParamError:
+            if config['pool_workers'] != 0 and \
+                    state_size(args) >= config['pool_threshold']:
+                compute = lambda: evaluate_pooled(subst, args, props)
+            elif config['batch_enabled']:
+                compute = lambda: state_batcher.evaluate(subst, args, props)
+            else:
+                compute = lambda: evaluate_status(subst, args, props)
+            self.data = self.cached('state', subst.data['id'], 
+                    self.key_args(args), compute)
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError):
             self.mh.error('Failed to generate parameter set.')
             self.mh.message(repr(sys.exc_info()[1]))
             return True
@@ -930,18 +3644,113 @@ class PropertyRequest(PMGIRequest):
         return False
 
 
+    def stream(self):
+        """Generate the response as newline-delimited JSON records
+    for line in pr.stream():
+        ...
+
+The states are evaluated and sent in chunks of config['stream_chunk'] 
+states as 'chunk' records (see PMGIRequest.stream()).  The arrays are 
+flattened, and each chunk holds the data from index start to stop.  
+Large requests are evaluated on the process pool, where a few chunks are
+evaluated ahead of the one being sent (see iter_state_chunks()).  If the
+result is in the result cache, it is sent from there, but results that
+are streamed are not cached.  Chunks in which every state is out of 
+bounds are not sent, and they are reported in the end record.
+"""
+        if self.deferred is None:
+            yield from PMGIRequest.stream(self)
+            return
+        subst, args = self.deferred
+        yield encode_json({'record': 'header', 'args': self.echo_args(),
+                'units': self.units, 'message': self.mh.tojson()}) + b'\n'
+
+        chunk = config['stream_chunk']
+        found = None
+        if config['cache_ttl'].get('state', 0) != 0:
+            found = get_result_cache().get(
+                    cache_key('state', subst.data['id'], self.key_args(args)))
+        if found is not None:
+            flat = {name: value.reshape(-1) for name, value in found.items()}
+            n = len(next(iter(flat.values())))
+            chunks = ((start, min(start+chunk, n), 
+                    {name: value[start:start+chunk] for name, value in flat.items()})
+                    for start in range(0, n, chunk))
+        else:
+            pooled = config['pool_workers'] != 0 and \
+                    state_size(args) >= config['pool_threshold']
+            ahead = 2 * (config['pool_workers'] or os.cpu_count() or 1)
+            chunks = iter_state_chunks(subst, args, chunk=chunk, 
+                    ahead=ahead, pooled=pooled, props=self.props)
+
+        skipped = 0
+        nan = self.json_nan()
+        with cost_queue.slot(self.cost) as admitted:
+            if not admitted:
+                self.mh.error('The server is busy with expensive requests.  Try again later.')
+                chunks = ()
+            try:
+                for start, stop, result in chunks:
+                    if result is None:
+                        skipped += 1
+                        continue
+                    result = self.format_data(result, start)
+                    yield encode_json({'record': 'chunk', 'start': start, 
+                            'stop': stop, 'data': result}, nan=nan,
+                            scalars=False) + b'\n'
+            except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
+                self.mh.error('Failed to generate parameter set.')
+                self.mh.message(repr(e))
+            else:
+                if skipped:
+                    self.mh.warn(f'{skipped} chunks were entirely out of bounds and were not sent.')
+        yield encode_json({'record': 'end', 'message': self.mh.tojson()}) + b'\n'
+
+
 class IsolineRequest(PMGIRequest):
     """
     This class will handle requests for an isoline
+
+    Exactly one property (s, h, e, T, p, d, v, or x) is held constant.  
+    If the 'default' argument is set, its value is ignored, and a family 
+    of default lines is computed (see get_default_lines()).  If several 
+    values are given, a line is computed for each.  Families are returned
+    as a list of lines, which are streamed as separate items (see 
+    PMGIRequest.stream()).  A whole family is evaluated in a single call
+    (see compute_iso_line()).
+
+    The 'method' argument selects how lines of h, e, and s are solved: 
+    'direct' (the default) or 'independent' (see evaluate_iso_family()).
+    The latter includes the number of property evaluations spent on 
+    each point in an 'iterations' array.
+
+    If the 'tol' argument is given, the lines are sampled adaptively 
+    instead of at a fixed number of points (see refine_iso_family()).  
+    Points are added where a line on a diagram of the 'axes' properties 
+    (s and T by default) bends away from a straight segment by more than
+    tol, a fraction of the extent of the diagram, up to 'max_points' 
+    points per line.
+
+    A zoomed diagram may give the 'window' argument, the bounds 
+    [xmin, xmax, ymin, ymax] of its axes in the units of the request, 
+    and the 'pixels' argument, its width in pixels.  Then, the lines are
+    only computed where they are visible, and tol defaults to the width
+    of one pixel (see window_sampling()).  The lines start with 'points'
+    points along grids that are clipped to the window, and they are 
+    refined no more than adaptive_window_passes times, so a windowed 
+    request is no slower than one on the fixed grid (see 
+    compute_auxlines()).
     """
-    def __init__(self, args):
-        # Clean initialization
-        PMGIRequest.__init__(self, args)
+    route = 'isoline'
+    nan_policy = 'drop'
+    # The number of points on each line
+    points = 50
 
-        # Read in the arguments from raw
-        self.args = dict(args)
+    def __init__(self, request):
+        # Clean initialization
+        PMGIRequest.__init__(self, request)
         # Process the arguments
-        if self.require(
+        self.require(
                 types={
                     's': toarray,
                     'h': toarray,
@@ -951,43 +3760,125 @@ class IsolineRequest(PMGIRequest):
                     'd': toarray,
                     'v': toarray,
                     'x': toarray,
-                    'default': str,
+                    'default': tobool,
+                    'method': str,
+                    'tol': float,
+                    'max_points': int,
+                    'axes': toproplist,
+                    'window': toarray,
+                    'pixels': int,
+                    'props': toproplist,
                     'id': str
                 },
-                mandatory=['id']):
-            return
+                mandatory=['id'])
 
+    def estimate(self):
+        """Estimate the cost of processing the request
+    cost = ir.estimate()
+"""
+        args = self.args.copy()
+        subst = pm.get(args.pop('id'))
+        default = args.pop('default', False)
+        args.pop('props', None)
+        args.pop('method', None)
+        args.pop('axes', None)
+        args.pop('pixels', None)
+        points = self.points
+        if args.pop('tol', None) is not None or \
+                args.pop('window', None) is not None:
+            points = args.get('max_points') or adaptive_max_points
+        args.pop('window', None)
+        args.pop('max_points', None)
+        if len(args) != 1:
+            return request_cost
+        prop, value = list(args.items())[0]
+        # See compute_iso_line() and get_default_lines()
+        lines = np.size(value)
+        if default:
+            lines = 9 if prop == 'x' else 10
+        other = iso_line_grid(prop)
+        return request_cost + state_cost(subst, (prop, other), 
+                lines * points)
 
     def process(self):
         """Process the request
-        This method is responsible for populating the "out" member dict with
-        correctly formatted data that can be returned as a JSON object.
+        This method is responsible for populating the data attribute with
+        the line (a dict of property arrays) or the list of lines.
         """
         # If there was an error, abort the processing
-        if self.out['error']:
-            return
-        elif not isinstance(self.substance, pm.reg.__basedata__):
-            self.error('Substance data seems to be corrupt!  Halting.')
-            return
+        if self.mh:
+            self.mh.message('Processing aborted due to error.')
+            return True
 
+        # Copy the args and pop out the id entry
+        # Everything that's left is the constant property
         args = self.args.copy()
-        self.out['inputs'] = self.args
-        # Leave only the property arguments
-        args.pop('id')
+        subst = self.get_substance(args.pop('id'))
+        props = args.pop('props', None)
+        default = args.pop('default', False)
+        method = args.pop('method', 'direct')
+        tol = args.pop('tol', None)
+        max_points = args.pop('max_points', None)
+        axes = args.pop('axes', None)
+        window = args.pop('window', None)
+        pixels = args.pop('pixels', None)
+        if subst is None or self.compile_units(subst) or \
+                self.check_props(subst, props) or self.check_method(method) \
+                or self.check_adaptive(subst, tol, max_points, axes, window,
+                        pixels):
+            return True
+        tol, axes, window = self.adaptive_sampling(tol, axes, window, pixels)
+        if len(args) != 1:
+            self.mh.error('Specify exactly one property for an isoline.')
+            return True
+        args = writable(convert_units(args, self.conversion, inverse=True))
+        prop, value = list(args.items())[0]
+        if not default and np.size(value) == 0:
+            self.mh.error(f'No value was given for {prop}.')
+            return True
 
+        key_args = dict(args, default=default, n=self.points, method=method)
+        if props is not None:
+            key_args['props'] = props
+        self.adaptive_key(key_args, tol, max_points, axes, window)
+        if default:
+            args[prop] = 0.
+            args['default'] = True
         try:
-            self.out['data'] = compute_iso_line(self.substance, n=50, **args)
-            PMGIRequest.clean_nan(self.out['data'])
-            PMGIRequest.json_friendly(self.out)
+            self.data = self.cached('isoline', subst.data['id'], key_args,
+                    lambda: compute_iso_line(subst, n=self.points, 
+                            props=props, method=method, tol=tol, 
+                            max_points=max_points, axes=axes, 
+                            window=window, **args))
         except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
-            self.error(e.args[0])
-        # Finally, clean up the return parameters
+            self.mh.error('Failed to compute the isoline.')
+            self.mh.message(repr(e))
+            return True
+        
+        lines = self.data if isinstance(self.data, list) else [self.data]
+        if any(np.any(line['status'] != status_ok) for line in lines):
+            self.mh.warn('Encountered states that were out of bounds for this substance model.')
+        return False
 
 
 class SaturationRequest(PMGIRequest):
     """
     This class will handle requests for saturation properties.
+
+    The data include a 'status' array of the status code of each point 
+    (see state_status()).  By default, the points that cannot be 
+    evaluated are dropped, and the 'index' array identifies the others 
+    (see drop_nan()).
+
+    Without a T or p argument, the default steam dome is returned.  If 
+    the 'tol' or 'window' argument is given, it is sampled adaptively 
+    instead, with the 'max_points', 'axes', 'window', and 'pixels' 
+    arguments of IsolineRequest (see refine_saturation()).
     """
+    route = 'saturation'
+    # Failed saturation states have always been removed
+    nan_policy = 'drop'
+
     def __init__(self, request):
         # Clean initialization
         PMGIRequest.__init__(self, request)
@@ -996,10 +3887,35 @@ class SaturationRequest(PMGIRequest):
             types={
                 'T': toarray,
                 'p': toarray,
+                'tol': float,
+                'max_points': int,
+                'axes': toproplist,
+                'window': toarray,
+                'pixels': int,
+                'props': toproplist,
                 'id': str
             },
             mandatory=['id'])
 
+    def estimate(self):
+        """Estimate the cost of processing the request
+    cost = sr.estimate()
+"""
+        args = self.args.copy()
+        args.pop('id')
+        args.pop('props', None)
+        args.pop('axes', None)
+        args.pop('pixels', None)
+        # See dome_temperatures()
+        size = dome_points
+        if args.pop('tol', None) is not None or \
+                args.pop('window', None) is not None:
+            size = args.get('max_points') or adaptive_max_points
+        args.pop('window', None)
+        args.pop('max_points', None)
+        if args:
+            size = sum(np.size(value) for value in args.values())
+        return request_cost + size * saturation_cost
 
     def process(self):
         """Process the request
@@ -1017,36 +3933,60 @@ class SaturationRequest(PMGIRequest):
         # Everything that's left will be arguments to the state method
         args = self.args.copy()
         subst = self.get_substance(args.pop('id'))
+        props = args.pop('props', None)
+        tol = args.pop('tol', None)
+        max_points = args.pop('max_points', None)
+        axes = args.pop('axes', None)
+        window = args.pop('window', None)
+        pixels = args.pop('pixels', None)
         # get_substance() handles error logging for us - we only need to
         # return True if it fails.
-        if subst is None:
+        if subst is None or self.compile_units(subst) or \
+                self.check_props(subst, props) or \
+                self.check_adaptive(subst, tol, max_points, axes, window,
+                        pixels):
             return True
+        tol, axes, window = self.adaptive_sampling(tol, axes, window, pixels)
+        if tol is not None and args:
+            self.mh.error('The tol and window arguments only apply to the default steam dome.')
+            return True
+        args = writable(convert_units(args, self.conversion, inverse=True))
         # Throw an error if the substance is not multi-phase
         if not ismultiphase(subst):
-            self.mh.error('Substance was not in the multi-phase collection: ' + repr(idstr))
+            self.mh.error('Substance was not in the multi-phase collection: ' + repr(subst.data['id']))
             return True
 
         ## This segment of code is strictly responsible for generating
-        # an array of temperature values to use
+        # an array of temperature values to use.  Saturation properties 
+        # are only defined between the triple and the critical points, so
+        # the valid array marks the values that can be evaluated.  The 
+        # others are given status_oob, instead of failing the request.
+        Tt,pt = subst.triple()
+        Tc,pc = subst.critical()
         
         # If there are no arguments, then generate a default set of 
-        # values
-        if len(args) == 0:
-            Tc,pc = subst.critical()
-            Tt,pt = subst.triple()
-            ep = (Tc-Tt) * .001
-            Ts = np.linspace(Tt+ep, Tc-ep, 31)
+        # values.  An adaptive dome finds its own temperatures.
+        if len(args) == 0 and tol is not None:
+            Ts = None
+        elif len(args) == 0:
+            Ts = dome_temperatures(subst)
+            valid = np.ones(Ts.shape, dtype=bool)
         # Test for over-defined states
         elif len(args)>1:
             self.mh.error('Saturation properties require only one argument.')
             return True
         # If T is specified, this is easy
         elif 'T' in args:
-            Ts = args['T']
+            Ts = np.asarray(args['T'], dtype=float)
+            valid = (Ts >= Tt) & (Ts <= Tc)
         # If p is specified, we'll need to calculate T
         elif 'p' in args:
+            ps = np.asarray(args['p'], dtype=float)
+            valid = (ps >= pt) & (ps <= pc)
+            Ts = np.full(ps.shape, np.nan)
             try:
-                Ts = subst.Ts(p=args['p'])
+                if valid.any():
+                    Ts[valid] = subst.Ts(p=np.array(ps[valid]))
             except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
                 self.mh.error('Failed to obtain temperature at the pressure(s) provided.')
                 self.mh.message(repr(e))
@@ -1057,30 +3997,183 @@ class SaturationRequest(PMGIRequest):
             return True
 
         # OK, we've got Ts - go calculate the state
+        def compute():
+            if Ts is None:
+                return _strip_props(refine_saturation(subst, tol, max_points,
+                        axes, _sampling_props(props, axes), window=window), 
+                        props)
+            return saturation_states(subst, Ts, props, valid)
+        key_args = {'T':np.asarray(Ts, dtype=float)} if Ts is not None else {}
+        if props is not None:
+            key_args['props'] = props
+        self.adaptive_key(key_args, tol, max_points, axes, window)
         try:
-            dsL,dsV = subst.ds(T=Ts)
-            self.data['liquid'] = subst.state(T=Ts, d=dsL)
-            self.data['vapor'] = subst.state(T=Ts, d=dsV)
-            # Throw away the liquid pressure - it is not numerically correct.
-            self.data['liquid']['p'] = self.data['vapor']['p']
+            self.data = self.cached('saturation', subst.data['id'], 
+                    key_args, compute)
         except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
             self.mh.error('Failed to evaluate saturation properties at the state(s) provided.')
             self.mh.message(repr(e))
             return True
         
-        count = clean_nan(self.data['liquid']) \
-                + clean_nan(self.data['vapor'])
-        if count:
+        if np.any(self.data['status'] != status_ok):
             self.mh.warn('Encountered states that were out of bounds for this substance model.')
         
         return False
         
 
 
+class AuxlinesRequest(PMGIRequest):
+    """
+    This class will handle requests for the background of a diagram
+
+    The steam dome and any default isoline families are returned in one
+    response, so the limits and saturation states they share are only 
+    computed once (see compute_auxlines()).  The 'lines' argument lists 
+    the properties held constant by the families, and the 'dome' 
+    argument (True by default) includes the steam dome of a multi-phase
+    substance.  The 'method', 'tol', 'max_points', 'axes', 'window', and
+    'pixels' arguments are the same as in IsolineRequest.  The data 
+    contain a 'dome' entry like the output of the saturation route, and
+    an entry for each family like the output of the isoline route with 
+    the 'default' argument set.  A windowed request is no slower than 
+    one on the fixed grid (see compute_auxlines()).
+    """
+    route = 'auxlines'
+    nan_policy = 'drop'
+    # The properties that may be held constant by a family
+    line_props = ('x', 'p', 'T', 'd', 'v', 'h', 'e', 's')
+
+    def __init__(self, request):
+        # Clean initialization
+        PMGIRequest.__init__(self, request)
+        # Process the arguments
+        self.require(
+            types={
+                'lines': toproplist,
+                'dome': tobool,
+                'method': str,
+                'tol': float,
+                'max_points': int,
+                'axes': toproplist,
+                'window': toarray,
+                'pixels': int,
+                'props': toproplist,
+                'id': str
+            },
+            mandatory=['id'])
+
+    def estimate(self):
+        """Estimate the cost of processing the request
+    cost = ar.estimate()
+"""
+        subst = pm.get(self.args['id'])
+        multiphase = ismultiphase(subst)
+        lines = self.args.get('lines')
+        if lines is None:
+            lines = ['x', 'p', 'T', 'd', 'h', 's'] if multiphase else \
+                    ['p', 'T', 'd', 'h', 's']
+        points = IsolineRequest.points
+        dome = dome_points
+        if self.args.get('tol') is not None or \
+                self.args.get('window') is not None:
+            points = dome = self.args.get('max_points') or adaptive_max_points
+        cost = request_cost
+        size = dome if self.args.get('dome', True) else 0
+        # See compute_auxlines() and get_default_lines()
+        for prop in lines:
+            if prop == 'x':
+                size += points
+                continue
+            elif prop in ('p', 'T'):
+                size += 10
+            other = iso_line_grid(prop)
+            cost += state_cost(subst, (prop, other), 10 * points)
+        if multiphase:
+            cost += size * saturation_cost
+        return cost
+
+    def process(self):
+        """Process the request
+        This method is responsible for populating the data attribute with
+        the steam dome and the isoline families.
+        """
+        # If there was an error, abort the processing
+        if self.mh:
+            self.mh.message('Processing aborted due to error.')
+            return True
+
+        args = self.args.copy()
+        subst = self.get_substance(args.pop('id'))
+        props = args.pop('props', None)
+        lines = args.pop('lines', None)
+        dome = args.pop('dome', True)
+        method = args.pop('method', 'direct')
+        tol = args.pop('tol', None)
+        max_points = args.pop('max_points', None)
+        axes = args.pop('axes', None)
+        window = args.pop('window', None)
+        pixels = args.pop('pixels', None)
+        if subst is None or self.compile_units(subst) or \
+                self.check_props(subst, props) or self.check_method(method) \
+                or self.check_adaptive(subst, tol, max_points, axes, window,
+                        pixels):
+            return True
+        tol, axes, window = self.adaptive_sampling(tol, axes, window, pixels)
+        if lines is not None:
+            unknown = [prop for prop in lines if prop not in self.line_props]
+            if unknown:
+                self.mh.error('Unrecognized isoline properties: ' + ', '.join(unknown))
+                self.mh.message('Valid properties are: ' + ', '.join(self.line_props))
+                return True
+            if 'x' in lines and not ismultiphase(subst):
+                self.mh.error('Quality lines require a multi-phase substance: ' + repr(subst.data['id']))
+                return True
+
+        key_args = {'dome': dome, 'n': IsolineRequest.points, 'method': method}
+        if lines is not None:
+            key_args['lines'] = lines
+        if props is not None:
+            key_args['props'] = props
+        self.adaptive_key(key_args, tol, max_points, axes, window)
+        try:
+            self.data = self.cached('auxlines', subst.data['id'], key_args,
+                    lambda: compute_auxlines(subst, lines, dome, 
+                            n=IsolineRequest.points, props=props, 
+                            method=method, tol=tol, max_points=max_points,
+                            axes=axes, window=window))
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
+            self.mh.error('Failed to compute the auxiliary lines.')
+            self.mh.message(repr(e))
+            return True
+
+        parts = [line for value in self.data.values() 
+                for line in (value if isinstance(value, list) else [value])]
+        if any(np.any(part['status'] != status_ok) for part in parts):
+            self.mh.warn('Encountered states that were out of bounds for this substance model.')
+        return False
+
+    def format_data(self, data, offset=0):
+        """Prepare data for the output
+    data = ar.format_data(data, offset=0)
+
+Like PMGIRequest.format_data(), but the states that failed are removed 
+from the dome and each line separately.
+"""
+        if self.conversion:
+            data = convert_units(data, self.conversion)
+        data = reduce_precision(data, self.precision, self.dtype)
+        if self.nan_policy == 'drop':
+            data = {name: drop_nan(value, offset) 
+                    for name, value in data.items()}
+        return data
+
+
 class InfoRequest(PMGIRequest):
     """
 This class will handle generic info requests about pyromat data
 """
+    route = 'info'
+    uses_units = False
 
     def __init__(self, args):
         PMGIRequest.__init__(self, args)
@@ -1088,7 +4181,23 @@ This class will handle generic info requests about pyromat data
         self.require(types={
             'substances':tobool,
             'legalunits':tobool,
-            'versions':tobool}, mandatory=[])
+            'versions':tobool,
+            'cache':tobool,
+            'batch':tobool,
+            'admission':tobool}, mandatory=[])
+
+    def etag(self):
+        """Compute the entity tag of the response
+    tag = ir.etag()
+
+The statistics of the cache, the batcher, and the admission control 
+change with every request, so responses that include them are not 
+cached by the client (see PMGIRequest.etag()).
+"""
+        for name in ('cache', 'batch', 'admission'):
+            if self.args.get(name):
+                return None
+        return PMGIRequest.etag(self)
     
     def process(self):
         """Process the request
@@ -1133,6 +4242,411 @@ correctly formatted data that can be returned as a JSON object.
             }
         self.data['versions'] = version_dict
 
+        # Should we obtain the result cache statistics?  Unlike the other
+        # items, these are only reported when they are requested.
+        if self.args.get('cache'):
+            self.data['cache'] = get_result_cache().stats()
+            self.data['cache']['coalesced'] = single_flight.coalesced
+
+        # Should we obtain the micro-batching statistics?
+        if self.args.get('batch'):
+            self.data['batch'] = state_batcher.stats()
+
+        # Should we obtain the admission control statistics?
+        if self.args.get('admission'):
+            self.data['admission'] = rate_limiter.stats()
+            self.data['admission'].update(cost_queue.stats())
+
+
+class BatchRequest(PMGIRequest):
+    """
+This class will handle a list of requests of any kind in a single POST.
+
+The 'requests' argument is a list of dicts.  Each contains the arguments
+of a single request and a 'route' entry that names the request type: 
+'subst', 'state', 'saturation', 'isoline', 'auxlines', 'info', or 
+'workspace'.  Units specified for the batch apply to every request that
+does not specify its own.  For example,
+    {'units': {'temperature': 'F'},
+     'requests': [
+        {'route': 'state', 'id': 'mp.H2O', 'T': [80, 90], 'p': 1},
+        {'route': 'state', 'id': 'mp.H2O', 'T': 100, 'p': [1, 2]},
+        {'route': 'saturation', 'id': 'mp.H2O'}]}
+
+The data are a list with the output of each request in the standard form
+(see PMGIRequest.output()), in the same order as the requests.  A request
+that fails does not cause the others to fail; its error is reported in
+its own message.
+
+State requests for the same substance with the same input properties 
+(like the first two above) are evaluated together in a single vectorized
+call (see evaluate_states()).  Out-of-bounds states in a group produce 
+NaN values like they would in any array passed to state().  Results found
+in the result cache are not evaluated again.
+"""
+    route = 'batch'
+
+    def __init__(self, request):
+        PMGIRequest.__init__(self, request)
+        self.handlers = []
+        if self.require(types={'requests': list}, mandatory=['requests']):
+            return
+        # The requests are echoed by their own outputs
+        requests = self.args.pop('requests')
+
+        for index, entry in enumerate(requests):
+            route = None
+            if isinstance(entry, dict):
+                entry = dict(entry)
+                route = entry.pop('route', None)
+            cls = routes.get(route)
+            if cls is None or cls is BatchRequest:
+                handler = PMGIRequest(PMGISubRequest({}))
+                handler.mh.error(f'Request {index} has an unrecognized route: {route}')
+                self.handlers.append((route, handler))
+                continue
+            # Apply the batch units unless the request has its own
+            if 'units' not in entry and \
+                    not any(name in self.short_units for name in entry):
+                entry['units'] = dict(self.units)
+            try:
+                handler = cls(PMGISubRequest(entry))
+            except Exception:
+                handler = PMGIRequest(PMGISubRequest({}))
+                handler.mh.error(f'Request {index} could not be initialized.')
+                handler.mh.message(repr(sys.exc_info()[1]))
+            self.handlers.append((route, handler))
+
+    def estimate(self):
+        """Estimate the cost of processing the request
+    cost = br.estimate()
+
+The cost is the sum of the costs of the requests in the batch.
+"""
+        cost = request_cost
+        for route, handler in self.handlers:
+            if route is not None and not handler.mh:
+                try:
+                    cost += handler.estimate()
+                except Exception:
+                    cost += request_cost
+        return cost
+
+    def process(self):
+        """Process the request
+This method is responsible for populating the data attribute with a list
+of the outputs of each request.
+"""
+        # If there was an error, abort
+        if self.mh:
+            self.mh.message('Aborted processing due to an error')
+            return True
+
+        # Process all requests except for the state requests, which are
+        # grouped by substance and input properties.
+        groups = {}
+        for route, handler in self.handlers:
+            if route is None or handler.mh:
+                continue
+            if handler.uses_units:
+                handler.process_units()
+            # Dry runs in a batch only report their own estimates
+            if handler.dryrun:
+                handler.admit()
+                continue
+            if route == 'state':
+                subst, args = handler.prepare()
+                if subst is not None:
+                    key = (subst.data['id'], tuple(sorted(args.keys())), 
+                            handler.props)
+                    groups.setdefault(key, []).append((handler, subst, args))
+                continue
+            try:
+                handler.process()
+            except Exception:
+                handler.mh.error('There was an unexpected error processing the request.')
+                handler.mh.message(repr(sys.exc_info()[1]))
+
+        for group in groups.values():
+            self.process_group(group)
+
+        failed = sum(1 for route, handler in self.handlers if handler.mh)
+        if failed:
+            self.mh.warn(f'{failed} of {len(self.handlers)} requests failed.')
+        self.data = [handler.output() for route, handler in self.handlers]
+        return False
+
+    def process_group(self, group):
+        """Evaluate a group of compatible state requests together
+    br.process_group(group)
+
+GROUP is a list of (handler, subst, args) tuples for PropertyRequest 
+handlers with the same substance, argument names, and properties, as 
+returned by their prepare() methods.  The results are written to each handler's data
+attribute, and errors are written to each handler's mh attribute.
+"""
+        ttl = config['cache_ttl'].get('state', 0)
+        rc = get_result_cache() if ttl != 0 else None
+        pending = []
+        for handler, subst, args in group:
+            key = cache_key('state', subst.data['id'], handler.key_args(args))
+            found = rc.get(key) if rc is not None else None
+            if found is None:
+                pending.append((handler, key, args))
+            else:
+                handler.data = found
+        if not pending:
+            return
+
+        subst = group[0][1]
+        results = evaluate_states(subst, [args for handler, key, args in pending],
+                group[0][0].props)
+        for (handler, key, args), result in zip(pending, results):
+            if isinstance(result, (pm.utility.PMParamError, 
+                    pm.utility.PMAnalysisError)):
+                handler.mh.error('Failed to generate parameter set.')
+                handler.mh.message(repr(result))
+            elif isinstance(result, Exception):
+                handler.mh.error('There was an unexpected error processing the request.')
+                handler.mh.message(repr(result))
+            else:
+                if rc is not None:
+                    rc.put(key, result, ttl=ttl)
+                handler.data = copy_result(result)
+
+
+
+class WorkspaceRequest(PMGIRequest):
+    """
+This class will handle requests to store arrays in the workspace and to
+retrieve them (see store_array()).
+
+Every argument other than those below is an array to be stored.  Its 
+handle may be used in place of the array in later requests.
+    ttl     The number of seconds to keep the arrays (no more than 
+            config['workspace_ttl'], which is the default)
+    fetch   A handle or a list of handles of arrays to retrieve
+
+For example, 
+    POST /workspace {"T": [300, 400, 500], "p": [1, 2, 4]}
+returns data like {'handles': {'T': '@6f1e...', 'p': '@09ab...'}, 
+'ttl': 3600.}, and the states may then be requested with
+    GET /state?id=mp.H2O&T=@6f1e...&p=@09ab...
+Retrieved arrays are returned in the 'arrays' dict of the data, keyed by
+their handles.  Arrays are stored and retrieved exactly as they were 
+sent; no units are applied.
+
+Other requests can also store their results in the workspace by setting
+their 'store' argument (see PMGIRequest.output()).
+"""
+    route = 'workspace'
+    uses_units = False
+    uses_handles = False
+
+    def __init__(self, request):
+        PMGIRequest.__init__(self, request)
+        types = {name: toarray for name in self.args}
+        types['ttl'] = float
+        types['fetch'] = tohandlelist
+        self.require(types=types, mandatory=[])
+
+    def process(self):
+        """Process the request
+This method is responsible for populating the data attribute with the
+handles of the stored arrays and the retrieved arrays.
+"""
+        # If there was an error, abort
+        if self.mh:
+            self.mh.message('Aborted processing due to an error')
+            return True
+
+        args = self.args.copy()
+        limit = config['workspace_ttl']
+        ttl = args.pop('ttl', limit)
+        fetch = args.pop('fetch', ())
+        if not ttl > 0:
+            self.mh.error(f'Invalid argument: ttl={ttl}  The ttl must be positive.')
+            return True
+
+        handles = {}
+        for name, value in args.items():
+            try:
+                handle = store_array(value, ttl)
+            except ValueError as e:
+                self.mh.error(f'Failed to store {name}: {e}')
+                return True
+            if handle is None:
+                self.status = 413
+                self.mh.error(f'The array {name} is larger than the workspace.')
+                return True
+            handles[name] = handle
+        if handles:
+            # The stored arrays are echoed by their handles
+            self.handles.update(handles)
+            self.data['handles'] = handles
+            self.data['ttl'] = min(ttl, limit)
+
+        if fetch:
+            arrays = {}
+            for handle in fetch:
+                found = fetch_array(handle)
+                if found is None:
+                    self.mh.error(f'Workspace handle not found: {handle}  It may have expired.')
+                    return True
+                arrays[handle] = found
+            self.data['arrays'] = arrays
+        return False
+
+
+
+# The request handler class for each route
+routes = {
+    'subst': SubstanceRequest,
+    'state': PropertyRequest,
+    'saturation': SaturationRequest,
+    'isoline': IsolineRequest,
+    'auxlines': AuxlinesRequest,
+    'info': InfoRequest,
+    'batch': BatchRequest,
+    'workspace': WorkspaceRequest,
+}
+
+
+def run_request(cls, request):
+    """Run the complete life cycle of a request handler
+    handler = run_request(cls, request)
+
+CLS is a PMGIRequest child class, and REQUEST is the Flask request (or
+a compatible object, see PMGISubRequest).  The handler is initialized, 
+its units are processed (if it uses them), conditional requests are 
+answered (see PMGIRequest.not_modified()), it is admitted (see 
+PMGIRequest.admit()), and it is processed.  Expensive requests wait for
+a slot in the cost_queue first.  The handler is returned, ready for its
+response() method.
+
+This is the code shared by the Flask routes and the asynchronous 
+gateway in pmgi_asgi.
+"""
+    handler = cls(request)
+    if handler.uses_units:
+        handler.process_units()
+    if handler.not_modified() or handler.admit():
+        return handler
+    with cost_queue.slot(handler.cost) as admitted:
+        if admitted:
+            handler.process()
+        else:
+            handler.status = 503
+            handler.mh.error('The server is busy with expensive requests.  Try again later.')
+    return handler
+
+
+
+class StaticAssets:
+    """Precompressed, fingerprinted static files held in memory
+    assets = StaticAssets(folder, url=None)
+    
+The HTML, JavaScript, and CSS files in FOLDER are read once, when the
+instance is created.  They are served under URL, the name of the folder
+if it is None.  Each file is compressed with gzip and (if the 
+brotli package is installed) brotli at the highest levels, and the 
+compressed copies are kept if they are smaller.
+
+Each file is also given a fingerprinted name that contains a hash of its
+contents (e.g. script.0123456789.js).  References to the other files in
+the HTML files (e.g. "../static/script.js") are replaced by their 
+fingerprinted names under URL (e.g. "../static_joe/script.0123456789.js"
+in static_joe), so the fingerprinted files can be cached by the 
+browsers forever; a new version of a file has a new name.  The HTML 
+files themselves are served under their own names, and they must be 
+revalidated (see the etag).
+
+get(name) returns a dict for a file, by its own or its fingerprinted 
+name, or None if it is not found:
+    mimetype    The file's content type
+    etag        A quoted hash of the file's contents
+    immutable   True if NAME was the fingerprinted name
+    bodies      A dict of the contents, keyed by the content coding
+                ('br', 'gzip', or None for the uncompressed contents)
+"""
+    # Extensions of the files that are loaded
+    extensions = ('.html', '.js', '.css')
+
+    def __init__(self, folder, url=None):
+        self.folder = folder
+        self.url = url
+        if url is None and folder is not None:
+            self.url = os.path.basename(os.path.normpath(folder))
+        self.assets = {}
+        self.fingerprints = {}
+        if folder is None or not os.path.isdir(folder):
+            return
+        contents = {}
+        for name in sorted(os.listdir(folder)):
+            path = os.path.join(folder, name)
+            if name.endswith(self.extensions) and os.path.isfile(path):
+                with open(path, 'rb') as fd:
+                    contents[name] = fd.read()
+        # Fingerprint the files other than the HTML files first, so that
+        # the HTML files can refer to them.
+        for name in sorted(contents, key=lambda name: name.endswith('.html')):
+            data = contents[name]
+            if name.endswith('.html'):
+                # The pages refer to their own files as static/, 
+                # wherever they are served from
+                for other, fingerprinted in self.fingerprints.items():
+                    data = re.sub(rb'\bstatic\w*/' + re.escape(other.encode()) + rb'\b',
+                            (self.url + '/' + fingerprinted).encode(), data)
+            digest = hashlib.sha1(data).hexdigest()[:10]
+            base, ext = os.path.splitext(name)
+            self.fingerprints[name] = f'{base}.{digest}{ext}'
+            bodies = {None: data}
+            for encoding in content_encodings():
+                level = 11 if encoding == 'br' else 9
+                compressed = compress(data, encoding, level)
+                if len(compressed) < len(data):
+                    bodies[encoding] = compressed
+            self.assets[name] = {
+                    'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                    'etag': f'"{digest}"',
+                    'bodies': bodies}
+        self.names = {fingerprinted: name 
+                for name, fingerprinted in self.fingerprints.items()}
+
+    def get(self, name):
+        if name in self.assets:
+            return dict(self.assets[name], immutable=False)
+        elif name in self.names:
+            return dict(self.assets[self.names[name]], immutable=True)
+        return None
+
+    def response(self, name, headers):
+        """Generate the HTTP response for a static file
+    body, status, headers = assets.response(name, headers)
+
+HEADERS are the request headers, which are used to negotiate the content
+coding (Accept-Encoding) and to answer conditional requests 
+(If-None-Match) with 304 Not Modified.  Returns None if the file is not
+found.
+"""
+        asset = self.get(name)
+        if asset is None:
+            return None
+        out = {
+            'ETag': asset['etag'],
+            'Vary': 'Accept-Encoding',
+            'Cache-Control': 'public, max-age=31536000, immutable' 
+                    if asset['immutable'] else 'no-cache'}
+        if etag_match(asset['etag'], headers.get('If-None-Match')):
+            return b'', 304, out
+        encoding = negotiate_encoding(headers.get('Accept-Encoding'),
+                [encoding for encoding in asset['bodies'] if encoding])
+        out['Content-Type'] = asset['mimetype']
+        if encoding is not None:
+            out['Content-Encoding'] = encoding
+        return asset['bodies'][encoding], 200, out
+
+
 
 ############################
 # Define the URL interface #
@@ -1157,70 +4671,98 @@ app = Flask(__name__)
 # /isoline
 #   Return property information while holding a single property constant
 #
+# /auxlines
+#   Return the steam dome and default isoline families for a diagram
+#
 # /info
 #   Return meta information about the active installation of PYroMat
+#
+# /batch
+#   Return the results of a list of any of the requests above
+#
+# /workspace
+#   Store arrays to be referenced by their handles in later requests
 
 @app.route('/subst', methods=['POST', 'GET'])
 def substance():
-    sr = SubstanceRequest(request)
-    sr.process_units()
-    sr.process()
-    return sr.output(), 200
+    sr = run_request(SubstanceRequest, request)
+    return sr.response()
 
 # The root pmgi accepts property requests.
 @app.route('/state', methods=['POST', 'GET'])
 def state():
-
-    pr = PropertyRequest(request)
-    pr.process_units()
-    pr.process()
-
-    return pr.output(), 200
+    pr = run_request(PropertyRequest, request)
+    return pr.response()
 
 
 # The saturation route computes saturation points or the steam dome
 @app.route('/saturation', methods=['POST', 'GET'])
 def saturation():
-    
-    sr = SaturationRequest(request)
-    sr.process_units()
-    sr.process()
-    return sr.output(), 200
+    sr = run_request(SaturationRequest, request)
+    return sr.response()
 
 
 
 # The isoline route computes isolines
 @app.route('/isoline', methods=['POST', 'GET'])
 def isoline():
-    # Read in the request data to an args dict
-    if request.method == 'POST':
-        jsondat = dict(request.json)
-        args = jsondat['state_input']
-        units = None
-        if 'units' in jsondat:
-            units = (jsondat['units'])
-        isr = IsolineRequest(args, units)
-    elif request.method == 'GET':
-        args = dict(request.args)
-        isr = IsolineRequest(args)
-
-    isr.process()
-
-    # Check for error and return code
-    if isr.out['error']:
-        return isr.out, 500
-    else:
-        return isr.out, 200
+    ir = run_request(IsolineRequest, request)
+    return ir.response()
+
+
+
+# The auxlines route computes the background lines of a diagram
+@app.route('/auxlines', methods=['POST', 'GET'])
+def auxlines():
+    ar = run_request(AuxlinesRequest, request)
+    return ar.response()
 
 
 
 # The info pmgi will return the results of queries (e.g. substance search)
 @app.route('/info', methods=['POST', 'GET'])
 def info():
-    ir = InfoRequest(request)
-    ir.process()
-    return ir.output(), 200
+    ir = run_request(InfoRequest, request)
+    return ir.response()
+
+
+# The batch route handles several requests in a single round trip
+@app.route('/batch', methods=['POST'])
+def batch():
+    br = run_request(BatchRequest, request)
+    return br.response()
+
+
+# The workspace route stores arrays to be referenced by later requests
+@app.route('/workspace', methods=['POST', 'GET'])
+def workspace():
+    wr = run_request(WorkspaceRequest, request)
+    return wr.response()
+
+
+
+# The files of every static folder (static, static_joe, ...) are served 
+# from memory, each under its own name
+static_assets = {name: StaticAssets(os.path.join(app.root_path, name)) 
+        for name in sorted(os.listdir(app.root_path)) 
+        if name.startswith('static') and 
+                os.path.isdir(os.path.join(app.root_path, name))}
+
+def static_file(filename, folder='static'):
+    assets = static_assets[folder]
+    response = assets.response(filename, request.headers)
+    if response is None:
+        # Other kinds of files are served by Flask
+        return flask.send_from_directory(assets.folder, filename)
+    return response
 
+# Replace the view function of Flask's own static route, and add one for
+# each of the other folders
+app.view_functions['static'] = static_file
+for name in static_assets:
+    if name != 'static':
+        app.add_url_rule(f'/{name}/<path:filename>', name, static_file, 
+                defaults={'folder': name})
 
 
 # ##### DELETE ME FOR DEPLOY - ROUTE FOR SERVING STATIC HTML DURING DEV:
@@ -1230,7 +4772,11 @@ def info():
 def render_static(page_name):
     # if not app.debug:
     #     flask.abort(404)
-    return app.send_static_file('%s.html' % page_name)
+    response = static_assets['static'].response('%s.html' % page_name, 
+            request.headers)
+    if response is None:
+        flask.abort(404)
+    return response
 
 
 if __name__ == '__main__':
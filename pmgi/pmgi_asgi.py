@@ -0,0 +1,217 @@
+#!/usr/bin/python3
+"""PYroMat Gateway Interface - asynchronous (ASGI) variant
+
+This module serves the same routes as the Flask application in pmgi
+(/subst, /state, /saturation, /isoline, /auxlines, /info, /batch, and 
+/workspace) as an ASGI application, so it can be run by an asynchronous
+server like uvicorn or hypercorn.  For example,
+
+    uvicorn pmgi_asgi:application --workers 4
+
+The requests are handled by the same PMGIRequest classes used by the
+Flask application (see pmgi.run_request()), so the behavior and the
+output are identical.  The difference is that an idle connection costs
+almost nothing, and a slow computation does not block the server.
+
+Cheap requests (the routes in inline_routes) are answered directly on
+the event loop.  All other requests are CPU-bound, so they are handed to
+a pool of threads (see get_executor()), and the event loop is free to
+serve other clients while they are computed.  Large state requests are
+still split over the process pool (see pool.evaluate_pooled()).
+
+The module has no dependencies beyond those of pmgi.  Only the routes
+above are served; the static development pages are not.
+"""
+
+import asyncio
+import json
+import urllib.parse
+import concurrent.futures
+import threading
+import wsgiref.headers
+
+import pmgi
+
+# These settings may be changed before the first request is served.
+config = {
+    # The number of threads used for CPU-bound requests.  None uses the
+    # concurrent.futures default.
+    'workers': None,
+    # The largest request body that will be accepted in bytes
+    'max_body': 64 * 2**20,
+}
+
+# Routes that are answered directly on the event loop
+inline_routes = {'info', 'subst'}
+
+
+class ASGIRequest:
+    """A stand-in for a Flask request built from an ASGI scope
+    request = ASGIRequest(scope, body)
+
+Provides the attributes and methods of a Flask request that are used 
+by PMGIRequest.  Like Flask, only the first value of a repeated query 
+argument is kept, and header names are not case sensitive.  Raises 
+ValueError if a POST body is not valid JSON.
+"""
+    def __init__(self, scope, body):
+        self.method = scope['method']
+        self.args = {}
+        query = urllib.parse.parse_qs(
+                scope.get('query_string', b'').decode('latin-1'))
+        for name, values in query.items():
+            self.args[name] = values[0]
+        self.headers = wsgiref.headers.Headers([
+                (name.decode('latin-1'), value.decode('latin-1'))
+                for name, value in scope.get('headers', [])])
+        self.mimetype = self.headers.get('Content-Type', '').split(';')[0].strip().lower()
+        self.data = body
+        self.json = None
+        if self.method == 'POST' and self.mimetype != pmgi.npz_type:
+            self.json = json.loads(body or b'{}')
+        client = scope.get('client')
+        self.remote_addr = client[0] if client else None
+
+    def get_data(self):
+        return self.data
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Return the thread pool used for CPU-bound requests
+    executor = get_executor()
+"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = concurrent.futures.ThreadPoolExecutor(
+                        max_workers=config['workers'],
+                        thread_name_prefix='pmgi')
+    return _executor
+
+
+def handle(route, request):
+    """Run a request handler and return its response
+    body, status, headers = handle(route, request)
+"""
+    handler = pmgi.run_request(pmgi.routes[route], request)
+    return handler.response()
+
+
+async def send_response(send, body, status, headers):
+    """Send a complete response
+    await send_response(send, body, status, headers)
+
+BODY is bytes, and HEADERS is a dict of the response headers.
+"""
+    raw = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers.items()]
+    raw.append((b'content-length', str(len(body)).encode()))
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': raw})
+    await send({'type': 'http.response.body', 'body': body})
+
+
+async def send_stream(send, lines, status, headers):
+    """Send a streamed response
+    await send_stream(send, lines, status, headers)
+
+LINES is an iterator over the parts of the body (see 
+pmgi.PMGIRequest.stream()).  Each part is produced in the thread pool 
+and sent as soon as it is ready.
+"""
+    raw = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+            for name, value in headers.items()]
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': raw})
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(get_executor(), 
+                next, lines, None)
+        if line is None:
+            break
+        await send({'type': 'http.response.body', 'body': line,
+                'more_body': True})
+    await send({'type': 'http.response.body', 'body': b''})
+
+
+async def send_json(send, status, content):
+    """Send a complete JSON response
+    await send_json(send, status, content)
+"""
+    await send_response(send, json.dumps(content).encode(), status,
+            {'Content-Type': 'application/json'})
+
+
+async def read_body(receive):
+    """Read the complete body of a request
+    body = await read_body(receive)
+
+Returns None if the body exceeds config['max_body'].
+"""
+    body = b''
+    more = True
+    while more:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body += message.get('body', b'')
+        if len(body) > config['max_body']:
+            return None
+        more = message.get('more_body', False)
+    return body
+
+
+async def application(scope, receive, send):
+    """The ASGI application
+    await application(scope, receive, send)
+"""
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if _executor is not None:
+                    _executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+    if scope['type'] != 'http':
+        return
+
+    route = scope['path'].strip('/')
+    if route not in pmgi.routes:
+        await send_json(send, 404, {'error': 'Not found'})
+        return
+    if scope['method'] not in ('GET', 'POST') or \
+            (route == 'batch' and scope['method'] != 'POST'):
+        await send_json(send, 405, {'error': 'Method not allowed'})
+        return
+
+    body = await read_body(receive)
+    if body is None:
+        await send_json(send, 413, {'error': 'Request body too large'})
+        return
+    try:
+        request = ASGIRequest(scope, body)
+    except ValueError:
+        await send_json(send, 400, {'error': 'Request body is not valid JSON'})
+        return
+
+    if route in inline_routes:
+        body, status, headers = handle(route, request)
+    else:
+        loop = asyncio.get_running_loop()
+        body, status, headers = await loop.run_in_executor(
+                get_executor(), handle, route, request)
+    if isinstance(body, bytes):
+        await send_response(send, body, status, headers)
+    else:
+        await send_stream(send, body, status, headers)
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+"""PYroMat Gateway Interface - process pool
+
+Large state evaluations are split into chunks and evaluated by a pool of
+worker processes (see evaluate_pooled() and iter_state_chunks()).  The 
+workers are started with the "spawn" method, because forking a multi-
+threaded web server process is unsafe.  
+
+The states are evaluated by pmgi.evaluate_status().  pmgi imports this 
+module, so pmgi is only imported by the functions that need it, both 
+here and in the workers (see _pool_state()).
+"""
+
+import concurrent.futures
+import multiprocessing
+import threading
+
+import numpy as np
+import pyromat as pm
+
+from settings import config
+from batching import concatenate_args
+
+
+def _pool_state(idstr, args, props=None):
+    """Evaluate state() for a substance in a worker process
+    result = _pool_state(idstr, args, props=None)
+
+Returns the result dict with its status codes (see 
+pmgi.evaluate_status()).  Arguments are in canonical units.  The worker
+imports pmgi on its first call, which loads PYroMat and its data once.
+"""
+    import pmgi
+    return pmgi.evaluate_status(pm.get(idstr), args, props)
+
+
+_state_pool = None
+_state_pool_lock = threading.Lock()
+
+def get_state_pool():
+    """Return the process pool for state evaluations
+    pool = get_state_pool()
+
+The pool is created on the first call with config['pool_workers'] 
+workers.  Returns None if the pool is disabled.
+"""
+    global _state_pool
+    if config['pool_workers'] == 0:
+        return None
+    if _state_pool is None:
+        with _state_pool_lock:
+            if _state_pool is None:
+                context = multiprocessing.get_context('spawn')
+                if config['pool_python'] is not None:
+                    context.set_executable(config['pool_python'])
+                _state_pool = concurrent.futures.ProcessPoolExecutor(
+                        max_workers=config['pool_workers'],
+                        mp_context=context)
+    return _state_pool
+
+
+def _reset_state_pool(pool):
+    # Discard a pool that has failed, so a new one will be created
+    global _state_pool
+    with _state_pool_lock:
+        if _state_pool is pool:
+            _state_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def state_size(args):
+    """Return the number of states described by a set of state() arguments
+    n = state_size(args)
+"""
+    return np.broadcast(*[np.asarray(value) for value in args.values()]).size
+
+
+def iter_state_chunks(subst, args, chunk=None, ahead=None, pooled=True,
+        props=None):
+    """Evaluate state() in chunks on the process pool
+    for start, stop, result in iter_state_chunks(subst, args, chunk=None,
+            ahead=None, pooled=True, props=None):
+        ...
+
+ARGS are the state() arguments in canonical units, and PROPS optionally
+limits the properties that are evaluated (see pmgi.evaluate_props()).  
+They are broadcast against each other, flattened, and split into chunks
+of CHUNK elements (config['pool_chunk'] if CHUNK is None).  The chunks 
+are submitted to the pool, and their results are yielded in order as 
+(start, stop, result), where start and stop are the indices of the 
+chunk in the flattened arrays.  By default, all chunks are submitted at
+once.  Otherwise, no more than AHEAD chunks are submitted before their 
+results are yielded, which limits the number of results held in memory.
+
+Each chunk is evaluated by pmgi.evaluate_status(), so its result 
+includes the status codes of its states, and invalid states only fail 
+on their own.  If every state of a chunk fails, the chunk's result is None, 
+unless every chunk failed, in which case the first error is raised after
+the last chunk.
+
+If POOLED is False, or if the pool is disabled or fails, the chunks are
+evaluated in this process instead.
+"""
+    import pmgi
+    if chunk is None:
+        chunk = config['pool_chunk']
+    flat, shapes = concatenate_args([args])
+    n = int(np.prod(shapes[0]))
+    bounds = [(start, min(start+chunk, n)) for start in range(0, n, chunk)]
+    pieces = [{name:value[start:stop] for name,value in flat.items()} 
+            for start, stop in bounds]
+    if ahead is None:
+        ahead = len(bounds)
+    pool = get_state_pool() if pooled else None
+    futures = {}
+    submitted = 0
+
+    errors = []
+    for index, (start, stop) in enumerate(bounds):
+        while pool is not None and submitted < min(index + ahead, len(bounds)):
+            try:
+                futures[submitted] = pool.submit(_pool_state, 
+                        subst.data['id'], pieces[submitted], props)
+                submitted += 1
+            except RuntimeError:
+                # The pool is broken or shutting down
+                _reset_state_pool(pool)
+                pool = None
+        try:
+            future = futures.pop(index, None)
+            if future is None:
+                result = pmgi.evaluate_status(subst, pieces[index], props)
+            else:
+                try:
+                    result = future.result()
+                except concurrent.futures.process.BrokenProcessPool:
+                    if pool is not None:
+                        _reset_state_pool(pool)
+                        pool = None
+                    futures.clear()
+                    result = pmgi.evaluate_status(subst, pieces[index], props)
+        except (pm.utility.PMParamError, pm.utility.PMAnalysisError) as e:
+            errors.append(e)
+            result = None
+        yield start, stop, result
+
+    if len(errors) == len(bounds):
+        raise errors[0]
+
+
+def evaluate_pooled(subst, args, props=None):
+    """Evaluate state() in parallel on the process pool
+    result = evaluate_pooled(subst, args, props=None)
+
+The result is identical to pmgi.evaluate_status(subst, args, props), 
+but it is computed by iter_state_chunks().  Chunks in which all states 
+failed are filled with NaN, and their status is status_oob.
+"""
+    import pmgi
+    n = state_size(args)
+    shape = np.broadcast(*[np.asarray(value) for value in args.values()]).shape
+    out = None
+    for start, stop, result in iter_state_chunks(subst, args, props=props):
+        if result is None:
+            continue
+        # Some chunks may return integer arrays (e.g. quality when there
+        # are no saturated states), so the output is always float.
+        if out is None:
+            out = {name:np.full(n, np.nan) for name in result}
+            out['status'] = np.full(n, pmgi.status_oob, dtype=np.uint8)
+        for name, value in result.items():
+            out[name][start:stop] = value
+    shape = shape if shape else (1,)
+    return {name:value.reshape(shape) for name,value in out.items()}
@@ -0,0 +1,119 @@
+#!/usr/bin/python3
+"""PYroMat Gateway Interface - settings
+
+The version and the configuration of the gateway, which are shared by 
+pmgi and the modules of its subsystems (see cache, for example).  The 
+settings may be changed by the WSGI script after pmgi is imported and 
+before the first request is served.  For example,
+
+    import pmgi
+    pmgi.config['cache_bytes'] = 256 * 2**20
+
+pmgi.config is the same dict as settings.config.
+"""
+
+__version__ = '0.1'
+
+config = {
+    # The memory budget for the result cache in bytes
+    'cache_bytes': 64 * 2**20,
+    # To share cached results between all the worker processes on a
+    # host, set cache_file to the path of an SQLite database file.  All
+    # processes must be able to write to it (and its directory).
+    'cache_file': None,
+    # The budget for the shared cache file in bytes
+    'cache_file_bytes': 1024 * 2**20,
+    # Arrays stored in the workspace (see WorkspaceRequest) are kept for
+    # workspace_ttl seconds, or less if the client asks, within a memory 
+    # budget of workspace_bytes.  The least recently used arrays are 
+    # discarded first.  Like the result cache, the workspace may be shared
+    # between processes by setting workspace_file to the path of an SQLite
+    # database file, which is limited to workspace_file_bytes.
+    'workspace_ttl': 3600.,
+    'workspace_bytes': 256 * 2**20,
+    'workspace_file': None,
+    'workspace_file_bytes': 1024 * 2**20,
+    # Array arguments may be given as range expressions (see 
+    # expand_range()), which may generate no more than range_max values.
+    'range_max': 10**6,
+    # Identical computations that are requested at the same time are only
+    # performed once.  The other requests wait for the result for up to
+    # flight_timeout seconds before computing it themselves.
+    'flight_timeout': 60.,
+    # Concurrent state requests for the same substance, input properties,
+    # and output properties may be combined into a single vectorized 
+    # evaluation.  When batch_enabled is True, the first request waits up
+    # to batch_window seconds for others to join it, and no more than 
+    # batch_max requests are combined.
+    'batch_enabled': False,
+    'batch_window': 0.002,
+    'batch_max': 64,
+    # State requests with at least pool_threshold elements are split into
+    # chunks of pool_chunk elements and evaluated in parallel by a pool of
+    # pool_workers worker processes.  None uses one worker per CPU, and 0
+    # disables the pool.  The workers are started with pool_python, the 
+    # Python interpreter; when None, sys.executable is used.  Under 
+    # mod_wsgi, sys.executable may be the Apache binary, so pool_python
+    # should be set there.
+    'pool_workers': None,
+    'pool_threshold': 50000,
+    'pool_chunk': 20000,
+    'pool_python': None,
+    # The number of seconds cached results remain valid for each route.
+    # None means results never expire, and 0 disables caching for that
+    # route.  Routes that are not listed are not cached.
+    'cache_ttl': {
+        'state': 600.,
+        'saturation': None,
+        'isoline': None,
+        'auxlines': None,
+    },
+    # The cost of each request is estimated in approximate seconds of CPU
+    # time before it is processed (see PMGIRequest.estimate()).  Requests
+    # that cost more than cost_limit are rejected.  Requests that cost more
+    # than cost_queue wait in a queue, so that no more than cost_slots of
+    # them are processed at once by each process, and cheap requests are
+    # not held up behind them.  A request that waits for longer than
+    # cost_timeout seconds is rejected.  None disables either limit.
+    'cost_limit': 30.,
+    'cost_queue': 1.,
+    'cost_slots': 1,
+    'cost_timeout': 30.,
+    # Each client (identified by its address) may spend rate_limit seconds
+    # of estimated cost per second, in bursts of up to rate_burst seconds.
+    # None disables the rate limit.  Behind a proxy, all requests appear
+    # to come from the same client, so it is disabled by default.
+    'rate_limit': None,
+    'rate_burst': 10.,
+    # Non-finite values (NaN and infinity) have no JSON representation.
+    # When json_nan is 'null', they are written as null.  When it is 
+    # 'literal', they are written as NaN, Infinity, and -Infinity, which 
+    # Python and some other parsers accept, but JavaScript's JSON.parse()
+    # does not.
+    'json_nan': 'null',
+    # Streamed responses (see PMGIRequest.stream()) evaluate and send the
+    # states in chunks of stream_chunk elements.
+    'stream_chunk': 5000,
+    # Responses of at least compress_min bytes are compressed when the
+    # client accepts it, with brotli (if the brotli package is installed)
+    # or gzip.  The levels trade speed for size (gzip 1-9, brotli 0-11).
+    # Streamed responses are always compressed.  Static assets are 
+    # compressed once, at the highest levels (see StaticAssets).
+    'compress_min': 1024,
+    'gzip_level': 6,
+    'brotli_level': 5,
+    # The responses to GET requests on these routes are given an entity 
+    # tag (ETag) that identifies them, and browsers and proxies may reuse
+    # them for the listed number of seconds.  After that, they must be 
+    # revalidated, and unchanged responses are answered with 304 Not 
+    # Modified without being computed again.  Routes that are not listed
+    # are not cached by clients.
+    'http_max_age': {
+        'subst': 86400,
+        'info': 3600,
+        'state': 600,
+        'saturation': 86400,
+        'isoline': 86400,
+        'auxlines': 86400,
+    },
+}
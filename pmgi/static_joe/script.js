@@ -325,8 +325,9 @@ class PointModel extends Subject{
         let pt = Object.assign({}, point);  // Copy object
         pt['ptid'] = this.point_id;  // Append the id to the point
 
-        // Push to the existing array
-        for (const key in pt) {
+        // Push to the existing array.  Entries that are not properties
+        // (e.g. the status code) are not tracked.
+        for (const key in this.points) {
             this.points[key].push(pt[key]);
         }
         // Increment the id and notify
@@ -1416,6 +1417,9 @@ class TableView{
 // * CONTROLLER
 // *********************************************
 
+// Significant digits requested for the plotted lines
+const AUXLINE_PRECISION = 6;
+
 // Define the classes
 var unitFormView;
 var substanceFormView;
@@ -1518,10 +1522,16 @@ function set_substance(newsubstance){
 }
 
 function calc_auxline(){
+    // The steam dome and all of the isoline families are computed by a
+    // single request.
+    let lines = ['p', 'T', 'd', 'h', 's'];
     if (get_substance().startsWith('mp')){
-        compute_auxline((data)=>{
-            let sll = data.data['liquid'];
-            let svl = data.data['vapor'];
+        lines.unshift('x');
+    }
+    compute_auxline((data)=>{
+        if ('dome' in data.data) {
+            let sll = data.data.dome['liquid'];
+            let svl = data.data.dome['vapor'];
             // concatenate vapor to liquid
             Object.keys(svl).forEach(key => {
                 for (let i = svl[key].length; i > -1; i--) {
@@ -1529,26 +1539,14 @@ function calc_auxline(){
                 }
             });
             add_steamdome(sll);
-        });
-
-        compute_auxline((data)=>{
-            data.data.forEach((line)=>{
-                pointModel.add_auxline('x', line, 'global');
-            });
-        },{'x': 0, 'default': true});
-    }
+        }
 
-    // Add a few types of lines
-    ['p', 'T', 'd', 'h', 's'].forEach((prop_val)=>{
-        compute_args = {};
-        compute_args[prop_val] = 0;
-        compute_args["default"] = true;
-        compute_auxline((data)=>{
-            data.data.forEach((line)=>{
+        lines.forEach((prop_val)=>{
+            data.data[prop_val].forEach((line)=>{
                 pointModel.add_auxline(prop_val, line, 'global');
             });
-        },compute_args);
-    })
+        });
+    },{'lines': lines});
 }
 
 function add_steamdome(steamdome){
@@ -1585,7 +1583,7 @@ function set_units(units){
  * @param mode - GET/POST. Only POST can handle units with the request
  */
 function compute_point(props, mode="POST"){
-    let requestroute = "/";
+    let requestroute = "/state";
 
     // Add the substance ID to props always
     props['id'] = get_substance();
@@ -1595,7 +1593,8 @@ function compute_point(props, mode="POST"){
         $.get(requestroute, props, propResponseSuccess,dataType='json')
             .fail(propResponseFail);
     } else if (mode === "POST") {
-        let postData = {state_input: props, units: get_units()};
+        // The arguments are posted with a nested units dict
+        let postData = Object.assign({}, props, {units: get_units()});
         $.ajax({
             url: requestroute,
             type: "POST",
@@ -1609,27 +1608,25 @@ function compute_point(props, mode="POST"){
 }
 
 /**
- * Async request for getting a state from the backend.
+ * Async request for getting the steam dome and isolines from the backend.
  * @param callback - function handle to execute when complete
- * @param props - Dict with keys of property and numeric values
+ * @param props - Dict of arguments, e.g. the list of isoline properties
  * @param mode - GET/POST. Only POST can handle units with the request
  */
 function compute_auxline(callback, props={}, mode="POST"){
-    let requestroute;
-    if (Object.keys(props).length === 0) {
-        requestroute = "/saturation";
-    } else {
-        requestroute = "/isoline"
-    }
+    let requestroute = "/auxlines";
 
     // Add the substance ID to props always
     props['id'] = get_substance();
+    // Lines are only plotted, so full precision is not needed
+    props['precision'] = AUXLINE_PRECISION;
 
     if (mode === "GET"){
         $.get(requestroute, props, callback,dataType='json')
             .fail(propResponseFail);
     } else if (mode === "POST") {
-        let postData = {state_input: props, units: get_units()};
+        // The arguments are posted with a nested units dict
+        let postData = Object.assign({}, props, {units: get_units()});
         $.ajax({
             url: requestroute,
             type: "POST",
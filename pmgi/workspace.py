@@ -0,0 +1,99 @@
+#!/usr/bin/python3
+"""PYroMat Gateway Interface - workspaces
+
+Clients may store arrays in the workspace once and refer to them in 
+later requests by their handles (e.g. T=@0123456789abcdef), instead of
+sending the same data again.  The handles are derived from the contents
+of the arrays, so storing the same array again returns the same handle
+and renews it.
+
+The arrays are kept in a result cache (see get_workspace()).
+"""
+
+import threading
+
+import numpy as np
+
+from settings import config
+from cache import result_size, cache_key, ResultCache, SharedResultCache
+
+
+_workspace = None
+_workspace_lock = threading.Lock()
+
+def get_workspace():
+    """Return the store used for the workspace arrays in this process
+    ws = get_workspace()
+
+If config['workspace_file'] is None, the workspace is an in-process 
+ResultCache.  Otherwise, it is a SharedResultCache that uses the file.
+"""
+    global _workspace
+    if _workspace is None:
+        with _workspace_lock:
+            if _workspace is None:
+                if config['workspace_file'] is None:
+                    _workspace = ResultCache(config['workspace_bytes'])
+                else:
+                    _workspace = SharedResultCache(config['workspace_file'],
+                            config['workspace_bytes'],
+                            config['workspace_file_bytes'])
+    return _workspace
+
+
+def ishandle(value):
+    """Test whether an argument is a workspace handle
+    test = ishandle(value)
+"""
+    return isinstance(value, str) and value.startswith('@')
+
+
+def store_array(value, ttl=None):
+    """Store an array in the workspace
+    handle = store_array(value, ttl=None)
+
+VALUE is stored for TTL seconds, which may not exceed the default, 
+config['workspace_ttl'].  Returns the handle string, or None if the 
+array is larger than the workspace.
+"""
+    value = np.asarray(value)
+    if value.dtype == object:
+        raise ValueError('Only numeric arrays may be stored')
+    limit = config['workspace_ttl']
+    ttl = limit if ttl is None else min(ttl, limit)
+    if result_size(value) > config['workspace_bytes']:
+        return None
+    handle = '@' + cache_key('workspace', None, {'value': value})[:16]
+    get_workspace().put(handle, np.array(value), ttl=ttl)
+    return handle
+
+
+def fetch_array(handle):
+    """Retrieve an array from the workspace
+    value = fetch_array(handle)
+
+Returns the read-only array stored with HANDLE, or None if it is not 
+found or has expired.
+"""
+    return get_workspace().get(handle)
+
+
+def store_arrays(data, ttl=None):
+    """Replace the arrays in a result with workspace handles
+    data = store_arrays(data, ttl=None)
+
+DATA may contain nested dicts and lists (see convert_units()).  Each 
+numpy array is stored (see store_array()), and a new structure with the
+handles in their place is returned.  Raises ValueError if an array is 
+larger than the workspace.
+"""
+    if isinstance(data, list):
+        return [store_arrays(value, ttl) for value in data]
+    elif isinstance(data, dict):
+        return {name: store_arrays(value, ttl) for name, value in data.items()}
+    elif isinstance(data, np.ndarray):
+        handle = store_array(data, ttl)
+        if handle is None:
+            raise ValueError('The array is larger than the workspace')
+        return handle
+    return data
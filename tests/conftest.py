@@ -0,0 +1,29 @@
+"""Test configuration for the PYroMat Gateway Interface
+
+The pmgi directory is not a package; it is put on the path the same way
+pmgi.wsgi does, and the modules are imported by name.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+        os.path.abspath(__file__))), 'pmgi'))
+
+import pyromat as pm
+pm.config['warning_verbose'] = False
+
+import pmgi
+
+
+@pytest.fixture
+def client():
+    """A Flask test client for the gateway"""
+    return pmgi.app.test_client()
+
+
+@pytest.fixture
+def water():
+    return pm.get('mp.H2O')
@@ -0,0 +1,139 @@
+"""Tests of the adaptive sampling of lines"""
+
+import numpy as np
+import pytest
+
+import pmgi
+
+
+def curve(function):
+    """Build the EVALUATE and COORDINATES arguments for y = FUNCTION(t)"""
+    calls = []
+    def evaluate(lines, t):
+        calls.append(t.size)
+        return {'x': t, 'y': function(t)}
+    def coordinates(payload):
+        return np.stack([payload['x'], payload['y']], axis=-1)[:, None, :]
+    return evaluate, coordinates, calls
+
+
+def start(evaluate, n=9, lines=1):
+    t = [np.linspace(0., 1., n) for _ in range(lines)]
+    return t, [evaluate(np.zeros(n, dtype=int), value) for value in t]
+
+
+def deviation(t, y, function):
+    """The largest distance of a curve from its piecewise linear samples"""
+    fine = np.linspace(0., 1., 20001)
+    return np.max(np.abs(np.interp(fine, t, y) - function(fine)))
+
+
+def test_straight_line():
+    evaluate, coordinates, calls = curve(lambda t: 2. * t)
+    t, payloads = start(evaluate)
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-3)
+    # The first pass bisects every segment, and none of the halves
+    assert count == 8
+    assert len(calls) == 2
+
+
+def test_curve():
+    function = lambda t: np.sin(6. * t)
+    evaluate, coordinates, calls = curve(function)
+    t, payloads = start(evaluate, lines=2)
+    calls.clear()
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-3)
+    assert count > 0
+    assert count == sum(value.size for value in t) - 18
+    for value, payload in zip(t, payloads):
+        assert (np.diff(value) > 0).all()
+        assert np.array_equal(payload['x'], value)
+        assert deviation(value, payload['y'], function) < 2e-3
+    # The new points of both lines are evaluated together in each pass
+    assert sum(calls) == count
+    assert len(calls) <= pmgi.adaptive_depth
+
+
+def test_tolerance():
+    function = lambda t: np.sin(6. * t)
+    sizes = []
+    for tol in (1e-2, 1e-3, 1e-4):
+        evaluate, coordinates, calls = curve(function)
+        t, payloads = start(evaluate)
+        t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+                coordinates, (1., 1.), tol)
+        sizes.append(t[0].size)
+    assert sizes[0] < sizes[1] < sizes[2]
+
+
+def test_limits():
+    function = lambda t: np.sin(40. * t)
+    evaluate, coordinates, calls = curve(function)
+    t, payloads = start(evaluate)
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-6, max_points=30)
+    assert t[0].size == 30
+    t, payloads = start(evaluate)
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-6, passes=0)
+    assert count == 0
+    t, payloads = start(evaluate)
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-6, passes=1)
+    assert count == 8
+    t, payloads = start(evaluate, n=2)
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-9, depth=3, max_points=1000)
+    assert t[0].size == 9
+
+
+def test_edge():
+    # The states beyond t = 0.6 fail, and the edge is found
+    function = lambda t: np.where(t <= 0.6, t, np.nan)
+    evaluate, coordinates, calls = curve(function)
+    t, payloads = start(evaluate)
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-3)
+    valid = t[0][np.isfinite(payloads[0]['y'])]
+    failed = t[0][~np.isfinite(payloads[0]['y'])]
+    assert failed.min() - valid.max() <= 2.**-pmgi.adaptive_edge_depth
+    # Only the segment across the edge is bisected after the first pass
+    assert count < 8 + 2 * pmgi.adaptive_edge_depth
+
+
+def test_window():
+    function = lambda t: np.sin(6. * t)
+    evaluate, coordinates, calls = curve(function)
+    t, payloads = start(evaluate)
+    window = (0.2, 0.4, -2., 2.)
+    t, payloads, count = pmgi.refine_adaptive(t, payloads, evaluate, 
+            coordinates, (1., 1.), 1e-4, window=window)
+    x = t[0]
+    # Only the points next to the edges are outside
+    assert np.sum((x < window[0]) | (x > window[1])) <= 2
+    inside = (x >= window[0]) & (x <= window[1])
+    assert inside.sum() > 5
+
+
+def test_iso_line(water):
+    fixed = pmgi.compute_iso_line(water, n=25, p=10.)
+    line = pmgi.compute_iso_line(water, n=25, p=10., tol=1/800)
+    assert line['T'].size <= pmgi.adaptive_max_points
+    assert (np.diff(line['T']) >= 0).all()
+    assert np.allclose(line['p'][line['status'] == pmgi.status_ok], 10., 
+            rtol=1e-5)
+    coarse = pmgi.compute_iso_line(water, n=25, p=10., tol=1/50)
+    assert coarse['T'].size < line['T'].size
+    limited = pmgi.compute_iso_line(water, n=25, p=10., tol=1/800,
+            max_points=20)
+    assert limited['T'].size <= 20
+    assert fixed['T'].size == 27
+
+
+def test_iso_line_route(client):
+    out = client.get('/isoline?id=mp.H2O&p=10&tol=0.002&props=T,p,s'
+            ).get_json()
+    assert not out['message']['error']
+    assert 10 < len(out['data']['T']) <= pmgi.adaptive_max_points
@@ -0,0 +1,82 @@
+"""Tests of the admission control (admission.py)"""
+
+import pytest
+
+import admission
+import pmgi
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    # Every test starts with empty buckets and queues
+    monkeypatch.setattr(pmgi, 'rate_limiter', admission.RateLimiter())
+    monkeypatch.setattr(pmgi, 'cost_queue', admission.CostQueue())
+    pmgi.get_result_cache().clear()
+
+
+def test_state_kind():
+    assert admission.state_kind(['T', 'd']) == 'direct'
+    assert admission.state_kind(['T', 'p']) == 'pressure'
+    assert admission.state_kind(['T']) == 'pressure'
+    assert admission.state_kind(['p', 'x']) == 'quality'
+    assert admission.state_kind(['p', 's']) == 'inverse'
+
+
+def test_state_cost(water):
+    cheap = admission.state_cost(water, ['T', 'd'], 1000)
+    inverse = admission.state_cost(water, ['p', 's'], 1000)
+    assert 0 < cheap < inverse
+    assert admission.state_cost(water, ['T', 'p'], 2000) == \
+            2 * admission.state_cost(water, ['T', 'p'], 1000)
+
+
+def test_dryrun(client):
+    data = client.get('/state?id=mp.H2O&T=linspace(300,900,1000)&p=1'
+            '&dryrun=1').get_json()['data']
+    assert data['cost'] > admission.request_cost
+    assert data['admitted']
+
+
+def test_too_expensive(monkeypatch, client):
+    monkeypatch.setitem(pmgi.config, 'cost_limit', 0.01)
+    response = client.get('/state?id=mp.H2O&T=linspace(300,900,100000)&s=7')
+    assert response.status_code == 413
+    assert response.get_json()['message']['error']
+    assert client.get('/state?id=mp.H2O&T=300&p=1').status_code == 200
+
+
+def test_rate_limit(monkeypatch, client):
+    monkeypatch.setitem(pmgi.config, 'rate_limit', 0.0001)
+    monkeypatch.setitem(pmgi.config, 'rate_burst', 0.002)
+    statuses = [client.get('/state?id=ig.N2&T=300&p=1').status_code 
+            for _ in range(3)]
+    assert statuses == [200, 429, 429]
+    response = client.get('/state?id=ig.N2&T=300&p=1')
+    assert int(response.headers['Retry-After']) >= 1
+    # Other clients have their own buckets
+    other = client.get('/state?id=ig.N2&T=300&p=1', 
+            environ_base={'REMOTE_ADDR': '10.0.0.2'})
+    assert other.status_code == 200
+
+
+def test_rate_limiter_debt(monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'rate_limit', 1.)
+    monkeypatch.setitem(pmgi.config, 'rate_burst', 2.)
+    limiter = admission.RateLimiter()
+    # A request larger than the burst is admitted from a full bucket
+    assert limiter.take('client', 5.) == 0.
+    assert limiter.take('client', 1.) > 0.
+    assert limiter.stats() == {'clients': 1, 'limited': 1}
+
+
+def test_busy(monkeypatch, client):
+    monkeypatch.setitem(pmgi.config, 'cost_queue', 0.)
+    monkeypatch.setitem(pmgi.config, 'cost_slots', 1)
+    monkeypatch.setitem(pmgi.config, 'cost_timeout', 0.05)
+    # Another expensive request holds the only slot
+    with pmgi.cost_queue.slot(1.) as admitted:
+        assert admitted
+        response = client.get('/state?id=ig.N2&T=300&p=1')
+    assert response.status_code == 503
+    assert pmgi.cost_queue.stats()['timeouts'] == 1
+    assert client.get('/state?id=ig.N2&T=300&p=1').status_code == 200
@@ -0,0 +1,57 @@
+"""Tests of the ASGI variant of the gateway (pmgi_asgi.py)"""
+
+import asyncio
+import json
+
+import pmgi_asgi
+
+
+def call(method, path, query=b'', body=b'', headers=()):
+    """Run one request through the ASGI application
+    status, headers, body = call(method, path, query=b'', body=b'', 
+            headers=())
+"""
+    scope = {'type': 'http', 'method': method, 'path': path, 
+            'query_string': query, 'headers': list(headers),
+            'client': ('127.0.0.1', 1234)}
+    messages = []
+    async def receive():
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+    async def send(message):
+        messages.append(message)
+    asyncio.run(pmgi_asgi.application(scope, receive, send))
+    start = messages[0]
+    content = b''.join(message.get('body', b'') for message in messages[1:])
+    return start['status'], dict(start['headers']), content
+
+
+def test_get_state():
+    status, headers, body = call('GET', '/state', b'id=ig.N2&T=300&p=1')
+    assert status == 200
+    assert json.loads(body)['data']['T'] == 300.
+
+
+def test_post_state():
+    status, headers, body = call('POST', '/state', body=json.dumps(
+            {'id': 'ig.N2', 'T': [300, 400], 'p': 1}).encode(),
+            headers=[(b'content-type', b'application/json')])
+    assert status == 200
+    assert json.loads(body)['data']['T'] == [300., 400.]
+
+
+def test_errors(monkeypatch):
+    assert call('GET', '/nowhere')[0] == 404
+    assert call('GET', '/batch')[0] == 405
+    assert call('POST', '/state', body=b'{not json')[0] == 400
+    monkeypatch.setitem(pmgi_asgi.config, 'max_body', 10)
+    assert call('POST', '/state', body=b'{"id": "ig.N2", "T": 300}')[0] == 413
+
+
+def test_stream():
+    status, headers, body = call('GET', '/state', 
+            b'id=ig.N2&T=300,400,500&p=1',
+            headers=[(b'accept', b'application/x-ndjson')])
+    assert status == 200
+    assert headers[b'content-type'].startswith(b'application/x-ndjson')
+    lines = [json.loads(line) for line in body.splitlines()]
+    assert len(lines) > 1
@@ -0,0 +1,89 @@
+"""Tests of the diagram background (compute_auxlines() and /auxlines)"""
+
+import time
+
+import numpy as np
+import pyromat as pm
+import pytest
+
+import pmgi
+
+
+lines = ['T', 'p', 'h', 's']
+
+
+def best_time(function, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def count_points(data):
+    return sum(np.size(line['T']) for name, family in data.items() 
+            if name != 'dome' for line in family)
+
+
+def test_windowed_is_no_slower_than_fixed(water):
+    # The fixed grid and two windows of an s-T diagram of water
+    pmgi.compute_auxlines(water, lines)
+    fixed = best_time(lambda: pmgi.compute_auxlines(water, lines))
+    for window in [(6, 8, 400, 600), (0, 10, 300, 700)]:
+        windowed = best_time(lambda: pmgi.compute_auxlines(water, lines, 
+                tol=1/800, window=window))
+        # Allow for the noise of a shared machine
+        assert windowed <= 1.2 * fixed, (window, windowed, fixed)
+
+
+def test_windowed_lines_stay_in_window(water):
+    window = (6, 8, 400, 600)
+    data = pmgi.compute_auxlines(water, ['p', 's'], tol=1/800, 
+            window=window)
+    assert data['p'] and data['s']
+    for line in data['p']:
+        T = line['T'][np.isfinite(line['T'])]
+        # Only the points next to the edges may be outside
+        assert np.sum((T < window[2]) | (T > window[3])) <= 2
+    fixed = pmgi.compute_auxlines(water, ['p', 's'])
+    assert count_points(data) < count_points(fixed)
+
+
+def test_auxlines_route(client):
+    response = client.get('/auxlines?id=mp.H2O&lines=T,p'
+            '&window=6,8,400,600&pixels=500')
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert set(data) == {'dome', 'T', 'p'}
+    assert all(len(line['T']) > 1 for line in data['p'])
+
+
+def test_families(water):
+    data = pmgi.compute_auxlines(water)
+    assert set(data) == {'dome', 'x', 'p', 'T', 'd', 'h', 's'}
+    assert set(data['dome']) == {'liquid', 'vapor', 'status'}
+    assert 'dome' not in pmgi.compute_auxlines(water, ['p'], dome=False)
+
+
+def test_same_as_separate_requests(client):
+    data = client.get('/auxlines?id=mp.H2O&lines=p,T&props=T,p,s'
+            ).get_json()['data']
+    dome = client.get('/saturation?id=mp.H2O&props=T,p,s').get_json()['data']
+    for phase in ('liquid', 'vapor'):
+        for name in ('T', 'p', 's'):
+            assert np.allclose(data['dome'][phase][name], dome[phase][name])
+    for prop in ('p', 'T'):
+        lines = client.get('/isoline?id=mp.H2O&%s=0&default=1&props=T,p,s'
+                % prop).get_json()['data']
+        assert len(data[prop]) == len(lines)
+        for mine, theirs in zip(data[prop], lines):
+            for name in ('T', 'p', 's'):
+                assert np.allclose(mine[name], theirs[name], rtol=1e-6)
+
+
+def test_single_phase():
+    nitrogen = pm.get('ig.N2')
+    assert set(pmgi.compute_auxlines(nitrogen)) == {'p', 'T', 'd', 'h', 's'}
+    with pytest.raises(pm.utility.PMParamError):
+        pmgi.compute_auxlines(nitrogen, ['x'])
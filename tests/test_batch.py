@@ -0,0 +1,29 @@
+"""Tests of the /batch route"""
+
+import numpy as np
+
+
+def test_batch(client):
+    response = client.post('/batch', json={
+        'units': {'temperature': 'F'},
+        'requests': [
+            {'route': 'state', 'id': 'mp.H2O', 'T': [80, 90], 'p': 1},
+            {'route': 'state', 'id': 'mp.H2O', 'T': 100, 'p': [1, 2], 
+                'units': {'temperature': 'C'}},
+            {'route': 'saturation', 'id': 'mp.H2O', 'T': 400},
+            {'route': 'state', 'id': 'mp.H2O', 'T': 'hot', 'p': 1},
+            {'route': 'nowhere'}]})
+    assert response.status_code == 200
+    outputs = response.get_json()['data']
+    assert len(outputs) == 5
+    assert outputs[0]['units']['temperature'] == 'F'
+    assert np.allclose(outputs[0]['data']['T'], [80., 90.])
+    assert outputs[1]['units']['temperature'] == 'C'
+    assert np.allclose(outputs[1]['data']['p'], [1., 2.])
+    assert 'liquid' in outputs[2]['data']
+    # Bad requests only fail on their own
+    for output in outputs[:3]:
+        assert not output['message']['error']
+    for output in outputs[3:]:
+        assert output['message']['error']
+
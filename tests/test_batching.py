@@ -0,0 +1,129 @@
+"""Tests of the micro-batching of state requests (batching.py)"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import batching
+import pmgi
+
+
+def run_threads(target, count, stagger=0.):
+    threads = [threading.Thread(target=target, args=(index,)) 
+            for index in range(count)]
+    for thread in threads:
+        thread.start()
+        time.sleep(stagger)
+    for thread in threads:
+        thread.join()
+
+
+def test_concatenate_and_split():
+    items = [{'T': 300., 'p': np.array([1., 2.])}, 
+            {'T': np.array([[400.], [500.]]), 'p': np.array([1., 2., 3.])}]
+    args, shapes = batching.concatenate_args(items)
+    assert shapes == [(2,), (2, 3)]
+    assert args['T'].shape == (8,)
+    assert np.array_equal(args['T'][:2], [300., 300.])
+    parts = batching.split_result(args, shapes)
+    assert parts[0]['p'].shape == (2,)
+    assert np.array_equal(parts[1]['T'], [[400.]*3, [500.]*3])
+
+
+class Recorder:
+    """A stand-in for pmgi.evaluate_states() that records the batches"""
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    def __call__(self, subst, items, props=None):
+        self.batches.append(len(items))
+        if self.error is not None:
+            raise self.error
+        return [{'T': np.asarray(item['T']) + 1.} for item in items]
+
+
+@pytest.fixture
+def window(monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'batch_window', 0.1)
+    monkeypatch.setitem(pmgi.config, 'batch_max', 64)
+
+
+def test_concurrent_requests_are_batched(window, water):
+    recorder = Recorder()
+    sb = batching.StateBatcher(recorder)
+    results = [None] * 8
+    def worker(index):
+        results[index] = sb.evaluate(water, {'T': float(index), 'p': 1.})
+    run_threads(worker, 8, stagger=0.005)
+    assert recorder.batches == [8]
+    assert [float(result['T']) for result in results] == \
+            [index + 1. for index in range(8)]
+    stats = sb.stats()
+    assert stats['batches'] == 1 and stats['largest'] == 8
+
+
+def test_batches_are_keyed(window, water):
+    recorder = Recorder()
+    sb = batching.StateBatcher(recorder)
+    def worker(index):
+        # Different argument names or props are not combined
+        if index % 2:
+            sb.evaluate(water, {'T': 300., 'p': 1.})
+        else:
+            sb.evaluate(water, {'T': 300., 'd': 1.}, props=('T',))
+    run_threads(worker, 4)
+    assert sorted(recorder.batches) == [2, 2]
+
+
+def test_batch_max(monkeypatch, water):
+    monkeypatch.setitem(pmgi.config, 'batch_window', 5.)
+    monkeypatch.setitem(pmgi.config, 'batch_max', 3)
+    recorder = Recorder()
+    sb = batching.StateBatcher(recorder)
+    start = time.time()
+    run_threads(lambda index: sb.evaluate(water, {'T': 1., 'p': 1.}), 3)
+    # A full batch does not wait for the window
+    assert time.time() - start < 2.
+    assert recorder.batches == [3]
+
+
+def test_errors_are_raised_in_every_thread(window, water):
+    sb = batching.StateBatcher(Recorder(KeyboardInterrupt('boom')))
+    errors = [None] * 4
+    def worker(index):
+        try:
+            sb.evaluate(water, {'T': 1., 'p': 1.})
+        except KeyboardInterrupt as e:
+            errors[index] = e
+    run_threads(worker, 4)
+    assert all(isinstance(error, KeyboardInterrupt) for error in errors)
+
+
+def test_bad_items_fail_alone(water):
+    results = pmgi.evaluate_states(water, [{'T': 300., 'p': 1.}, 
+            {'T': -5., 'p': 1.}, {'T': 400., 'p': 1.}])
+    assert [result['status'][0] for result in results] == \
+            [pmgi.status_ok, pmgi.status_oob, pmgi.status_ok]
+    # An item that cannot be evaluated at all returns its error
+    results = pmgi.evaluate_states(water, [{'T': 300., 'p': 1.}, 
+            {'T': 'a', 'p': 1.}])
+    assert results[0]['status'][0] == pmgi.status_ok
+    assert isinstance(results[1], ValueError)
+
+
+def test_batched_route(monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'batch_enabled', True)
+    monkeypatch.setitem(pmgi.config, 'batch_window', 0.05)
+    pmgi.get_result_cache().clear()
+    before = pmgi.state_batcher.stats()['batches']
+    results = [None] * 6
+    def worker(index):
+        response = pmgi.app.test_client().get(
+                f'/state?id=ig.N2&T={300 + index}&p=1&props=T')
+        results[index] = response.get_json()['data']['T']
+    run_threads(worker, 6)
+    assert results == [300. + index for index in range(6)]
+    assert pmgi.state_batcher.stats()['batches'] - before < 6
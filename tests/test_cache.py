@@ -0,0 +1,225 @@
+"""Tests of the result caches (cache.py)"""
+
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import cache
+import pmgi
+
+
+def result(value, size=100):
+    return {'T': np.full(size, float(value))}
+
+
+def test_lru_eviction():
+    one = cache.result_size(result(0))
+    rc = cache.ResultCache(maxbytes=3 * one)
+    for key in 'abc':
+        rc.put(key, result(ord(key)))
+    # Using a makes b the least recently used
+    assert rc.get('a') is not None
+    rc.put('d', result(4))
+    assert rc.get('b') is None
+    assert all(rc.get(key) is not None for key in 'acd')
+    stats = rc.stats()
+    assert stats['evictions'] == 1
+    assert stats['entries'] == 3
+    assert stats['bytes'] <= stats['maxbytes']
+
+
+def test_oversized_results_are_not_stored():
+    rc = cache.ResultCache(maxbytes=100)
+    rc.put('big', result(1, 1000))
+    assert rc.get('big') is None
+    assert rc.stats()['entries'] == 0
+
+
+def test_expiry(monkeypatch):
+    rc = cache.ResultCache(maxbytes=2**20)
+    rc.put('key', result(1), ttl=10.)
+    assert rc.get('key') is not None
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11.)
+    assert rc.get('key') is None
+    assert rc.stats()['misses'] == 1
+
+
+def test_results_are_frozen_and_copied():
+    rc = cache.ResultCache(maxbytes=2**20)
+    original = result(1)
+    rc.put('key', original)
+    found = rc.get('key')
+    with pytest.raises(ValueError):
+        found['T'][0] = 0.
+    # The structure is a copy, the arrays are shared
+    found['extra'] = 1
+    again = rc.get('key')
+    assert 'extra' not in again
+    assert again['T'] is found['T']
+
+
+def test_cache_key():
+    args = {'T': np.array([300., 400.]), 'p': np.array([1.])}
+    key = cache.cache_key('state', 'mp.H2O', args)
+    assert key == cache.cache_key('state', 'mp.H2O', 
+            {'p': np.array([1.]), 'T': np.array([300., 400.])})
+    assert key != cache.cache_key('state', 'ig.N2', args)
+    assert key != cache.cache_key('state', 'mp.H2O', 
+            {'T': np.array([300., 401.]), 'p': np.array([1.])})
+    # The shape is part of the key
+    assert key != cache.cache_key('state', 'mp.H2O', 
+            {'T': np.array([[300.], [400.]]), 'p': np.array([1.])})
+
+
+def test_requests_are_cached(client):
+    rc = cache.get_result_cache()
+    rc.clear()
+    before = rc.stats()
+    url = '/state?id=mp.H2O&T=300,310,320&p=1'
+    first = client.get(url).get_json()
+    second = client.get(url).get_json()
+    assert first['data'] == second['data']
+    stats = rc.stats()
+    assert stats['hits'] == before['hits'] + 1
+    assert stats['misses'] == before['misses'] + 1
+    # Results are cached in canonical units, so other units hit too
+    client.get('/state?id=mp.H2O&T=26.85,36.85,46.85&p=1&uT=C')
+    assert rc.stats()['hits'] == before['hits'] + 2
+
+
+def test_pack_result_round_trip():
+    data = {'liquid': {'T': np.arange(3.)}, 'status': np.zeros(3, 
+            dtype=np.uint8), 'lines': [{'x': np.ones(2)}], 'n': 3, 
+            'name': 'water', 'none': None}
+    found = cache.unpack_result(cache.pack_result(data))
+    assert np.array_equal(found['liquid']['T'], data['liquid']['T'])
+    assert found['status'].dtype == np.uint8
+    assert np.array_equal(found['lines'][0]['x'], np.ones(2))
+    assert (found['n'], found['name'], found['none']) == (3, 'water', None)
+
+
+def test_shared_cache_between_instances(tmp_path):
+    filename = str(tmp_path / 'results.sqlite')
+    one = cache.SharedResultCache(filename)
+    two = cache.SharedResultCache(filename)
+    one.put('key', result(1))
+    found = two.get('key')
+    assert np.array_equal(found['T'], result(1)['T'])
+    assert two.stats()['file_hits'] == 1
+    # The second lookup is answered from memory
+    two.get('key')
+    assert two.stats()['file_hits'] == 1
+
+
+def test_shared_cache_eviction(tmp_path):
+    size = len(cache.pack_result(result(0)))
+    rc = cache.SharedResultCache(str(tmp_path / 'results.sqlite'), 
+            filebytes=10 * size)
+    for index in range(25):
+        rc._store(f'key{index:02d}', result(index), None)
+        # Each result is given a distinct access time
+        time.sleep(0.002)
+    stats = rc.stats()
+    assert stats['file_bytes'] <= stats['file_maxbytes']
+    assert stats['file_entries'] == 10
+    assert stats['evictions'] == 15
+    assert stats['errors'] == 0
+    # The least recently used results were deleted
+    conn = rc._connect()
+    keys = [key for key, in conn.execute('SELECT key FROM results')]
+    assert sorted(keys) == [f'key{index:02d}' for index in range(15, 25)]
+
+
+def test_shared_cache_survives_a_bad_file(tmp_path):
+    # A directory cannot be opened as a database
+    (tmp_path / 'results').mkdir()
+    rc = cache.SharedResultCache(str(tmp_path / 'results'))
+    rc.put('key', result(1))
+    assert rc.get('key') is not None
+    assert rc.stats()['errors'] > 0
+
+
+def run_threads(target, count):
+    threads = [threading.Thread(target=target, args=(index,)) 
+            for index in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_single_flight_coalesces():
+    sf = cache.SingleFlight()
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.1)
+        return {'T': np.zeros(1)}
+    results = [None] * 5
+    def worker(index):
+        results[index] = sf.do('key', compute)
+    run_threads(worker, 5)
+    assert len(calls) == 1
+    assert sf.coalesced == 4
+    # Every caller has its own dict
+    assert len({id(value) for value in results}) == 5
+
+
+def test_single_flight_raises_in_every_thread():
+    sf = cache.SingleFlight()
+    def compute():
+        time.sleep(0.1)
+        raise ValueError('boom')
+    errors = [None] * 3
+    def worker(index):
+        try:
+            sf.do('key', compute)
+        except ValueError as e:
+            errors[index] = e
+    run_threads(worker, 3)
+    assert all(isinstance(error, ValueError) for error in errors)
+
+
+def test_single_flight_timeout(monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'flight_timeout', 0.05)
+    sf = cache.SingleFlight()
+    calls = []
+    def compute():
+        calls.append(1)
+        time.sleep(0.3)
+        return {}
+    run_threads(lambda index: sf.do('key', compute), 2)
+    # The follower gave up waiting and computed the result itself
+    assert len(calls) == 2
+    assert sf.coalesced == 0
+
+
+@pytest.mark.skipif(cache.fcntl is None, reason='flock() is not available')
+def test_shared_cache_lock(tmp_path):
+    # flock() locks belong to an open file, so two SharedResultCache 
+    # instances in different threads exclude each other like processes
+    filename = str(tmp_path / 'results.sqlite')
+    one = cache.SharedResultCache(filename)
+    two = cache.SharedResultCache(filename)
+    held = threading.Event()
+    order = []
+    def holder():
+        with one.lock('abcdef') as waited:
+            assert not waited
+            held.set()
+            time.sleep(0.2)
+            order.append('one')
+    thread = threading.Thread(target=holder)
+    thread.start()
+    held.wait()
+    with two.lock('abcdef') as waited:
+        order.append('two')
+    thread.join()
+    assert waited
+    assert order == ['one', 'two']
+    # Keys are spread over lock files by their first characters
+    with two.lock('123456') as waited:
+        assert not waited
@@ -0,0 +1,48 @@
+"""Tests of the response encoding"""
+
+import json
+
+import numpy as np
+import pytest
+
+import pmgi
+
+
+value = {'T': np.array([300., np.nan, np.inf]), 'one': np.array([2.5]),
+        'status': np.array([0, 1, 0], dtype=np.uint8), 'name': 'water',
+        'lines': [{'x': np.arange(2.)[::-1]}], 'n': np.float64(3.),
+        'grid': np.ones((2, 2), dtype=np.float32)}
+
+
+@pytest.mark.parametrize('orjson', [True, False])
+def test_encode_json(monkeypatch, orjson):
+    if not orjson:
+        monkeypatch.setattr(pmgi, 'orjson', None)
+    elif pmgi.orjson is None:
+        pytest.skip('orjson is not installed')
+    out = json.loads(pmgi.encode_json(value, nan='null'))
+    assert out['T'] == [300., None, None]
+    assert out['one'] == 2.5
+    assert out['status'] == [0, 1, 0]
+    assert out['lines'] == [{'x': [1., 0.]}]
+    assert out['n'] == 3.
+    assert out['grid'] == [[1., 1.], [1., 1.]]
+    assert out['name'] == 'water'
+    out = json.loads(pmgi.encode_json(value, nan='null', scalars=False))
+    assert out['one'] == [2.5]
+
+
+def test_literal_nan():
+    text = pmgi.encode_json(value, nan='literal').decode()
+    assert 'NaN' in text and 'Infinity' in text
+    assert np.isnan(json.loads(text)['T'][1])
+    with pytest.raises(ValueError):
+        pmgi.encode_json(value, nan='zero')
+
+
+def test_json_nan_setting(monkeypatch, client):
+    monkeypatch.setitem(pmgi.config, 'json_nan', 'literal')
+    pmgi.get_result_cache().clear()
+    response = client.get('/state?id=mp.H2O&T=300,5000&p=1&props=T'
+            '&nan_policy=keep')
+    assert b'NaN' in response.data
@@ -0,0 +1,90 @@
+"""Tests of the entity tags and conditional GET requests"""
+
+import pytest
+
+import pmgi
+
+
+url = '/state?id=mp.H2O&T=300&p=1'
+
+
+def test_headers(client):
+    response = client.get(url)
+    assert response.status_code == 200
+    assert response.headers['ETag'].startswith('"')
+    assert response.headers['Last-Modified'] == pmgi.last_modified
+    assert response.headers['Cache-Control'] == 'public, max-age=%d' % \
+            pmgi.config['http_max_age']['state']
+    assert client.get(url).headers['ETag'] == response.headers['ETag']
+
+
+def test_if_none_match(client):
+    tag = client.get(url).headers['ETag']
+    response = client.get(url, headers={'If-None-Match': tag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == tag
+    response = client.get(url, headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+
+
+def test_if_modified_since(client):
+    response = client.get(url, 
+            headers={'If-Modified-Since': pmgi.last_modified})
+    assert response.status_code == 304
+    response = client.get(url, 
+            headers={'If-Modified-Since': 'Thu, 01 Jan 1970 00:00:00 GMT'})
+    assert response.status_code == 200
+    # If-None-Match takes precedence
+    response = client.get(url, headers={'If-None-Match': '"other"',
+            'If-Modified-Since': pmgi.last_modified})
+    assert response.status_code == 200
+
+
+def test_modified_since():
+    assert pmgi.modified_since(None)
+    assert pmgi.modified_since('not a date')
+    assert not pmgi.modified_since(pmgi.last_modified)
+
+
+@pytest.mark.parametrize('other, headers', [
+        ('/state?id=mp.H2O&T=310&p=1', {}),
+        ('/state?id=mp.H2O&T=300&p=1&uT=C', {}),
+        (url, {'Accept-Encoding': 'gzip'}),
+        (url, {'Accept': 'application/x-ndjson'}),
+        ('/state?id=mp.H2O&T=300&p=1&precision=3', {})])
+def test_distinct(client, other, headers):
+    tag = client.get(url).headers['ETag']
+    other = client.get(other, headers=headers).headers.get('ETag')
+    assert other is not None and other != tag
+
+
+@pytest.mark.parametrize('query', [
+        '/state?id=mp.H2O&T=300&p=1&dryrun=1',
+        '/state?id=mp.H2O&T=300&p=1&store=1',
+        '/state?id=mp.H2O&T=300&p=1&nothere=1',
+        '/info?cache=1',
+        '/info?admission=1'])
+def test_not_cached(client, query):
+    response = client.get(query)
+    assert 'ETag' not in response.headers
+    assert 'Cache-Control' not in response.headers
+
+
+def test_post(client):
+    response = client.post('/state', json={'id': 'mp.H2O', 'T': 300, 'p': 1})
+    assert 'ETag' not in response.headers
+
+
+def test_info(client):
+    assert client.get('/info?versions=1').headers['ETag']
+
+
+def test_before_admission(client, monkeypatch):
+    # Conditional requests are answered before they are computed
+    tag = client.get(url).headers['ETag']
+    def process(self):
+        raise AssertionError('The request was computed')
+    monkeypatch.setattr(pmgi.PropertyRequest, 'process', process)
+    response = client.get(url, headers={'If-None-Match': tag})
+    assert response.status_code == 304
@@ -0,0 +1,134 @@
+"""Tests of the isolines (compute_iso_line() and /isoline)"""
+
+import numpy as np
+import pyromat as pm
+import pytest
+
+import pmgi
+
+
+@pytest.fixture
+def counted(monkeypatch):
+    """Count the calls to evaluate_props()"""
+    calls = []
+    evaluate_props = pmgi.evaluate_props
+    def counted(subst, args, props=None):
+        calls.append(args)
+        return evaluate_props(subst, args, props)
+    monkeypatch.setattr(pmgi, 'evaluate_props', counted)
+    return calls
+
+
+@pytest.mark.parametrize('prop, value', [('T', 400.), ('p', 10.), 
+        ('s', 6.), ('h', 2800.), ('d', 100.)])
+def test_line(water, prop, value):
+    line = pmgi.compute_iso_line(water, n=25, **{prop: value})
+    ok = line['status'] == pmgi.status_ok
+    assert ok.sum() >= 20
+    # PYroMat's own iterations are converged to about 1e-5
+    assert np.allclose(line[prop][ok], value, rtol=1e-5)
+
+
+def test_saturation_crossing(water):
+    line = pmgi.compute_iso_line(water, n=25, p=1.)
+    # The saturated liquid and vapor points are inserted
+    assert line['T'].size == 27
+    assert sorted(line['x'][line['x'] >= 0]) == [0., 1.]
+
+
+def test_family_one_call(water, counted):
+    lines = pmgi.compute_iso_line(water, n=25, default=True, T=0)
+    assert len(lines) > 1
+    assert len(counted) == 1
+    values = np.ravel(pmgi.get_default_lines(water, 'T', 
+            pmgi.get_practical_limits(water)))
+    assert np.allclose([line['T'][0] for line in lines], values)
+
+
+def test_several_values(water):
+    lines = pmgi.compute_iso_line(water, n=10, h=[2800., 3000.])
+    assert len(lines) == 2
+    assert np.nanmax(np.abs(lines[1]['h'] - 3000.)) < 1e-2
+
+
+def test_errors(water):
+    with pytest.raises(pm.utility.PMParamError):
+        pmgi.compute_iso_line(water, T=300., p=1.)
+    with pytest.raises(pm.utility.PMParamError):
+        pmgi.compute_iso_line(water, zz=1.)
+
+
+def test_route(client):
+    out = client.get('/isoline?id=mp.H2O&s=6&props=T,s').get_json()
+    assert not out['message']['error']
+    assert set(out['data']) >= {'T', 's', 'status', 'index'}
+    assert np.allclose(out['data']['s'], 6.)
+    out = client.get('/isoline?id=mp.H2O&h=2800,3000&props=T,h').get_json()
+    assert len(out['data']) == 2
+
+
+def test_route_default(client):
+    out = client.get('/isoline?id=mp.H2O&p=0&default=1&props=T,p'
+            ).get_json()
+    assert not out['message']['error']
+    assert len(out['data']) > 1
+
+
+def test_solve_monotonic():
+    target = np.array([0.5, 2., 9., -1.])
+    x, iterations, failed = pmgi.solve_monotonic(
+            lambda x, index: x**3 - target[index], np.zeros(4), 
+            np.full(4, 2.))
+    assert failed.tolist() == [pmgi.status_ok] * 2 + [pmgi.status_oob] * 2
+    assert np.allclose(x[:2], np.cbrt(target[:2]), rtol=1e-9)
+    assert np.isnan(x[2:]).all()
+    assert (iterations <= pmgi.iso_max_iter).all()
+
+
+def test_solve_monotonic_kink():
+    # A kink (like a phase boundary) cannot make the solution diverge
+    F = lambda x, index: np.where(x < 1., 100. * (x - 1.), x - 1.) + 0.5
+    x, iterations, failed = pmgi.solve_monotonic(F, np.zeros(1), 
+            np.full(1, 5.))
+    assert failed[0] == pmgi.status_ok
+    assert np.isclose(x[0], 0.995)
+
+
+def test_solve_monotonic_failures():
+    F = lambda x, index: np.where(x > 1., np.nan, x - 1.5)
+    x, iterations, failed = pmgi.solve_monotonic(F, np.zeros(1), 
+            np.full(1, 2.))
+    assert failed[0] == pmgi.status_noconv
+    F = lambda x, index: np.sign(x - 1.)
+    x, iterations, failed = pmgi.solve_monotonic(F, np.zeros(1), 
+            np.full(1, 2.5))
+    assert iterations[0] <= pmgi.iso_max_iter
+
+
+@pytest.mark.parametrize('prop', ['h', 's', 'e'])
+def test_independent(water, prop):
+    values = np.ravel(pmgi.get_default_lines(water, prop, 
+            pmgi.get_practical_limits(water)))
+    direct = pmgi.compute_iso_line(water, n=15, props=['T', 'd', prop], 
+            **{prop: values})
+    independent = pmgi.compute_iso_line(water, n=15, 
+            props=['T', 'd', prop], method='independent', **{prop: values})
+    assert len(direct) == len(independent)
+    for mine, theirs in zip(independent, direct):
+        assert 'iterations' in mine
+        ok = (mine['status'] == pmgi.status_ok) & \
+                (theirs['status'] == pmgi.status_ok)
+        assert ok.sum() > 0
+        assert np.allclose(mine[prop][ok], theirs[prop][ok], rtol=1e-5)
+        assert np.allclose(mine['T'][ok], theirs['T'][ok], rtol=1e-5)
+
+
+def test_methods(client):
+    assert pmgi.iso_methods == ('direct', 'independent')
+    out = client.get('/isoline?id=mp.H2O&s=6&method=independent&props=T,s'
+            ).get_json()
+    assert not out['message']['error']
+    assert np.allclose(out['data']['s'], 6.)
+    out = client.get('/isoline?id=mp.H2O&s=6&method=continuation'
+            ).get_json()
+    assert 'Unrecognized isoline method' in out['message']['message']
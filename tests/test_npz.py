@@ -0,0 +1,93 @@
+"""Tests of the npz request and response format"""
+
+import io
+import json
+import zipfile
+
+import numpy as np
+import pytest
+
+import pmgi
+
+
+T = np.linspace(300., 400., 5)
+p = np.ones(5)
+
+
+def savez(**arrays):
+    fd = io.BytesIO()
+    np.savez(fd, **arrays)
+    return fd.getvalue()
+
+
+class Unseekable(io.RawIOBase):
+    """A file that can only be written in order, like a network stream"""
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.data += data
+        return len(data)
+
+
+def test_stored_members_are_views():
+    data = savez(T=T, p=p)
+    args = pmgi.decode_npz(data)
+    assert np.array_equal(args['T'], T)
+    assert args['T'].base is not None
+    assert not args['T'].flags.writeable
+    assert pmgi.writable(args)['T'].flags.writeable
+
+
+def test_compressed_members():
+    fd = io.BytesIO()
+    np.savez_compressed(fd, T=T, id=np.array('ig.N2'))
+    args = pmgi.decode_npz(fd.getvalue())
+    assert np.array_equal(args['T'], T)
+    assert args['id'] == 'ig.N2'
+
+
+def test_streamed_archive():
+    # Members with data descriptors have no sizes in their local headers
+    fd = Unseekable()
+    with zipfile.ZipFile(fd, 'w', compression=zipfile.ZIP_STORED) as zf:
+        for name, value in (('T', T), ('p', p)):
+            with zf.open(name + '.npy', 'w', force_zip64=True) as member:
+                np.lib.format.write_array(member, value)
+    data = bytes(fd.data)
+    assert zipfile.ZipFile(io.BytesIO(data)).infolist()[0].flag_bits & 8
+    args = pmgi.decode_npz(data)
+    assert np.array_equal(args['T'], T)
+    assert np.array_equal(args['p'], p)
+
+
+def test_args_json_member():
+    fd = io.BytesIO()
+    with zipfile.ZipFile(fd, 'w') as zf:
+        with zf.open('T.npy', 'w') as member:
+            np.lib.format.write_array(member, T)
+        zf.writestr('args.json', json.dumps({'units': {'temperature': 'C'}}))
+    args = pmgi.decode_npz(fd.getvalue())
+    assert args['units'] == {'temperature': 'C'}
+
+
+def test_bad_archives():
+    with pytest.raises(ValueError):
+        pmgi.decode_npz(b'not an archive')
+    with pytest.raises(ValueError):
+        pmgi.decode_npz(savez(T=np.array([{'a': 1}], dtype=object)))
+
+
+def test_npz_request_and_response(client):
+    response = client.post('/state?id=ig.N2&props=T,h', data=savez(T=T, p=p),
+            content_type=pmgi.npz_type, headers={'Accept': pmgi.npz_type})
+    assert response.status_code == 200
+    assert response.mimetype == pmgi.npz_type
+    with np.load(io.BytesIO(response.data)) as npz:
+        assert np.array_equal(npz['data/T'], T)
+        assert npz['data/h'].shape == (5,)
+        output = json.loads(npz['output.json'])
+    assert not output['message']['error']
@@ -0,0 +1,81 @@
+"""Tests of the chunked evaluation of large states (pool.py)"""
+
+import numpy as np
+import pyromat as pm
+import pytest
+
+import pmgi
+import pool
+
+
+@pytest.fixture
+def workers(monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'pool_workers', 2)
+    yield
+    executor = pool._state_pool
+    if executor is not None:
+        pool._reset_state_pool(executor)
+
+
+def states(n):
+    return {'T': np.linspace(300., 900., n), 'p': np.full(n, 1.)}
+
+
+def test_chunk_bounds(water):
+    chunks = list(pool.iter_state_chunks(water, states(25), chunk=10, 
+            pooled=False))
+    assert [(start, stop) for start, stop, result in chunks] == \
+            [(0, 10), (10, 20), (20, 25)]
+    for start, stop, result in chunks:
+        assert result['T'].size == stop - start
+        assert np.allclose(result['T'], states(25)['T'][start:stop])
+
+
+def test_pooled_matches_direct(workers, water):
+    args = states(50)
+    expected = pmgi.evaluate_status(water, args)
+    chunks = list(pool.iter_state_chunks(water, args, chunk=20, ahead=1))
+    assert [(start, stop) for start, stop, result in chunks] == \
+            [(0, 20), (20, 40), (40, 50)]
+    result = pool.evaluate_pooled(water, {'T': args['T'].reshape(5, 10), 
+            'p': 1.})
+    assert result['T'].shape == (5, 10)
+    for name, value in expected.items():
+        assert np.allclose(result[name].ravel(), value, equal_nan=True), name
+
+
+def test_failed_chunks(water):
+    # The first chunk is entirely out of bounds
+    args = {'T': np.concatenate([np.full(10, -1.), 
+            np.linspace(300., 400., 10)]), 'p': 1.}
+    chunks = list(pool.iter_state_chunks(water, args, chunk=10, 
+            pooled=False))
+    assert chunks[0][2] is None
+    assert np.all(chunks[1][2]['status'] == pmgi.status_ok)
+    result = pool.evaluate_pooled(water, args)
+    assert np.all(np.isnan(result['T'][:10]))
+    assert np.array_equal(result['status'], 
+            [pmgi.status_oob] * 10 + [pmgi.status_ok] * 10)
+    # Unless every chunk failed
+    with pytest.raises(pm.utility.PMParamError):
+        list(pool.iter_state_chunks(water, {'T': np.full(20, -1.), 'p': 1.},
+                chunk=10, pooled=False))
+
+
+def test_disabled_pool(monkeypatch, water):
+    monkeypatch.setitem(pmgi.config, 'pool_workers', 0)
+    assert pool.get_state_pool() is None
+    result = pool.evaluate_pooled(water, states(30))
+    assert np.all(result['status'] == pmgi.status_ok)
+
+
+def test_large_requests_use_the_pool(workers, monkeypatch, client):
+    monkeypatch.setitem(pmgi.config, 'pool_threshold', 100)
+    monkeypatch.setitem(pmgi.config, 'pool_chunk', 40)
+    pmgi.get_result_cache().clear()
+    response = client.get('/state?id=ig.N2&T=linspace(300,900,150)&p=1'
+            '&props=T,h')
+    assert response.status_code == 200
+    data = response.get_json()['data']
+    assert np.allclose(data['T'], np.linspace(300., 900., 150))
+    assert pool._state_pool is not None
@@ -0,0 +1,43 @@
+"""Tests of the precision and dtype output options"""
+
+import numpy as np
+import pytest
+
+import pmgi
+
+
+def test_round_significant():
+    value = np.array([123456., 0.00123456, -9.87654, 0., np.nan, np.inf])
+    out = pmgi.round_significant(value, 3)
+    assert out[:4].tolist() == [123000., 0.00123, -9.88, 0.]
+    assert np.isnan(out[4]) and out[5] == np.inf
+    assert repr(float(pmgi.round_significant(1./3., 4))) == '0.3333'
+
+
+def test_reduce_precision():
+    data = {'T': np.array([300.123456]), 'lines': [{'x': 1.23456}], 
+            'name': 'water', 'n': 7}
+    out = pmgi.reduce_precision(data, precision=2, dtype='float32')
+    assert out['T'].dtype == np.float32 and out['T'][0] == np.float32(300.)
+    assert out['lines'][0]['x'] == np.float32(1.2)
+    assert out['name'] == 'water' and out['n'] == 7
+    # The original data are not modified
+    assert data['T'][0] == 300.123456
+    assert pmgi.reduce_precision(data) is data
+
+
+def test_state_precision(client):
+    full = client.get('/state?id=mp.H2O&T=300&p=1').get_json()
+    out = client.get('/state?id=mp.H2O&T=300&p=1&precision=3').get_json()
+    assert not out['message']['error']
+    assert out['data']['d'] == float(f"{full['data']['d']:.3g}")
+    assert out['args']['precision'] == 3
+    assert out['data']['status'] == 0
+
+
+@pytest.mark.parametrize('query', ['precision=30', 'precision=x', 
+        'dtype=int8'])
+def test_invalid(client, query):
+    out = client.get('/state?id=mp.H2O&T=300&p=1&' + query).get_json()
+    assert out['message']['error']
+    assert out['data'] == {}
@@ -0,0 +1,51 @@
+"""Tests of the props argument"""
+
+import numpy as np
+import pytest
+
+import pmgi
+
+
+@pytest.mark.parametrize('props', [None, ['h'], ['h', 's', 'd']])
+def test_evaluate_props(water, props):
+    args = {'T': np.array([300., 500.]), 'p': np.array([1., 1.])}
+    full = water.state(**args)
+    out = pmgi.evaluate_props(water, args, props)
+    assert list(out) == list(props or full)
+    for name in out:
+        assert np.allclose(out[name], full[name])
+
+
+@pytest.mark.parametrize('query', ['props=h,s', 'props=h'])
+def test_state(client, query):
+    out = client.get('/state?id=mp.H2O&T=300&p=1&' + query).get_json()
+    names = query.split('=')[1].split(',')
+    assert list(out['data']) == names + ['status']
+    assert out['args']['props'] == names
+
+
+def test_post_list(client):
+    out = client.post('/state', json={'id': 'mp.H2O', 'T': [300, 310], 
+            'p': 1, 'props': ['h', 'd']}).get_json()
+    assert set(out['data']) == {'h', 'd', 'status'}
+    assert len(out['data']['h']) == 2
+
+
+def test_saturation(client):
+    out = client.get('/saturation?id=mp.H2O&T=373&props=p').get_json()
+    assert list(out['data']['liquid']) == ['p']
+    assert list(out['data']['vapor']) == ['p']
+
+
+def test_isoline(client):
+    out = client.get('/isoline?id=mp.H2O&T=400&props=h,s').get_json()
+    assert not out['message']['error']
+    assert {'h', 's'} <= set(out['data'])
+    assert 'd' not in out['data']
+
+
+def test_unknown(client):
+    out = client.get('/state?id=mp.H2O&T=300&p=1&props=zz').get_json()
+    assert out['message']['error']
+    assert 'Unrecognized properties: zz' in out['message']['message']
+    assert out['data'] == {}
@@ -0,0 +1,79 @@
+"""Tests of the range expressions"""
+
+import numpy as np
+import pytest
+
+import pmgi
+
+
+@pytest.mark.parametrize('text, expected', [
+        ('linspace(300, 900, 4)', np.linspace(300, 900, 4)),
+        ('linspace(1,1,1)', [1.]),
+        (' logspace(-1, 2, 4) ', [.1, 1., 10., 100.]),
+        ('arange(5)', [0., 1., 2., 3., 4.]),
+        ('arange(1, 2, 0.25)', [1., 1.25, 1.5, 1.75]),
+        ('arange(3, 0, -1)', [3., 2., 1.]),
+        ('arange(0, 1, -1)', [])])
+def test_expand(text, expected):
+    assert pmgi.isrange(text)
+    assert np.allclose(pmgi.expand_range(text), expected)
+
+
+@pytest.mark.parametrize('text, message', [
+        ('linspace(1, 2)', 'requires start, stop, and num'),
+        ('linspace(1, 2, 2.5)', 'must be a positive integer'),
+        ('logspace(1, 2, 0)', 'must be a positive integer'),
+        ('linspace(1, 2, x)', 'must be numbers'),
+        ('arange()', 'must be numbers'),
+        ('arange(1, 2, 3, 4)', 'arange() requires stop'),
+        ('arange(1, 2, 0)', 'finite and nonzero'),
+        ('arange(1, 2, nan)', 'finite and nonzero'),
+        ('range(5)', 'Not a range expression')])
+def test_invalid(text, message):
+    with pytest.raises(ValueError, match=message.replace('(', r'\(')
+            .replace(')', r'\)')):
+        pmgi.expand_range(text)
+
+
+def test_limit(monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'range_max', 10)
+    assert len(pmgi.expand_range('linspace(0, 1, 10)')) == 10
+    assert len(pmgi.expand_range('arange(10)')) == 10
+    for text in ('linspace(0, 1, 11)', 'logspace(0, 1, 11)', 'arange(11)',
+            'arange(0, 1, 0.01)'):
+        with pytest.raises(ValueError, match='more than 10 values'):
+            pmgi.expand_range(text)
+
+
+def test_isrange():
+    assert not pmgi.isrange('300,400')
+    assert not pmgi.isrange(300.)
+    assert not pmgi.isrange('@0123')
+
+
+@pytest.mark.parametrize('method', ['get', 'post'])
+def test_request(client, method):
+    if method == 'get':
+        response = client.get('/state?id=mp.H2O&T=linspace(300,400,3)&p=1')
+    else:
+        response = client.post('/state', json={'id': 'mp.H2O', 
+                'T': 'linspace(300,400,3)', 'p': 1})
+    out = response.get_json()
+    assert not out['message']['error']
+    assert out['data']['T'] == [300., 350., 400.]
+
+
+def test_request_units(client):
+    out = client.get('/state?id=mp.H2O&T=linspace(20,30,2)&p=1&uT=C'
+            ).get_json()
+    assert np.allclose(out['data']['T'], [20., 30.])
+
+
+def test_request_errors(client):
+    out = client.get('/state?id=mp.H2O&T=arange(300,400,1e-9)&p=1'
+            ).get_json()
+    assert 'may not generate more than' in out['message']['message']
+    assert out['data'] == {}
+    out = client.get('/state?id=mp.H2O&T=linspace(300,400,x)&p=1'
+            ).get_json()
+    assert 'must be numbers' in out['message']['message']
@@ -0,0 +1,110 @@
+"""Tests of response compression and the static assets"""
+
+import gzip
+import re
+import zlib
+
+import pytest
+
+import pmgi
+
+
+@pytest.mark.parametrize('accept, expected', [
+        (None, None),
+        ('', None),
+        ('gzip', 'gzip'),
+        ('gzip;q=0.5, br', 'br'),
+        ('br;q=0, gzip', 'gzip'),
+        ('*', 'br'),
+        ('*;q=0.1, br;q=0', 'gzip'),
+        ('identity', None),
+        ('gzip;q=x', None)])
+def test_negotiate_encoding(accept, expected):
+    assert pmgi.negotiate_encoding(accept, ['br', 'gzip']) == expected
+
+
+def test_etag_match():
+    assert pmgi.etag_match('"abc"', '"abc"')
+    assert pmgi.etag_match('"abc"', '"x", W/"abc"')
+    assert pmgi.etag_match('"abc"', '*')
+    assert not pmgi.etag_match('"abc"', '"abd"')
+    assert not pmgi.etag_match('"abc"', None)
+
+
+def test_compress():
+    data = b'{"x": 1}' * 200
+    assert gzip.decompress(pmgi.compress(data, 'gzip')) == data
+    assert pmgi.compress(data, 'gzip') == pmgi.compress(data, 'gzip')
+    parts = list(pmgi.compress_stream([data, data], 'gzip'))
+    # Each part can be decompressed as soon as it is received
+    decompressor = zlib.decompressobj(31)
+    assert decompressor.decompress(parts[0]) == data
+    assert gzip.decompress(b''.join(parts)) == 2 * data
+
+
+def test_compressed_response(client, monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'compress_min', 0)
+    plain = client.get('/state?id=mp.H2O&T=300,400&p=1')
+    response = client.get('/state?id=mp.H2O&T=300,400&p=1', 
+            headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    assert gzip.decompress(response.data) == plain.data
+    assert 'Content-Encoding' not in plain.headers
+
+
+def test_small_response(client):
+    response = client.get('/info?what=version', 
+            headers={'Accept-Encoding': 'gzip'})
+    assert len(response.data) < pmgi.config['compress_min']
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_folders():
+    assert {'static', 'static_joe'} <= set(pmgi.static_assets)
+    for name, assets in pmgi.static_assets.items():
+        assert assets.url == name
+        assert assets.get('nothere.js') is None
+
+
+def test_page(client):
+    response = client.get('/static_joe/index.html', 
+            headers={'Accept-Encoding': 'gzip'})
+    assert response.status_code == 200
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.headers['Cache-Control'] == 'no-cache'
+    assert response.headers['ETag']
+    page = gzip.decompress(response.data)
+    assert page == client.get('/static_joe/index.html').data
+    # The page refers to the fingerprinted files of its own folder
+    refs = re.findall(rb'\.\./(static\w*/[\w.]+)', page)
+    assert refs
+    for ref in refs:
+        assert ref.startswith(b'static_joe/')
+        assert re.search(rb'\.[0-9a-f]{10}\.\w+$', ref)
+        asset = client.get('/' + ref.decode())
+        assert asset.status_code == 200
+        assert asset.headers['Cache-Control'] == \
+                'public, max-age=31536000, immutable'
+
+
+def test_not_modified(client):
+    tag = client.get('/static_joe/index.html').headers['ETag']
+    response = client.get('/static_joe/index.html', 
+            headers={'If-None-Match': tag})
+    assert response.status_code == 304
+    assert response.data == b''
+    response = client.get('/static_joe/index.html', 
+            headers={'If-None-Match': '"other"'})
+    assert response.status_code == 200
+
+
+def test_dev_page(client):
+    response = client.get('/selector/')
+    assert response.status_code == 200
+    assert response.data == client.get('/static/selector.html').data
+
+
+def test_not_found(client):
+    assert client.get('/static_joe/nothere.png').status_code == 404
+    assert client.get('/nothere/').status_code == 404
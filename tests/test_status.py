@@ -0,0 +1,156 @@
+"""Tests of the per-element status codes and the nan_policy option"""
+
+import numpy as np
+import pyromat as pm
+import pytest
+
+import pmgi
+
+
+def test_isolated(water):
+    args = {'T': np.array([300., 350., 400., 450.]), 
+            'x': np.array([0.5, 1.5, 0.2, 0.8])}
+    result, failed = pmgi.evaluate_isolated(water, args, ('h', 'x'))
+    assert failed.tolist() == [pmgi.status_ok, pmgi.status_oob, 
+            pmgi.status_ok, pmgi.status_ok]
+    assert np.isnan(result['h'][1])
+    good = water.state(T=args['T'][[0, 2, 3]], x=args['x'][[0, 2, 3]])
+    assert np.allclose(result['h'][[0, 2, 3]], good['h'])
+
+
+def test_isolated_all_invalid(water):
+    with pytest.raises(pm.utility.PMParamError):
+        pmgi.evaluate_isolated(water, {'T': np.array([300., 400.]),
+                'x': np.array([1.5, 2.])})
+
+
+def test_isolate_max(water, monkeypatch):
+    monkeypatch.setattr(pmgi, 'isolate_max', 3)
+    x = np.full(16, 0.5)
+    x[3] = 1.5
+    result, failed = pmgi.evaluate_isolated(water, 
+            {'T': np.full(16, 350.), 'x': x})
+    # The failing half is given up once the evaluations run out
+    assert failed[3] == pmgi.status_oob
+    assert (failed[8:] == pmgi.status_ok).all()
+    assert (failed != pmgi.status_ok).sum() > 1
+
+
+def test_noconv(water, monkeypatch):
+    def evaluate_props(subst, args, props=None):
+        raise pm.utility.PMAnalysisError('Failed to converge')
+    monkeypatch.setattr(pmgi, 'evaluate_props', evaluate_props)
+    result = pmgi.evaluate_status(water, {'T': np.array([310., 301.]),
+            'p': np.array([1., 1.])})
+    assert result['status'].tolist() == [pmgi.status_noconv] * 2
+    assert np.isnan(result['h']).all()
+
+
+def test_status(water):
+    result = pmgi.evaluate_status(water, {'T': np.array([300., 20000.]),
+            'p': np.array([1., 1.])})
+    assert result['status'].dtype == np.uint8
+    assert result['status'].tolist() == [pmgi.status_ok, pmgi.status_oob]
+
+
+def test_ambiguous(water):
+    T = np.array([373.124, 400., 373.124, 500.])
+    ps = np.ravel(water.ps(T=T))
+    p = np.array([ps[0], 1., 2., ps[3]])
+    result = pmgi.evaluate_status(water, {'T': T, 'p': p}, ('h',))
+    assert result['status'].tolist() == [pmgi.status_ambiguous, 
+            pmgi.status_ok, pmgi.status_ok, pmgi.status_ambiguous]
+
+
+def test_ambiguous_screen(water, monkeypatch):
+    # States far from the saturation curve never reach subst.ps()
+    pmgi._saturation_curve(water.data['id'])
+    calls = []
+    ps = type(water).ps
+    def counted(self, *args, **kwargs):
+        calls.append(kwargs)
+        return ps(self, *args, **kwargs)
+    monkeypatch.setattr(type(water), 'ps', counted)
+    pmgi.evaluate_status(water, {'T': np.array([300., 400., 600.]), 
+            'p': np.array([1., 5., 50.])})
+    assert calls == []
+
+
+def test_drop_nan():
+    data = {'h': np.array([1., np.nan, 3.]), 
+            'status': np.array([0, 1, 3], dtype=np.uint8)}
+    out = pmgi.drop_nan(data, offset=10)
+    assert out['h'].tolist() == [1., 3.]
+    assert out['index'].tolist() == [10, 12]
+    assert out['status'].tolist() == [0, 1, 3]
+    assert data['h'].size == 3
+    nested = {'liquid': {'h': np.array([1., np.nan])}, 
+            'vapor': {'h': np.array([np.nan, 2.])}, 'name': 'dome'}
+    out = pmgi.drop_nan(nested)
+    assert out['liquid']['h'].size == 0 and out['index'].size == 0
+    assert out['name'] == 'dome'
+
+
+url = '/state?id=mp.H2O&T=300,20000&p=1&props=h'
+
+
+def test_policy_null(client):
+    out = client.get(url).get_json()
+    assert out['data']['h'][1] is None
+    assert out['data']['status'] == [pmgi.status_ok, pmgi.status_oob]
+
+
+def test_policy_drop(client):
+    out = client.get(url + '&nan_policy=drop').get_json()
+    assert out['data']['h'] == pytest.approx(112.65, abs=0.01)
+    assert out['data']['index'] == 0
+    assert out['data']['status'] == [pmgi.status_ok, pmgi.status_oob]
+    assert out['args']['nan_policy'] == 'drop'
+
+
+def test_policy_keep(client):
+    response = client.get(url + '&nan_policy=keep')
+    assert b'NaN' in response.data
+
+
+def test_policy_invalid(client):
+    out = client.get(url + '&nan_policy=zz').get_json()
+    assert 'The nan_policy must be' in out['message']['message']
+
+
+def test_invalid_element(client):
+    out = client.get('/state?id=mp.H2O&T=300,400&x=0.5,1.5&props=h,x'
+            ).get_json()
+    assert not out['message']['error']
+    assert out['data']['x'] == [0.5, None]
+    assert out['data']['status'] == [pmgi.status_ok, pmgi.status_oob]
+
+
+def test_all_invalid(client):
+    out = client.get('/state?id=mp.H2O&T=300&x=1.5').get_json()
+    assert out['message']['error']
+    assert 'Quality' in out['message']['message']
+
+
+def test_saturation_mask(client):
+    out = client.get('/saturation?id=mp.H2O&T=200,300,400').get_json()
+    assert not out['message']['error']
+    assert out['data']['liquid']['T'] == [300., 400.]
+    assert out['data']['index'] == [1, 2]
+
+
+def test_noconv_requests(client, monkeypatch):
+    def evaluate_props(subst, args, props=None):
+        raise pm.utility.PMAnalysisError('Failed to converge')
+    monkeypatch.setattr(pmgi, 'evaluate_props', evaluate_props)
+    out = client.get('/state?id=mp.H2O&T=311.5&p=1').get_json()
+    assert out['data']['status'] == pmgi.status_noconv
+    out = client.get('/state?id=mp.H2O&T=311.5,302.5&p=1').get_json()
+    assert out['data']['status'] == [pmgi.status_noconv] * 2
+    out = client.post('/batch', json={'requests': [{'route': 'state', 
+            'id': 'mp.H2O', 'T': [311.5, 302.5], 'p': 1}]}).get_json()
+    assert out['data'][0]['data']['status'] == [pmgi.status_noconv] * 2
+    response = client.get('/state?id=mp.H2O&T=311.5,302.5&p=1', 
+            headers={'Accept': pmgi.ndjson_type})
+    assert response.status_code == 200
+    assert b'"status":[2,2]' in response.data
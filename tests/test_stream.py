@@ -0,0 +1,62 @@
+"""Tests of the streamed NDJSON responses"""
+
+import json
+
+import numpy as np
+
+import pmgi
+
+
+def records(response):
+    assert response.status_code == 200
+    assert response.mimetype == pmgi.ndjson_type
+    body = response.get_data()
+    # Every record is one line, and the body ends with a newline
+    assert body.endswith(b'\n')
+    return [json.loads(line) for line in body.split(b'\n')[:-1]]
+
+
+def test_state_chunks(monkeypatch, client):
+    monkeypatch.setitem(pmgi.config, 'stream_chunk', 4)
+    pmgi.get_result_cache().clear()
+    response = client.get('/state?id=ig.N2&T=linspace(300,400,10)&p=1'
+            '&props=T,h', headers={'Accept': pmgi.ndjson_type})
+    lines = records(response)
+    assert [line['record'] for line in lines] == \
+            ['header', 'chunk', 'chunk', 'chunk', 'end']
+    assert lines[0]['units']['temperature'] == 'K'
+    chunks = lines[1:-1]
+    assert [(line['start'], line['stop']) for line in chunks] == \
+            [(0, 4), (4, 8), (8, 10)]
+    T = np.concatenate([line['data']['T'] for line in chunks])
+    assert np.allclose(T, np.linspace(300., 400., 10))
+    assert not lines[-1]['message']['error']
+
+
+def test_failed_chunks_are_reported(monkeypatch, client):
+    monkeypatch.setitem(pmgi.config, 'stream_chunk', 5)
+    pmgi.get_result_cache().clear()
+    response = client.get('/state?id=mp.H2O&T=-5,-5,-5,-5,-5,300,310&p=1'
+            '&props=T', headers={'Accept': pmgi.ndjson_type})
+    lines = records(response)
+    chunks = [line for line in lines if line['record'] == 'chunk']
+    assert [(line['start'], line['stop']) for line in chunks] == [(5, 7)]
+    assert lines[-1]['record'] == 'end'
+    assert lines[-1]['message']['message']
+
+
+def test_family_items(client):
+    response = client.get('/isoline?id=mp.H2O&p=1,10,100&props=T,p', 
+            headers={'Accept': pmgi.ndjson_type})
+    lines = records(response)
+    items = [line for line in lines if line['record'] == 'item']
+    assert [line['index'] for line in items] == [0, 1, 2]
+    assert lines[0]['record'] == 'header' and lines[-1]['record'] == 'end'
+
+
+def test_single_data_record(client):
+    response = client.get('/saturation?id=mp.H2O&T=400', 
+            headers={'Accept': pmgi.ndjson_type})
+    lines = records(response)
+    assert [line['record'] for line in lines] == ['header', 'data', 'end']
+    assert 'liquid' in lines[1]['data']
@@ -0,0 +1,90 @@
+"""Tests of the unit handling of requests"""
+
+import threading
+
+import numpy as np
+import pyromat as pm
+
+import pmgi
+
+
+def canonical():
+    return {unit: pm.config['unit_' + unit] for unit in pmgi.canonical_units}
+
+
+def test_requests_leave_the_canonical_units(client):
+    before = canonical()
+    assert before == pmgi.canonical_units
+    response = client.get('/state?id=mp.H2O&T=100&p=1&uT=C&uP=kPa')
+    assert response.status_code == 200
+    assert response.get_json()['units']['temperature'] == 'C'
+    response = client.post('/state', json={'id': 'ig.N2', 'T': 500, 
+            'p': 1, 'units': {'temperature': 'F', 'pressure': 'psi'}})
+    assert response.status_code == 200
+    assert canonical() == before
+
+
+def test_other_requests_leave_the_canonical_units(client):
+    from test_asgi import call
+    before = canonical()
+    response = client.post('/batch', json={'units': {'temperature': 'F'},
+            'requests': [{'route': 'state', 'id': 'mp.H2O', 'T': 80, 'p': 1}]})
+    assert response.status_code == 200
+    assert canonical() == before
+    response = client.get('/state?id=mp.H2O&T=100,110&p=1&uT=C',
+            headers={'Accept': pmgi.ndjson_type})
+    assert response.status_code == 200
+    assert canonical() == before
+    status, headers, body = call('GET', '/state', b'id=ig.N2&T=30&p=1&uT=C')
+    assert status == 200
+    assert canonical() == before
+
+
+def test_concurrent_unit_systems():
+    # Each thread asks for the same state in its own temperature units
+    results = {}
+    def worker(unit):
+        client = pmgi.app.test_client()
+        for _ in range(5):
+            response = client.get(f'/state?id=ig.N2&T=300&p=1&uT={unit}'
+                    '&props=T,h')
+            results.setdefault(unit, []).append(
+                    response.get_json()['data']['T'])
+    threads = [threading.Thread(target=worker, args=(unit,)) 
+            for unit in ('K', 'C', 'F')]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # T=300 is read in each unit system, so it comes back unchanged
+    for unit, values in results.items():
+        assert np.allclose(values, 300.), unit
+    assert canonical() == pmgi.canonical_units
+
+
+def test_conversion_matches_pyromat(water):
+    conversion = pmgi.get_conversion(water, {'temperature': 'C', 
+            'pressure': 'kPa', 'energy': 'J', 'matter': 'kmol'})
+    T = np.array([300., 400., 500.])
+    result = water.state(T=T, p=1.)
+    converted = pmgi.convert_units(result, conversion)
+    assert np.allclose(converted['T'], T - 273.15)
+    assert np.allclose(converted['p'], 100.)
+    # kJ/kg to J/kmol
+    assert np.allclose(converted['h'], result['h'] * 1e3 * water.mw())
+    back = pmgi.convert_units(converted, conversion, inverse=True)
+    for name in ('T', 'p', 'h', 's', 'd'):
+        assert np.allclose(back[name], result[name])
+
+
+def test_canonical_units_need_no_conversion(water):
+    assert pmgi.get_conversion(water, {}) == {}
+    data = {'T': np.array([300.])}
+    assert pmgi.convert_units(data, {}) is data
+
+
+def test_arguments_are_converted(client):
+    kelvin = client.get('/state?id=mp.H2O&T=373.15&p=1&props=h').get_json()
+    celsius = client.get('/state?id=mp.H2O&T=100&p=100&uT=C&uP=kPa'
+            '&props=h').get_json()
+    assert np.isclose(kelvin['data']['h'], celsius['data']['h'])
@@ -0,0 +1,112 @@
+"""Tests of the workspace and its handles"""
+
+import time
+
+import numpy as np
+import pytest
+
+import pmgi
+import workspace
+
+
+@pytest.fixture(autouse=True)
+def fresh(monkeypatch):
+    """Give every test an empty workspace"""
+    monkeypatch.setattr(workspace, '_workspace', None)
+
+
+def test_store_fetch():
+    value = np.array([300., 400., 500.])
+    handle = workspace.store_array(value)
+    assert workspace.ishandle(handle) and len(handle) == 17
+    # The handle depends only on the contents
+    assert workspace.store_array(value.copy()) == handle
+    assert workspace.store_array(value + 1.) != handle
+    found = workspace.fetch_array(handle)
+    assert np.array_equal(found, value)
+    assert not found.flags.writeable
+    assert workspace.fetch_array('@nothere') is None
+
+
+def test_ishandle():
+    assert workspace.ishandle('@0123')
+    assert not workspace.ishandle('300')
+    assert not workspace.ishandle(np.array(['@0123']))
+
+
+def test_store_invalid(monkeypatch):
+    with pytest.raises(ValueError):
+        workspace.store_array(np.array([{}, 1]))
+    monkeypatch.setitem(pmgi.config, 'workspace_bytes', 100)
+    assert workspace.store_array(np.zeros(100)) is None
+
+
+def test_ttl(monkeypatch):
+    handle = workspace.store_array([1., 2.], ttl=10.)
+    now = time.time()
+    monkeypatch.setattr(time, 'time', lambda: now + 11.)
+    assert workspace.fetch_array(handle) is None
+    # The ttl cannot exceed the default
+    monkeypatch.setattr(time, 'time', lambda: now)
+    handle = workspace.store_array([1., 2.], ttl=1e9)
+    monkeypatch.setattr(time, 'time', 
+            lambda: now + pmgi.config['workspace_ttl'] + 1.)
+    assert workspace.fetch_array(handle) is None
+
+
+def test_store_arrays():
+    data = {'T': np.array([1., 2.]), 'lines': [{'x': np.arange(3.)}],
+            'name': 'water'}
+    out = workspace.store_arrays(data)
+    assert workspace.ishandle(out['T']) and workspace.ishandle(
+            out['lines'][0]['x'])
+    assert out['name'] == 'water'
+    assert np.array_equal(workspace.fetch_array(out['lines'][0]['x']), 
+            np.arange(3.))
+
+
+def test_route(client):
+    out = client.post('/workspace', json={'T': [300, 400, 500], 
+            'p': [1, 2, 4], 'ttl': 1e9}).get_json()
+    assert not out['message']['error']
+    handles = out['data']['handles']
+    assert out['data']['ttl'] == pmgi.config['workspace_ttl']
+    out = client.get('/state?id=mp.H2O&T=%s&p=%s' % (handles['T'], 
+            handles['p'])).get_json()
+    assert not out['message']['error']
+    direct = client.post('/state', json={'id': 'mp.H2O', 
+            'T': [300, 400, 500], 'p': [1, 2, 4]}).get_json()
+    assert out['data'] == direct['data']
+    out = client.get('/workspace?fetch=' + handles['T']).get_json()
+    assert out['data']['arrays'] == {handles['T']: [300., 400., 500.]}
+
+
+def test_route_errors(client, monkeypatch):
+    out = client.get('/workspace?fetch=@nothere').get_json()
+    assert 'Workspace handle not found: @nothere' in out['message']['message']
+    out = client.get('/state?id=mp.H2O&T=@nothere&p=1').get_json()
+    assert out['message']['error'] and out['data'] == {}
+    out = client.post('/workspace', json={'T': [300], 'ttl': 0}).get_json()
+    assert 'The ttl must be positive' in out['message']['message']
+    monkeypatch.setitem(pmgi.config, 'workspace_bytes', 100)
+    response = client.post('/workspace', json={'T': list(range(100))})
+    assert response.status_code == 413
+
+
+def test_store_result(client):
+    out = client.get('/state?id=mp.H2O&T=300,400&p=1&store=1').get_json()
+    assert not out['message']['error']
+    handle = out['data']['h']
+    assert workspace.ishandle(handle)
+    direct = client.get('/state?id=mp.H2O&T=300,400&p=1').get_json()
+    out = client.get('/workspace?fetch=' + handle).get_json()
+    assert out['data']['arrays'][handle] == direct['data']['h']
+
+
+def test_shared(tmp_path, monkeypatch):
+    monkeypatch.setitem(pmgi.config, 'workspace_file', 
+            str(tmp_path / 'workspace.db'))
+    handle = workspace.store_array([1., 2.])
+    # Another process would open the same file
+    monkeypatch.setattr(workspace, '_workspace', None)
+    assert np.array_equal(workspace.fetch_array(handle), [1., 2.])